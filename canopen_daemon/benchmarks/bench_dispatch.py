@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    bench_dispatch
+
+    Microbenchmark measuring the dispatch overhead per command of the
+    canopen_daemon (lookup, parameter decoding, node lookup and locking).
+    The built-in commands are re-registered with a no-op handler,
+    so no CAN bus is needed.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from command_registry import registry, Command, CommandRegistry, DaemonContext
+import daemon_commands
+
+# Number of dispatches per command
+ITERATIONS = 100000
+
+# Parameters sent with each command
+SAMPLE_PARAMETERS = {
+    'node_id': 0x03,
+    'index': 0x6011,
+    'subindex': 0x01,
+    'mode': 'expedited',
+    'data': 0x1A2B3C4D,
+    'EDS': 'SimNode/SimNode.eds',
+    'new_state': 'OPERATIONAL',
+    'can_id': 0x1AF,
+    'timeout': 1,
+}
+
+
+def _noop(ctx, req):
+    return {}
+
+
+def main():
+    # Same parameter specs, locks and node lookups as the built-in commands
+    bench_registry = CommandRegistry()
+    for name in registry.names():
+        builtin = registry.get(name)
+        bench_registry.add(Command(name, _noop, builtin.params, builtin.lock, builtin.resolve_node))
+
+    # Network with a single (fake) node - only the lookup is measured
+    ctx = DaemonContext({0x03: object()})
+
+    print('%-28s %12s' % ('command', 'ns/dispatch'))
+    for name in bench_registry.names():
+        if name == 'turn_off':
+            continue
+        duration = timeit.timeit(lambda: bench_registry.dispatch(ctx, name, SAMPLE_PARAMETERS),
+                                 number=ITERATIONS)
+        print('%-28s %12.0f' % (name, duration / ITERATIONS * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    bench_eds_cache
+
+    Startup-time benchmark of the EDS cache against the 20_EDS corpus
+    (plain EDS files and EDS files within the example ZIP archives):
+    parsing from scratch, loading the pickled form from disk (daemon restart)
+    and in-memory hits (further add_node calls with the same EDS).
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from od_cache import ObjectDictionaryCache
+
+EDS_DIR = os.path.join(os.path.dirname(__file__), '../../20_EDS')
+
+# add_node calls per EDS file for the in-memory measurement (i.e. nodes sharing one EDS)
+NODES_PER_EDS = 30
+
+
+def _collect(target_dir):
+    # Plain EDS files plus the ones extracted from the ZIP archives
+    paths = glob.glob(os.path.join(EDS_DIR, '**', '*.eds'), recursive=True)
+    for archive in glob.glob(os.path.join(EDS_DIR, '**', '*.[zZ][iI][pP]'), recursive=True):
+        with zipfile.ZipFile(archive) as zip_file:
+            for name in zip_file.namelist():
+                if name.lower().endswith('.eds'):
+                    paths.append(zip_file.extract(name, target_dir))
+    return sorted(paths)
+
+
+def _load_all(cache, paths, node_ids=(1,)):
+    loaded = []
+    started = time.perf_counter()
+    for path in paths:
+        for node_id in node_ids:
+            try:
+                cache.get(path, node_id)
+            except Exception as e:
+                print('  skipped %s: %s' % (os.path.basename(path), e))
+                break
+        else:
+            loaded.append(path)
+    return loaded, time.perf_counter() - started
+
+
+def main():
+    with tempfile.TemporaryDirectory() as target_dir:
+        paths = _collect(os.path.join(target_dir, 'eds'))
+        cache_dir = os.path.join(target_dir, 'cache')
+        print('%d EDS files in %s' % (len(paths), os.path.abspath(EDS_DIR)))
+
+        cold = ObjectDictionaryCache(cache_dir)
+        paths, parse_time = _load_all(cold, paths)
+        print('%-34s %10.1f ms' % ('parse (cold start)', parse_time * 1e3))
+
+        restarted = ObjectDictionaryCache(cache_dir)
+        _, disk_time = _load_all(restarted, paths)
+        print('%-34s %10.1f ms   (%d loaded from disk)' % ('pickled (daemon restart)', disk_time * 1e3,
+                                                        restarted.disk_hits))
+
+        node_ids = range(1, NODES_PER_EDS + 1)
+        shared = ObjectDictionaryCache()
+        _, shared_time = _load_all(shared, paths, node_ids)
+        print('%-34s %10.1f ms   (%d parsed, %d hits)' % ('%d nodes per EDS (in memory)' % NODES_PER_EDS,
+                                                          shared_time * 1e3, shared.misses, shared.hits))
+        print('%-34s %10.1f ms' % ('%d nodes per EDS (no cache, est.)' % NODES_PER_EDS,
+                                   parse_time * NODES_PER_EDS * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    bench_pdo_decode
+
+    Decoding throughput (frames/second) of a TPDO mapping 0x6011sub1/sub2
+    of SimNode.eds (as mapped by 1A00): generic access to every mapped
+    variable via python-canopen, the compiled decoder per frame and the
+    compiled decoder on a batch of buffered frames. No CAN bus is needed.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import canopen
+
+import pdo_decoder
+
+SIM_EDS_PATH = os.path.join(os.path.dirname(__file__), '../../20_EDS/SimNode/SimNode.eds')
+
+# Frames decoded per measurement
+FRAMES = 100000
+
+
+def _measure(name, decode, payloads):
+    started = time.perf_counter()
+    decode(payloads)
+    duration = time.perf_counter() - started
+    print('%-28s %12.0f frames/s' % (name, len(payloads) / duration))
+
+
+def main():
+    node = canopen.RemoteNode(0x03, SIM_EDS_PATH)
+    pdo_map = node.tpdo[1]
+    pdo_map.clear()
+    pdo_map.add_variable(0x6011, 1)
+    pdo_map.add_variable(0x6011, 2)
+    pdo_map.cob_id = 0x183
+    decoder = pdo_decoder.compile_map(pdo_map)
+    print('mapping %s compiled to %r (numpy: %s)' % ([pdo_decoder.variable_key(*key) for key in decoder.keys],
+                                                     decoder.struct.format,
+                                                     pdo_decoder.numpy is not None))
+
+    payloads = [bytes(random.getrandbits(8) for _ in range(8)) for _ in range(FRAMES)]
+
+    def generic(payloads):
+        for payload in payloads:
+            pdo_map.data = bytearray(payload)
+            [var.raw for var in pdo_map.map]
+
+    def compiled(payloads):
+        for payload in payloads:
+            decoder.decode(payload)
+
+    def batch(payloads):
+        decoder.decode_batch(payloads)
+
+    _measure('python-canopen variables', generic, payloads)
+    _measure('compiled struct', compiled, payloads)
+    _measure('compiled batch', batch, payloads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    bench_subscribe_latency
+
+    Latency benchmark of subscribe_next_msg on a virtual CAN bus:
+    time from sending a frame until the waiting subscription returns,
+    for the event-driven Subscription and for the former 100 ms poll loop.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+import os
+import sys
+import threading
+import time
+
+import can
+import canopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from subscriptions import Subscription
+
+# Number of frames per measurement
+ROUNDS = 50
+
+# Concurrent subscriptions (to different CAN-IDs) per round
+CONCURRENT = 8
+
+# Virtual channel shared by daemon and stimulus bus
+CHANNEL = 'bench_subscribe'
+
+
+def _event_wait(subscription, timeout):
+    subscription.wait(timeout)
+
+
+def _poll_wait(subscription, timeout):
+    # Former implementation: poll every 100 ms
+    time_waited = 0
+    while not subscription.received and time_waited <= timeout:
+        time.sleep(0.1)
+        time_waited = time_waited + 0.1
+
+
+def _measure(network, stimulus_bus, wait):
+    latencies = []
+    for i in range(ROUNDS):
+        subscriptions = [Subscription(network, 0x100 + n) for n in range(CONCURRENT)]
+        returned = [None] * CONCURRENT
+
+        def waiter(n):
+            wait(subscriptions[n], 1.0)
+            returned[n] = time.perf_counter()
+
+        for subscription in subscriptions:
+            subscription.subscribe()
+        threads = [threading.Thread(target=waiter, args=(n,)) for n in range(CONCURRENT)]
+        for thread in threads:
+            thread.start()
+        # Let the waiters block before the frames are sent
+        time.sleep(0.005 + 0.01 * (i % 10) / 10)
+        sent = time.perf_counter()
+        for n in range(CONCURRENT):
+            stimulus_bus.send(can.Message(arbitration_id=0x100 + n, data=[i & 0xFF], is_extended_id=False))
+        for thread in threads:
+            thread.join()
+        for subscription in subscriptions:
+            subscription.unsubscribe()
+        latencies.extend(t - sent for t in returned)
+    latencies.sort()
+    return latencies
+
+
+def _report(name, latencies):
+    mean = sum(latencies) / len(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print('%-14s mean %8.3f ms   p99 %8.3f ms   max %8.3f ms' % (
+        name, mean * 1e3, p99 * 1e3, latencies[-1] * 1e3))
+
+
+def main():
+    network = canopen.Network()
+    network.connect(bustype='virtual', channel=CHANNEL)
+    stimulus_bus = can.interface.Bus(bustype='virtual', channel=CHANNEL)
+    try:
+        print('%d rounds with %d concurrent subscriptions' % (ROUNDS, CONCURRENT))
+        _report('event-driven', _measure(network, stimulus_bus, _event_wait))
+        _report('poll 100 ms', _measure(network, stimulus_bus, _poll_wait))
+    finally:
+        stimulus_bus.shutdown()
+        network.disconnect()
+
+
+if __name__ == '__main__':
+    main()
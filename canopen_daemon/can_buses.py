@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    can_buses
+
+    The CAN buses (channels) managed by the canopen_daemon. Each bus has its own
+    canopen.Network, notifier thread, frame recorder, scanner and SDO engine,
+    so throughput scales with the number of channels. Requests select a bus via
+    the 'bus' parameter - without it, the first configured bus is used.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import canopen
+import can
+
+from command_registry import registry, DaemonContext, CommandError
+from frame_recorder import FrameRecorder
+from network_scanner import NetworkScanner
+from sdo_engine import SdoEngine
+from sdo_stream import SdoStreams
+from pdo_cache import PdoValueCache
+from sync_producer import SyncProducer
+from periodic_tasks import PeriodicTasks
+from emcy_monitor import EmcyMonitor
+from heartbeat_monitor import HeartbeatMonitor
+
+# ================================================================================
+class CanBus(object):
+    """ One CAN interface with its network, notifier and command state """
+
+    def __init__(self, name, bustype, channel, bitrate=250000, recorder_capacity=100000, streamer=None,
+                 **shared):
+        """
+        :param str name:
+            Name used in the 'bus' parameter of requests.
+        :param str bustype:
+            python-can interface, i.e. 'socketcan' or 'pcan'.
+        :param channel:
+            Channel of the interface, i.e. 'can0' or 'PCAN_USBBUS1'.
+        :param int bitrate:
+            Bit rate of the bus.
+        :param streamer:
+            :class:`frame_stream.FrameStreamer` shared by all buses (optional).
+        :param shared:
+            Additional state shared by all buses (i.e. od_cache, stop event).
+        """
+        self.name = name
+        self.bustype = bustype
+        self.channel = channel
+        self.bitrate = bitrate
+
+        # Create network and assign it to the bus
+        self.network = canopen.Network()
+        self.network.bus = can.interface.Bus(bustype=bustype, channel=channel, bitrate=bitrate)
+
+        # Set notifier - one receive thread per bus
+        self.network.notifier = can.Notifier(self.network.bus, self.network.listeners, 1)
+
+        # Record all CAN frames for later queries
+        self.recorder = FrameRecorder(recorder_capacity)
+        self.network.notifier.add_listener(self.recorder)
+
+        # Stream filtered CAN frames to subscribers
+        self.streamer = streamer
+        if streamer is not None:
+            self.network.notifier.add_listener(streamer.listener(name))
+
+        # EMCYs of all nodes - history and push to subscribers
+        self.emcy_monitor = EmcyMonitor(name, streamer)
+        self.network.notifier.add_listener(self.emcy_monitor)
+
+        # Heartbeats of all nodes - NMT state table, state changes and heartbeat loss pushed to subscribers
+        self.heartbeat_monitor = HeartbeatMonitor(name, streamer)
+        self.network.notifier.add_listener(self.heartbeat_monitor)
+
+        # SYNC producer - observes the SYNC frames on the bus as well
+        self.sync_producer = SyncProducer(self.network, bustype)
+        self.network.notifier.add_listener(self.sync_producer)
+
+        # Cyclic raw CAN frames
+        self.periodic_tasks = PeriodicTasks(self.network, bustype)
+
+        # Pipelined SDO transfers - one per node, all nodes of the bus in flight at once
+        self.sdo_engine = SdoEngine(self.network, heartbeat_monitor=self.heartbeat_monitor)
+
+        # Chunked block transfers spanning several requests
+        self.sdo_streams = SdoStreams(self.sdo_engine)
+
+        self.context = DaemonContext(self.network, bus=self, recorder=self.recorder, streamer=streamer,
+                                     network_scanner=NetworkScanner(self.network, bitrate),
+                                     sdo_engine=self.sdo_engine, sdo_streams=self.sdo_streams,
+                                     pdo_cache=PdoValueCache(),
+                                     sync_producer=self.sync_producer,
+                                     periodic_tasks=self.periodic_tasks,
+                                     emcy_monitor=self.emcy_monitor,
+                                     heartbeat_monitor=self.heartbeat_monitor, **shared)
+
+    def execute(self, cmd, parameters):
+        """ Execute a command on this bus - returns reply_cmd and reply_parameters
+
+        Commands run in the thread of the caller (a front end worker), serialized only by the node /
+        named locks of the commands - a long wait (i.e. subscribe_next_msg) never blocks other requests.
+        """
+        return registry.dispatch(self.context, cmd, parameters)
+
+    def info(self):
+        return {'name': self.name, 'bustype': self.bustype, 'channel': self.channel, 'bitrate': self.bitrate,
+                'nodes': sorted(self.network.keys()),
+                'recorded': self.recorder.recorded, 'sdo': self.sdo_engine.stats()}
+
+    def shutdown(self):
+        self.sdo_streams.close_all()
+        self.sync_producer.stop()
+        self.periodic_tasks.stop()
+        self.heartbeat_monitor.stop()
+        # Disconnect network from CAN bus
+        self.network.disconnect()
+
+
+# ================================================================================
+class CanBuses(object):
+    """ All buses of the daemon, by name """
+
+    def __init__(self):
+        self._buses = {}
+        self.default = None
+
+    def add(self, bus):
+        if bus.name in self._buses:
+            raise ValueError('bus %s is configured twice' % bus.name)
+        self._buses[bus.name] = bus
+        if self.default is None:
+            self.default = bus
+        # Every bus context knows all buses (i.e. for batches spanning several buses)
+        bus.context.buses = self
+        return bus
+
+    def get(self, name=None):
+        """ Return the bus selected by the 'bus' parameter of a request """
+        if name is None:
+            return self.default
+        try:
+            return self._buses[name]
+        except KeyError:
+            raise CommandError('unknown bus %s' % name)
+
+    def __iter__(self):
+        return iter(self._buses.values())
+
+    def __len__(self):
+        return len(self._buses)
+
+    def shutdown(self):
+        for bus in self:
+            bus.shutdown()
@@ -22,12 +22,23 @@ import logging
 import os
 import struct
 import json
+import threading
+import sys
+import collections
 
 import canopen
 import can
 
 import zmq
 
+from command_registry import load_plugins
+import daemon_commands
+import wire_protocol
+from frame_stream import FrameStreamer
+from od_cache import ObjectDictionaryCache
+from can_buses import CanBus, CanBuses
+from shard_broker import ShardBroker
+
 # Print debug infos ??
 DEBUG = False
 
@@ -37,38 +48,78 @@ SIM_NETWORK = True
 # EDS Path - Used for SimNode only
 SIM_EDS_PATH = os.path.join(os.path.dirname(__file__), '../20_EDS/SimNode/SimNode.eds')
 
-# Variables
-stop_daemon = False
-nodes = {}
-subscribe_msg_count = 0
-subscribe_msg_id = 0
-subscribe_msg_data = []
-subscribe_msg_timestamp = 0
-time_waited = 0
+# Directory of pickled EDS files for fast restarts (None = parse on every start)
+EDS_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.eds_cache')
 
-# ================================================================================
-# Additional Functions
+# Directory of columnar exports (recorder_export / pdo_export with output = 'file')
+EXPORT_DIR = os.path.join(os.path.dirname(__file__), '.exports')
 
-# Define simple callbackfunction for receiving message of specific ID
-def _recv_callback(can_id, data, timestamp):
-    global subscribe_msg_count, subscribe_msg_id, subscribe_msg_data, subscribe_msg_timestamp
-    if DEBUG:
-        print('CAN-ID: ', hex(can_id), ' - Data: ', data, '- Timestamp: ', timestamp)
-    if subscribe_msg_count == 0:
-        subscribe_msg_count = 1
-        subscribe_msg_id = can_id
-        subscribe_msg_data = list(data)
-        subscribe_msg_timestamp = timestamp
-    else:
-        # other msgs than the first will be ignored, but still handled
-        pass
+# Bit rate of the CAN buses
+BITRATE = 250000
+
+# CAN buses managed by the daemon - requests select one via the 'bus' parameter (default: first bus)
+# Each bus has its own network and notifier thread - commands run in the worker threads below
+BUSES = [
+    # {'name': 'can0', 'bustype': 'socketcan', 'channel': 'can0', 'bitrate': BITRATE},
+    {'name': 'can0', 'bustype': 'pcan', 'channel': 'PCAN_USBBUS1', 'bitrate': BITRATE},
+    # {'name': 'can1', 'bustype': 'pcan', 'channel': 'PCAN_USBBUS3', 'bitrate': BITRATE},
+]
+
+# Number of worker threads serving requests concurrently (waiting for the buses)
+WORKER_COUNT = 16
+
+# First message of a worker - it is idle and waits for a request
+WORKER_READY = b'\x01'
+
+# Endpoint of the PUB socket streaming filtered CAN frames
+STREAM_ENDPOINT = "tcp://*:5556"
 
+# Number of CAN frames kept by the frame recorder
+RECORDER_CAPACITY = 100000
+
+# Plugin modules registering additional commands
+PLUGINS = []
+
+# Sharded mode - one daemon process per bus behind a broker on the same endpoints
+SHARDED = False
+
+# Local endpoints between broker and shards (sharded mode only)
+SHARD_ENDPOINT = "tcp://127.0.0.1:5557"
+SHARD_STREAM_ENDPOINT = "tcp://127.0.0.1:5558"
+
+# Name of the bus served by this process, if started as shard by the broker (--shard <name>)
+shard_name = None
+default_bus_name = BUSES[0]['name']
+if '--shard' in sys.argv:
+    shard_name = sys.argv[sys.argv.index('--shard') + 1]
+    BUSES = [bus_config for bus_config in BUSES if bus_config['name'] == shard_name]
 
 # ================================================================================
 # Init ZMQ
 context = zmq.Context()
-socket = context.socket(zmq.REP)
-socket.bind("tcp://*:5555")
+
+if SHARDED and shard_name is None:
+    # This process only runs the broker - every bus is served by its own process (this script with --shard)
+    print('CANopen - Daemon starting shards for buses: %s' % ', '.join(bus['name'] for bus in BUSES))
+    broker = ShardBroker(context, "tcp://*:5555", SHARD_ENDPOINT, STREAM_ENDPOINT, SHARD_STREAM_ENDPOINT,
+                         [bus['name'] for bus in BUSES], [sys.executable, os.path.abspath(__file__)])
+    broker.run()
+    context.term()
+    sys.exit(0)
+
+if shard_name is None:
+    # ROUTER front end for the clients
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind("tcp://*:5555")
+else:
+    # Shard - requests are routed by the broker (identity = bus name)
+    frontend = context.socket(zmq.DEALER)
+    frontend.setsockopt(zmq.IDENTITY, shard_name.encode('utf-8'))
+    frontend.connect(SHARD_ENDPOINT)
+# ROUTER back end handing each request to an idle worker (load balancing - a worker blocked
+# in a long command never gets a request queued, while others are idle)
+backend = context.socket(zmq.ROUTER)
+backend.bind("inproc://workers")
 
 # ================================================================================
 # Init CANopen
@@ -77,20 +128,27 @@ socket.bind("tcp://*:5555")
 if DEBUG:
     logging.basicConfig(level=logging.DEBUG)
 
-# Create bus (using SocketCAN, can0 and a bit rate of 250 kB/s)
-# can_bus = can.interface.Bus(bustype='socketcan', channel='can0', bitrate=250000)
-can_bus = can.interface.Bus(bustype='pcan', channel='PCAN_USBBUS1', bitrate=250000)
+# Stream filtered CAN frames of all buses to subscribers (via the broker in the sharded mode)
+if shard_name is None:
+    streamer = FrameStreamer(context, STREAM_ENDPOINT)
+else:
+    streamer = FrameStreamer(context, SHARD_STREAM_ENDPOINT, bind=False, public_endpoint=STREAM_ENDPOINT)
 
-# Create network
-network = canopen.Network()
+# Parsed EDS files, shared by all nodes
+od_cache = ObjectDictionaryCache(EDS_CACHE_DIR)
 
-# Assign network to previoulyly created bus
-network.bus = can_bus
+# State shared by all buses
+stop_daemon = threading.Event()
 
-# Set notifier
-network.notifier = can.Notifier(network.bus, network.listeners, 1)
+# Create buses - each with its own network and notifier
+buses = CanBuses()
+for bus_config in BUSES:
+    buses.add(CanBus(recorder_capacity=RECORDER_CAPACITY, streamer=streamer, od_cache=od_cache,
+                     export_dir=EXPORT_DIR, stop=stop_daemon, sim_node=None, **bus_config))
 
 # ================================================================================
+# SimNode lives on the first bus (in the sharded mode: in the shard of the first bus)
+SIM_NETWORK = SIM_NETWORK and shard_name in (None, default_bus_name)
 if SIM_NETWORK:
     # Create SimNode with NodeID = 0x03 for testing
     print('Setting up test environment with SimNode - node_id = 0x03 ...')
@@ -99,10 +157,10 @@ if SIM_NETWORK:
 
     # Connect network_sim to same CAN bus (but may different channel !!)
     # network_sim.connect(channel='can0', bustype='socketcan', bitrate=250000)
-    network_sim.connect(bustype='pcan', channel='PCAN_USBBUS2', bitrate=250000)
+    network_sim.connect(bustype='pcan', channel='PCAN_USBBUS2', bitrate=BITRATE)
 
     # Create simulated nodes (via network_sim) > called "local"
-    localSimNode_0x03 = network_sim.create_node(0x03, SIM_EDS_PATH)
+    localSimNode_0x03 = network_sim.create_node(0x03, od_cache.get(SIM_EDS_PATH, 0x03))
 
     # Set Index 0x1000-Subindex 0x00, which is scanned by scanner.search()
     # Set in EDS file - localSimNode_0x03.sdo[0x1000].raw = 0x00000022
@@ -115,292 +173,102 @@ if SIM_NETWORK:
     localSimNode_0x03.sdo[0x6011][0x01].raw = 0x1A2B3C4D
     localSimNode_0x03.sdo[0x6011][0x02].raw = 0x5E6FAABB
 
+    # SimNode is connected to the first bus
+    buses.default.context.sim_node = localSimNode_0x03
+
     print('Test environment with SimNode ready ...')
 
 # ================================================================================
-# Main (will be left via a CMD)
-print('CANopen - Daemon ready to receive messages ...')
-keep_running = True
-while stop_daemon == False:
-    
-    # ================================================================================
-    #  Wait for next request from client
-    message = socket.recv_string(encoding='utf-8')
-    print("Received message: %s" % message)
+# Init commands
+daemon_commands.DEBUG = DEBUG
+load_plugins(PLUGINS)
+
+# Decode one request, execute it and encode the reply (in the encoding of the request)
+def _handle_request(frames):
+    encoding = wire_protocol.request_encoding(frames)
+    opcode = None
+    try:
+        cmd, parameters, opcode = wire_protocol.decode_request(encoding, frames)
+        print("Received message (%s): %s" % (encoding, cmd))
+
+        # DEBUG Pretty print parameters
+        if DEBUG:
+            print('Message contained CMD value: ', cmd, ' - executing command')
+            print(parameters)
 
-    # Parse string as JSON
-    message_dict = json.loads(message)
+        # Route the request to its bus (executed in this worker thread)
+        bus = buses.get(parameters.get('bus', None))
+        reply_cmd, reply_parameters = bus.execute(cmd, parameters)
+    except Exception as e:
+        # A failing request must still be answered, otherwise the client's REQ socket is stuck
+        reply_cmd = 'err: %s' % e
+        reply_parameters = {}
 
-    # DEBUG Pretty print JSON
     if DEBUG:
-        print(json.dumps(message_dict, indent = 4, sort_keys=True))
-    
-    if 'cmd' in message_dict:
-        if DEBUG:
-            print('Message contained CMD value: ', message_dict['cmd'], ' - executing command')
-        cmd = message_dict.get('cmd', '')
-        parameters = message_dict.get('parameters', None)
-    else:
-        if DEBUG:
-            print('Message contained NO CMD value - ignoring message')
-        cmd = ''
-        parameters: None
-
-    # Prepare reply (with data that makes not writing correct response data obvious)
-    reply_cmd = 'err: no reply written for case'
-    reply_parameters = {}
-
-    # ===========================================================
-    # Stop daemon
-    if cmd == 'turn_off':
-        # stop daemon
-        stop_daemon = True
-        reply_cmd = 'turn_off'
-
-    # ===========================================================
-    # Add node
-    elif cmd == 'add_node':
-        # Add remote node to CANopen network
-        node_id = parameters.get('node_id', 0x00)
-        EDS = parameters.get('EDS', '')
-        EDS_PATH = os.path.join(os.path.dirname(__file__), '../20_EDS/', EDS)
-        if node_id != 0 and EDS != '':
-            nodes[node_id] = network.add_node(node_id, EDS_PATH)
-            if DEBUG:
-                print('Addind remote node: ', hex(node_id))
-                print(nodes)
-            reply_cmd = 'add_node'
-            reply_parameters['node_id'] = node_id
-        else:
-            reply_cmd = 'err: node_id CANNOT be zero OR EDS cannot be empty'
-
-    # ===========================================================
-    # Scanner
-    elif cmd == 'scanner':
-        # Scan network with scanner via Index 0x1000 Subindex 0x00
-        network.scanner.search()
-        # Wait for nodes to respond
-        time.sleep(1)
-        if DEBUG:
-            for node_id in network.scanner.nodes:
-                print('Found node: ', hex(node_id))
-        reply_cmd = 'scanner'
-        reply_parameters = network.scanner.nodes
-
-    # ===========================================================
-    # Control NMT
-    elif cmd == 'nmt_change_state':
-        node_id = parameters.get('node_id', 0x00)
-        new_state = parameters.get('new_state', 'INITIALISING')
-        network[node_id].nmt.state = new_state
-        reply_cmd = cmd
-        reply_parameters['node_id'] = node_id
-        reply_parameters['new_state'] = new_state
-
-    # ===========================================================
-    # SDO Upload
-    elif cmd == 'sdo_upload':
-        node_id = parameters.get('node_id', 0x00)
-        index = parameters.get('index', 0x0000)
-        subindex = parameters.get('subindex', 0x00)
-        mode = parameters.get('mode', 'expedited')
-        if node_id != 0x00 and index != 0x0000:
-            if mode == 'expedited' or mode == 'segmented':
-                obj = network[node_id].sdo[index]
-                if isinstance(obj, canopen.sdo.Variable):
-                    value =  obj.raw
-                else:
-                    value = obj[subindex].raw
-            elif mode == 'block-filelike':
-                # Upload large data (binary) via BLOCK transfer from the node via file-like access
-                fp = network[node_id].sdo.open(index, subindex, 'rb', block_transfer=True) # rb = read binary
-                value = fp.read()
-                fp.close()
+        print(reply_cmd, reply_parameters)
+    return wire_protocol.encode_reply(encoding, reply_cmd, reply_parameters, opcode)
+
+# Worker thread - announces itself as idle, then serves one request after the other
+def _worker():
+    socket = context.socket(zmq.REQ)
+    socket.connect("inproc://workers")
+    try:
+        socket.send(WORKER_READY)
+        while True:
+            frames = socket.recv_multipart(copy=False)
+            # Routing envelope of the client up to the empty delimiter frame (as stripped by a REP socket)
+            delimiter = next((position for position, frame in enumerate(frames) if not len(frame.buffer)), None)
+            if delimiter is None:
+                reply = frames[:1] + [b''] + wire_protocol.encode_reply('json', 'err: no envelope delimiter', {})
             else:
-                pass
-            reply_cmd = cmd
-            reply_parameters['index'] = index
-            reply_parameters['subindex'] = subindex
-            reply_parameters['value'] = value
-        else:
-            reply_cmd = 'err: node_id CANNOT be zero OR index CANNOT be zero'
-
-    # ===========================================================
-    # SDO Download
-    elif cmd == 'sdo_download':
-        node_id = parameters.get('node_id', 0x00)
-        index = parameters.get('index', 0x0000)
-        subindex = parameters.get('subindex', 0x00)
-        mode = parameters.get('mode', 'expedited')
-        data = parameters.get('data', '')
-        if node_id != 0x00 and index != 0x0000:
-            if mode == 'expedited' or mode == 'segmented':
-                obj = network[node_id].sdo[index]
-                if isinstance(obj, canopen.sdo.Variable):
-                    network[node_id].sdo[index].raw = data
-                else:
-                    network[node_id].sdo[index][subindex].raw = data
-            else:
-                # Download large data via BLOCK transfer from the node via file-like access
-                fp = network[node_id].sdo.open(index, subindex, 'wb', block_transfer=True)
-                fp.write(data)
-                fp.close()
-            reply_cmd = cmd
-            reply_parameters['index'] = index
-            reply_parameters['subindex'] = subindex
-            reply_parameters['success'] = 0x01 # Permanently TRUE (= 0x01)
-        else:
-            reply_cmd = 'err: node_id CANNOT be zero OR index CANNOT be zero'
-
-    # ===========================================================
-    # Read active EMCYs
-    elif cmd == 'emcys_read_active':
-        node_id = parameters.get('node_id', 0x00)
-        if node_id != 0x00:
-            value = network[node_id].emcy.active
-            value_str = str(network[node_id].emcy.active)
-            reply_cmd = cmd
-            reply_parameters['node_id'] = node_id
-            reply_parameters['value'] = value_str
-        else:
-            reply_cmd = 'err: node_id CANNOT be zero'
-    
-    # ===========================================================
-    # Read log EMCYs
-    elif cmd == 'emcys_read_log':
-        node_id = parameters.get('node_id', 0x00)
-        if node_id != 0x00:
-            value = network[node_id].emcy.log
-            value_str = str(network[node_id].emcy.log)
-            reply_cmd = cmd
-            reply_parameters['node_id'] = node_id
-            reply_parameters['value'] = value_str
-        else:
-            reply_cmd = 'err: node_id CANNOT be zero'
-
-    # ===========================================================
-    # Read next msg with specific CAN-ID
-    elif cmd == 'subscribe_next_msg':
-        can_id = parameters.get('can_id', 0x00000000)
-        timeout = parameters.get('timeout', 3)
-        subscribe_msg_count = 0
-        subscribe_msg_id = 0
-        subscribe_msg_data = []
-        subscribe_msg_timestamp = 0
-        time_waited = 0
-        network.subscribe(can_id, _recv_callback)
-        while subscribe_msg_count != 1 and time_waited <= timeout:
-            time.sleep(0.1)
-            time_waited = time_waited + 0.1
-        network.unsubscribe(can_id, _recv_callback)
-        reply_cmd = cmd
-        if subscribe_msg_count == 1:
-            reply_parameters['subscribe_msg_id'] = subscribe_msg_id
-            reply_parameters['subscribe_msg_data'] = subscribe_msg_data
-            reply_parameters['subscribe_msg_timestamp'] = subscribe_msg_timestamp
-        else:
-            reply_parameters['note'] = 'incorrect number of msgs received'
-
-    # ===========================================================
-    # Activate periodic SYNC
-    elif cmd == 'sync_activate_periodic':
-        sync_period = parameters.get('sync_period', 5)
-        network.sync.start(period=sync_period)
-        reply_cmd = cmd
-        reply_parameters['sync_period'] = sync_period
-
-    # ===========================================================
-    # Deactivate periodic SYNC
-    elif cmd == 'sync_deactivate_periodic':
-        network.sync.stop()
-        reply_cmd = cmd
-
-    # ===========================================================
-    # Send raw CAN message
-    elif cmd == 'can_send_msg':
-        can_id = parameters.get('can_id', 0x00000000)
-        can_bytes = parameters.get('can_bytes', [0xAB, 0xCD, 0xEF, 0x00, 0xAB, 0xCD, 0xEF, 0x99])
-        network.send_message(can_id, can_bytes)
-        reply_cmd = cmd
-        reply_parameters['can_id'] = can_id
-        reply_parameters['can_bytes'] = can_bytes
-
-    # ===========================================================
-    # Trigger EMCY
-    elif cmd == 'emcys_trigger_sim':
-        localSimNode_0x03.emcy.send(0x3001, register=4, data=b"Under")
-        reply_cmd = cmd
-        reply_parameters['node_id'] = node_id
-        reply_parameters['value'] = 'triggered'
-
-    # ===========================================================
-    # Clear EMCY
-    elif cmd == 'emcys_reset_sim':
-        localSimNode_0x03.emcy.reset(register=4, data=b"CLEAR")
-        reply_cmd = cmd
-        reply_parameters['value'] = 'reset'
-    
-    # ===========================================================
-    # ===========================================================
-    # UNTESTED !!!!
-    # ===========================================================
-    # Config TX-PDO
-    elif cmd == 'pdo_config_tx':
-        node_id = parameters.get('node_id', 0x00)
-        pdo_number = parameters.get('pdo_number', 1)
-        trans_type = parameters.get('trans_type', 0xFF)
-        event_timer = parameters.get('event_timer', 1500)
-        enabled = parameters.get('enabled', False)
-
-        network[node_id].tpdo.read()
-        network[node_id].tpdo[pdo_number].clear()
-        network[node_id].tpdo[pdo_number].add_variable(0x6011, 1)
-        network[node_id].tpdo[pdo_number].add_variable(0x6011, 2)
-        network[node_id].tpdo[pdo_number].trans_type = 1
-        network[node_id].tpdo[pdo_number].event_timer = 10
-        network[node_id].tpdo[pdo_number].enabled = True
-        # Save new PDO configuration to node
-        network[node_id].tpdo[pdo_number].save()
-
-        reply_cmd = cmd
-        reply_parameters['node_id'] = node_id
-        reply_parameters['pdo_number'] = pdo_number
-        reply_parameters['trans_type'] = trans_type
-        reply_parameters['event_timer'] = event_timer
-        reply_parameters['enable'] = enabled
-
-    # ===========================================================
-    # Start TX-PDO
-    elif cmd == 'pdo_start_tx':
-        node_id = parameters.get('node_id', 0x00)
-        pdo_number = parameters.get('pdo_number', 1)
-        period = parameters.get('period', 5)
-
-        network[node_id].tpdo.read()
-        # Start TX-PDO
-        network[node_id].tpdo[pdo_number].start(period=period)
-
-        reply_cmd = cmd
-        reply_parameters['node_id'] = node_id
-        reply_parameters['pdo_number'] = pdo_number
-        reply_parameters['period'] = period
-    
-    # ===========================================================
-    # ===========================================================
-    # Unknown CMD
-    else:
-        reply_cmd = 'unknown_cmd'
-
-    result = {}
-    result['reply_cmd'] = reply_cmd
-    result['reply_parameters'] = reply_parameters
+                reply = frames[:delimiter + 1] + _handle_request(frames[delimiter + 1:])
+            socket.send_multipart(reply, copy=False)
+    except zmq.ContextTerminated:
+        pass
+    socket.close()
 
-    if DEBUG:
-        print(result)
-    socket.send_string(json.dumps(result), encoding='utf-8')
+# ================================================================================
+# Main (will be left via a CMD)
+workers = []
+for i in range(WORKER_COUNT):
+    worker = threading.Thread(target=_worker, name='worker-%d' % i, daemon=True)
+    worker.start()
+    workers.append(worker)
 
-# Disconnect networks from CAN bus
-network.disconnect()
+print('CANopen - Daemon ready to receive messages ...')
+# Requests are only taken from the front end while a worker is idle - until then they wait in ZMQ
+poll_all = zmq.Poller()
+poll_all.register(frontend, zmq.POLLIN)
+poll_all.register(backend, zmq.POLLIN)
+poll_workers = zmq.Poller()
+poll_workers.register(backend, zmq.POLLIN)
+idle_workers = collections.deque()
+pending_requests = 0
+while True:
+    # Shuttle requests to idle workers and replies back to the clients
+    # (poll with timeout, so a turn_off request is noticed)
+    events = dict((poll_all if idle_workers else poll_workers).poll(100))
+    if backend in events:
+        # [worker, b'', WORKER_READY] or [worker, b'', envelope ..., b'', reply ...]
+        frames = backend.recv_multipart(copy=False)
+        idle_workers.append(frames[0].bytes)
+        if len(frames) > 3:
+            frontend.send_multipart(frames[2:], copy=False)
+            pending_requests -= 1
+    if frontend in events and idle_workers:
+        backend.send_multipart([idle_workers.popleft(), b''] + frontend.recv_multipart(copy=False), copy=False)
+        pending_requests += 1
+    if stop_daemon.is_set() and pending_requests == 0:
+        # Stop only once no reply is pending anymore, so the turn_off reply is delivered
+        break
+
+frontend.close(linger=1000)
+backend.close()
+streamer.stop()
+context.term()
+
+# Disconnect networks from CAN buses
+buses.shutdown()
 
 if SIM_NETWORK:
     network_sim.disconnect()
@@ -21,6 +21,10 @@ import json
 
 import zmq
 
+import wire_protocol
+import frame_stream
+import frame_burst
+
 DEBUG = False
 
 context = zmq.Context()
@@ -47,31 +51,72 @@ def send_cmd(cmd, parameters):
 
     return reply_dict
 
+def send_cmd_binary(encoding, cmd, parameters, opcode=None):
+    print('--------')
+    # Send CMD as binary frames ('msgpack' or 'struct')
+    print('Request (%s): %s %s' % (encoding, cmd, parameters))
+    socket.send_multipart(wire_protocol.encode_request(encoding, cmd, parameters, opcode))
+
+    # Receive cmd Response (in the same encoding)
+    reply_dict = wire_protocol.decode_reply(socket.recv_multipart())
+    print('Reply: %s' % (reply_dict))
+
+    return reply_dict
+
 #  Socket to talk to server
 print('Connecting to canopen_daemon at tcp://localhost:5555 …')
 socket = context.socket(zmq.REQ)
 socket.connect('tcp://localhost:5555')
 
-reply_dict = send_cmd('add_node', {'node_id': 0x03, 'EDS': 'SimNode/SimNode.eds'})
+# Buses of the daemon - requests without 'bus' parameter go to the default bus
+reply_dict = send_cmd('bus_list', {})
+
+# Health and CPU load of the daemon process serving the bus (one process per bus in the sharded mode)
+reply_dict = send_cmd('shard_stats', {'bus': 'can0'})
+
+reply_dict = send_cmd('add_node', {'node_id': 0x03, 'EDS': 'SimNode/SimNode.eds', 'bus': 'can0'})
 
 reply_dict = send_cmd('nmt_change_state', {'node_id': 0x03, 'new_state': 'INITIALISING'})
 time.sleep(1)
 
 reply_dict = send_cmd('sdo_download', {'node_id': 0x03, 'index': 0x1017, 'subindex': 0x00, 'mode': 'expedited', 'data': 2500})
 
+# Heartbeat loss is detected after 1.5 x 2500 ms (state changes / loss pushed on topics 'event.nmt' / 'event.heartbeat')
+reply_dict = send_cmd('heartbeat_expect', {'node_id': 0x03, 'period_ms': 2500})
+
 reply_dict = send_cmd('nmt_change_state', {'node_id': 0x03, 'new_state': 'PRE-OPERATIONAL'})
 time.sleep(1)
 
-reply_dict = send_cmd('pdo_start_tx', {'node_id': 0x03, 'pdo_number':1, 'period': 2.5})
+# TPDO1 maps 0x6011sub1/sub2, sent every 100 ms - received values are cached by the daemon
+reply_dict = send_cmd('pdo_config_tx', {'node_id': 0x03, 'pdo_number': 1, 'mapping': [[0x6011, 1], [0x6011, 2]],
+                                        'trans_type': 0xFE, 'event_timer': 100})
 time.sleep(1)
 
-reply_dict = send_cmd('pdo_start_tx', {'node_id': 0x03, 'pdo_number':2, 'period': 4.5})
+reply_dict = send_cmd('pdo_start_tx', {'node_id': 0x03, 'pdo_number': 2, 'operational': False})
 time.sleep(1)
 
-reply_dict = send_cmd('nmt_change_state', {'node_id': 0x03, 'new_state': 'OPERATIONAL'})
+# Returns as soon as the heartbeat of the node confirms the new state (at most 3 s)
+reply_dict = send_cmd('nmt_change_state', {'node_id': 0x03, 'new_state': 'OPERATIONAL', 'wait': 3.0})
+
+reply_dict = send_cmd('nmt_wait_state', {'node_id': 0x03, 'state': 'OPERATIONAL', 'timeout': 3.0})
+
+# Fleet NMT: one frame per listed node, one confirmation window for all (per-node results)
+reply_dict = send_cmd('nmt_change_states', {'node_ids': [0x03, 0x04, 0x05], 'new_state': 'PRE-OPERATIONAL',
+                                            'wait': 3.0})
+
+# Broadcast (node 0) - confirmed by all nodes with a current heartbeat
+reply_dict = send_cmd('nmt_change_states', {'new_state': 'OPERATIONAL', 'wait': 3.0})
+
+# NMT state, liveness and heartbeat period of all nodes seen on the bus
+reply_dict = send_cmd('nmt_states', {})
+
+# Latest value from the PDO cache (no bus traffic), fails if older than 0.5 s
+reply_dict = send_cmd('pdo_read_cached', {'node_id': 0x03, 'index': 0x6011, 'subindex': 1, 'max_age': 0.5})
 time.sleep(1)
 
-reply_dict = send_cmd('scanner', {})
+reply_dict = send_cmd('scanner', {'expected': [0x03]})
+
+reply_dict = send_cmd('scan_nodes', {'expected': [0x03], 'identity': True})
 
 reply_dict = send_cmd('sync_activate_periodic', {'sync_period': 1.5})
 
@@ -81,6 +126,12 @@ reply_dict = send_cmd('sdo_upload', {'node_id': 0x03, 'index': 0x1008, 'subindex
 
 reply_dict = send_cmd('sdo_upload', {'node_id': 0x03, 'index': 0x1018, 'subindex': 0x04, 'mode': 'expedited'})
 
+# Same object of several nodes - the transfers run concurrently (about one round trip)
+reply_dict = send_cmd('sdo_upload_nodes', {'node_ids': [0x03], 'index': 0x1000, 'subindex': 0x00})
+
+# Latencies, adaptive timeout and circuit breaker state of the node
+reply_dict = send_cmd('sdo_stats', {'node_id': 0x03})
+
 # Object is RO to arhere to CiA profile standards
 # reply_dict = send_cmd('sdo_download', {'node_id': 0x03, 'index': 0x1008, 'subindex': 0x00, 'mode': 'segmented', 'data': 'embeX Node - ID 0x03'})
 
@@ -100,6 +151,23 @@ time.sleep(5)
 
 reply_dict = send_cmd('sdo_download', {'node_id': 0x03, 'index': 0x6011, 'subindex': 0x02, 'mode': 'expedited', 'data': 0xBBFFAAFF})
 
+# 1000 frames with one request (packed binary), paced to 50 % bus load
+burst = frame_burst.pack_frames([(0x600 + (i % 127) + 1, [0x40, 0x00, 0x10, 0x00]) for i in range(1000)])
+reply_dict = send_cmd_binary('struct', 'can_send_burst', {'bus_load': 0.5, 'frames': burst},
+                             wire_protocol.OP_CAN_BURST)
+if 'msgpack' in send_cmd('wire_protocols', {})['reply_parameters']['encodings']:
+    # msgpack replies carry sent, errors and the achieved rate
+    reply_dict = send_cmd_binary('msgpack', 'can_send_burst', {'bus_load': 0.5, 'frames': burst})
+
+# Heartbeat emulation of node 0x7F (operational) every 100 ms - sent by the daemon without further requests
+reply_dict = send_cmd('can_start_periodic', {'name': 'hb_0x7F', 'can_id': 0x77F, 'can_bytes': [0x05], 'period': 0.1})
+reply_dict = send_cmd('can_update_periodic', {'name': 'hb_0x7F', 'can_bytes': [0x7F]})
+reply_dict = send_cmd('can_list_periodic', {})
+reply_dict = send_cmd('can_stop_periodic', {'name': 'hb_0x7F'})
+
+# Achieved SYNC period (jitter, overruns)
+reply_dict = send_cmd('sync_stats', {})
+
 reply_dict = send_cmd('sync_deactivate_periodic', {})
 time.sleep(10)
 
@@ -107,8 +175,18 @@ reply_dict = send_cmd('emcys_read_active', {'node_id': 0x03})
 
 reply_dict = send_cmd('emcys_read_log', {'node_id': 0x03})
 
+# EMCYs are pushed on the stream socket (topic 'event.emcy') - no polling needed
+event_socket = context.socket(zmq.SUB)
+event_socket.connect('tcp://localhost:5556')
+event_socket.setsockopt(zmq.SUBSCRIBE, b'event.emcy')
+time.sleep(0.2)
+
 reply_dict = send_cmd('emcys_trigger_sim', {})
-time.sleep(1)
+if event_socket.poll(1000):
+    kind, event = frame_stream.decode_event(event_socket.recv_multipart())
+    print('Event %s: node 0x%02X code 0x%04X register 0x%02X' % (kind, event['node_id'], event['code'],
+                                                                event['register']))
+event_socket.close()
 
 reply_dict = send_cmd('emcys_read_active', {'node_id': 0x03})
 
@@ -121,8 +199,93 @@ reply_dict = send_cmd('emcys_read_active', {'node_id': 0x03})
 
 reply_dict = send_cmd('emcys_read_log', {'node_id': 0x03})
 
+# EMCYs of all nodes of the last minute within a code range (0x3xxx = voltage)
+reply_dict = send_cmd('emcy_query', {'code_min': 0x3000, 'code_max': 0x3FFF, 'last': 60.0})
+
 reply_dict = send_cmd('subscribe_next_msg', {'can_id': 0x1AF, 'timeout': 15})
 
 reply_dict = send_cmd('can_send_msg', {'can_id': 0x00F, 'can_bytes': [0x00, 0x00, 0xFF, 0xFF, 0x00, 0x00, 0xFF, 0xFF]})
 
+# Hot path: SDO read / write as fixed struct frames (plain bytes, no JSON)
+reply_dict = send_cmd_binary('struct', 'sdo_upload', {'node_id': 0x03, 'index': 0x6011, 'subindex': 0x01},
+                             wire_protocol.OP_SDO_UPLOAD)
+
+reply_dict = send_cmd_binary('struct', 'sdo_download', {'node_id': 0x03, 'index': 0x6011, 'subindex': 0x01,
+                                                        'data': b'\x4D\x3C\x2B\x1A'}, wire_protocol.OP_SDO_DOWNLOAD)
+
+# Same request via msgpack (if available on the daemon)
+reply_dict = send_cmd('wire_protocols', {})
+if 'msgpack' in reply_dict['reply_parameters']['encodings']:
+    reply_dict = send_cmd_binary('msgpack', 'sdo_upload', {'node_id': 0x03, 'index': 0x1008, 'subindex': 0x00,
+                                                           'mode': 'segmented'})
+
+# Large DOMAIN objects chunk by chunk (SDO block transfer) - one binary frame per chunk, bounded memory
+# Needs a node with SDO block transfer and a DOMAIN object, i.e. the program data 0x1F50 of a CiA 302-3
+# bootloader - SimNode (python-canopen's SDO server) supports neither, so the examples are commented out
+# image = bytes(range(256)) * 256
+# reply_dict = send_cmd('sdo_stream_open', {'node_id': 0x03, 'index': 0x1F50, 'subindex': 0x01,
+#                                           'direction': 'download', 'size': len(image)})
+# if reply_dict['reply_cmd'] == 'sdo_stream_open':
+#     stream_id = reply_dict['reply_parameters']['stream_id']
+#     for offset in range(0, len(image), 16384):
+#         send_cmd_binary('struct', 'sdo_stream_write', {'stream_id': stream_id, 'data': image[offset:offset + 16384]},
+#                         wire_protocol.OP_SDO_STREAM_WRITE)
+#     # Progress and throughput (bytes/s); after an error: sdo_stream_resume, then continue at 'transferred'
+#     reply_dict = send_cmd('sdo_stream_status', {'stream_id': stream_id})
+#     reply_dict = send_cmd('sdo_stream_close', {'stream_id': stream_id})
+
+# reply_dict = send_cmd('sdo_stream_open', {'node_id': 0x03, 'index': 0x1F50, 'subindex': 0x01, 'direction': 'upload'})
+# if reply_dict['reply_cmd'] == 'sdo_stream_open':
+#     stream_id = reply_dict['reply_parameters']['stream_id']
+#     data = b''
+#     while True:
+#         reply_dict = send_cmd_binary('struct', 'sdo_stream_read', {'stream_id': stream_id, 'size': 16384},
+#                                      wire_protocol.OP_SDO_STREAM_READ)
+#         if reply_dict['status'] != wire_protocol.STATUS_OK:
+#             break
+#         data += reply_dict['payload']
+#         if len(reply_dict['payload']) < 16384:
+#             break
+#     reply_dict = send_cmd('sdo_stream_close', {'stream_id': stream_id})
+
+# Firmware update of several nodes (image file on the daemon host) - buses in parallel, per-node throughput
+# (targets: [[bus, node_id], ...] for nodes on other buses than the one of the request)
+# reply_dict = send_cmd('flash_firmware', {'image': '/opt/firmware/dut_v2.bin', 'node_ids': [0x03], 'program': 1})
+
+# Stream all TPDOs of node 0x03 (0x183, 0x283) - filtered within the daemon
+reply_dict = send_cmd('stream_add_filter', {'name': 'tpdo_0x03', 'can_id': 0x083, 'mask': 0x0FF})
+stream_socket = context.socket(zmq.SUB)
+stream_socket.connect('tcp://localhost:5556')
+stream_socket.setsockopt(zmq.SUBSCRIBE, b'can.tpdo_0x03')
+if stream_socket.poll(5000):
+    name, sequence, dropped, frames = frame_stream.decode_batch(stream_socket.recv_multipart())
+    print('Stream %s - batch %d with %d frames (%d dropped): %s' % (name, sequence, len(frames), dropped, frames))
+stream_socket.close()
+reply_dict = send_cmd('stream_stats', {})
+reply_dict = send_cmd('stream_remove_filter', {'name': 'tpdo_0x03'})
+
+# Everything received on 0x1AF within the last 2 s (no new subscription needed)
+reply_dict = send_cmd('recorder_query', {'can_ids': [0x1AF], 'last': 2.0})
+
+# Last minute of TPDO1 as columns: .npy files on the daemon side (numpy.load(file, mmap_mode='r'))
+reply_dict = send_cmd('pdo_export', {'node_id': 0x03, 'pdo_number': 1, 'last': 60.0, 'output': 'file',
+                                     'name': 'tpdo1_0x03'})
+
+# Recorded frames as binary columns within the reply - msgpack sends them as attachment frames
+if 'msgpack' in send_cmd('wire_protocols', {})['reply_parameters']['encodings']:
+    reply_dict = send_cmd_binary('msgpack', 'recorder_export', {'last': 60.0})
+
+# Full parameter dump of the node, compared with a golden snapshot (serial number ignored)
+reply_dict = send_cmd('od_snapshot', {'node_id': 0x03})
+golden = reply_dict['reply_parameters']['snapshot']
+reply_dict = send_cmd('od_snapshot', {'node_id': 0x03, 'golden': golden, 'ignore': ['1018:04']})
+
+# Several SDO uploads in one round trip
+reply_dict = send_cmd('batch', {'stop_on_error': False, 'commands': [
+    build_msg('sdo_upload', {'node_id': 0x03, 'index': 0x1000, 'subindex': 0x00, 'mode': 'expedited'}),
+    build_msg('sdo_upload', {'node_id': 0x03, 'index': 0x6001, 'subindex': 0x01, 'mode': 'expedited'}),
+    build_msg('sdo_upload', {'node_id': 0x03, 'index': 0x6011, 'subindex': 0x01, 'mode': 'expedited'}),
+    build_msg('sdo_upload', {'node_id': 0x03, 'index': 0x6011, 'subindex': 0x02, 'mode': 'expedited'}),
+]})
+
 reply_dict = send_cmd('turn_off', {})
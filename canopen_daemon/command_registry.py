@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    command_registry
+
+    Registry mapping each command name of the canopen_daemon to a handler.
+    Parameters of a request are validated and decoded once into a typed
+    request struct (using __slots__), which is then handed to the handler.
+
+    Plugins register additional commands by importing this module and using
+    the command() decorator - the main loop of the daemon does not change.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import importlib
+import threading
+
+
+# ================================================================================
+class CommandError(Exception):
+    """ Raised for invalid requests - answered with reply_cmd 'err: <message>' """
+
+
+# ================================================================================
+class Param(object):
+    """ Description of a single parameter of a command """
+
+    __slots__ = ('name', 'default', 'convert', 'nonzero', 'choices')
+
+    def __init__(self, name, default=None, convert=None, nonzero=False, choices=None):
+        """
+        :param str name:
+            Key of the parameter within 'parameters' of the request.
+        :param default:
+            Value used, if the parameter is missing.
+        :param convert:
+            Callable converting the raw JSON value (i.e. int, float, str).
+        :param boolean nonzero:
+            Reject the request, if the value is zero / empty.
+        :param choices:
+            Tuple of allowed values.
+        """
+        self.name = name
+        self.default = default
+        self.convert = convert
+        self.nonzero = nonzero
+        self.choices = choices
+
+    def decode(self, parameters):
+        value = parameters.get(self.name, self.default)
+        if self.convert is not None and value is not None:
+            try:
+                value = self.convert(value)
+            except (TypeError, ValueError):
+                raise CommandError('%s has an invalid value: %r' % (self.name, value))
+        if self.nonzero and not value:
+            raise CommandError('%s CANNOT be zero' % self.name)
+        if self.choices is not None and value not in self.choices:
+            raise CommandError('%s must be one of %s' % (self.name, ', '.join(map(str, self.choices))))
+        return value
+
+
+# ================================================================================
+class Request(object):
+    """ Base class of the request structs - one subclass (with __slots__) per command """
+
+    __slots__ = ('cmd', 'node')
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# ================================================================================
+class Command(object):
+    """ Handler object of a single command """
+
+    __slots__ = ('name', 'handler', 'params', 'lock', 'resolve_node', 'sdo', 'request_type')
+
+    def __init__(self, name, handler, params=(), lock=None, resolve_node=False, sdo=False):
+        """
+        :param str name:
+            Command name, as sent in 'cmd' of the request.
+        :param handler:
+            Callable handler(context, request) returning the reply_parameters.
+        :param params:
+            Tuple of :class:`Param` describing the parameters.
+        :param lock:
+            None, 'node' (serialize per node_id) or the name of a shared lock.
+        :param boolean resolve_node:
+            Look up network[node_id] once and store it as request.node.
+        :param boolean sdo:
+            The handler talks to the SDO server of node_id directly (not via the SDO engine) -
+            rejected while a block transfer holds it. Checked with the lock held.
+        """
+        self.name = name
+        self.handler = handler
+        self.params = tuple(params)
+        self.lock = lock
+        self.resolve_node = resolve_node
+        self.sdo = sdo
+        self.request_type = type(
+            'Request_' + name, (Request,), {'__slots__': tuple(p.name for p in self.params)})
+
+    def decode(self, context, parameters):
+        """ Validate and decode the raw parameters into a request struct """
+        request = self.request_type()
+        request.cmd = self.name
+        request.node = None
+        for param in self.params:
+            setattr(request, param.name, param.decode(parameters))
+        if self.resolve_node:
+            try:
+                request.node = context.network[request.node_id]
+            except KeyError:
+                raise CommandError('node 0x%02X has not been added' % request.node_id)
+        return request
+
+    def lock_for(self, context, request):
+        if self.lock is None:
+            return None
+        if self.lock == 'node':
+            # SDO traffic to one node never blocks another node
+            return context.lock(('node', request.node_id))
+        return context.lock(self.lock)
+
+    def _run(self, context, request):
+        if self.sdo:
+            context.check_sdo(request.node_id)
+        return self.handler(context, request)
+
+    def execute(self, context, request):
+        lock = self.lock_for(context, request)
+        if lock is None:
+            return self._run(context, request)
+        with lock:
+            return self._run(context, request)
+
+
+# ================================================================================
+class CommandRegistry(object):
+    """ Maps command names to :class:`Command` objects """
+
+    def __init__(self):
+        self._commands = {}
+
+    def add(self, command):
+        if command.name in self._commands:
+            raise ValueError('command %s is already registered' % command.name)
+        self._commands[command.name] = command
+        return command
+
+    def register(self, name, params=(), lock=None, resolve_node=False, sdo=False):
+        """ Decorator registering handler(context, request) as command 'name' """
+        def decorator(handler):
+            self.add(Command(name, handler, params, lock, resolve_node, sdo))
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self._commands.get(name)
+
+    def names(self):
+        return sorted(self._commands)
+
+    def __contains__(self, name):
+        return name in self._commands
+
+    def dispatch(self, context, cmd, parameters):
+        """ Decode and execute a request - returns reply_cmd and reply_parameters """
+        command = self._commands.get(cmd)
+        if command is None:
+            return 'unknown_cmd', {}
+        try:
+            request = command.decode(context, parameters)
+            reply_parameters = command.execute(context, request)
+        except CommandError as e:
+            return 'err: %s' % e, {}
+        if reply_parameters is None:
+            reply_parameters = {}
+        return command.name, reply_parameters
+
+
+# ================================================================================
+class DaemonContext(object):
+    """ State of the daemon shared by all command handlers """
+
+    def __init__(self, network, **kwargs):
+        self.network = network
+        self.nodes = {}
+        self.stop = threading.Event()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # Additional state (i.e. the simulated node)
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def lock(self, key):
+        """ Return the lock for key, created on first use """
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def check_sdo(self, node_id):
+        """ Raise CommandError, if an SDO stream holds the SDO server of node_id """
+        sdo_streams = getattr(self, 'sdo_streams', None)
+        if sdo_streams is not None:
+            try:
+                sdo_streams.check_node(node_id)
+            except IOError as e:
+                raise CommandError(str(e))
+
+
+# ================================================================================
+# Default registry used by the daemon and its plugins
+registry = CommandRegistry()
+command = registry.register
+
+
+def load_plugins(module_names):
+    """ Import plugin modules - each registers its commands on import """
+    return [importlib.import_module(name) for name in module_names]
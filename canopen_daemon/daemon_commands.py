@@ -0,0 +1,1002 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    daemon_commands
+
+    Built-in commands of the canopen_daemon, registered on import
+    with the default command registry.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import time
+import os
+import struct
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import canopen
+from canopen.nmt import NMT_COMMANDS
+
+from command_registry import registry, command, CommandError, Param
+import wire_protocol
+from subscriptions import Subscription
+import frame_stream
+import od_snapshot
+import pdo_decoder
+import timeseries_export
+import sync_producer
+import frame_burst
+import sdo_stream
+import firmware_flash
+import heartbeat_monitor
+
+# Print debug infos ??
+DEBUG = False
+
+# Base directory of the EDS files referenced by add_node
+EDS_DIR = os.path.join(os.path.dirname(__file__), '../20_EDS/')
+
+# SDO transfer modes
+SDO_MODES = ('expedited', 'segmented', 'block-filelike')
+
+# NMT states reported by heartbeats
+NMT_STATES = tuple(heartbeat_monitor.NMT_STATES.values())
+
+# Number of threads executing the sub-commands of a batch (one per node in flight)
+BATCH_WORKERS = 16
+
+# Parameters shared by several commands
+NODE_ID = Param('node_id', 0x00, int, nonzero=True)
+INDEX = Param('index', 0x0000, int, nonzero=True)
+SUBINDEX = Param('subindex', 0x00, int)
+MODE = Param('mode', 'expedited', str, choices=SDO_MODES)
+RAW = Param('raw', False, bool)
+# Time window of recorder queries
+WINDOW = (Param('last', 0, float), Param('start', None, float), Param('end', None, float), Param('limit', None, int))
+# Target of columnar exports
+EXPORT = (Param('output', 'binary', str, choices=('binary', 'file')), Param('name', '', str))
+
+# Start of this daemon process (reported by shard_stats)
+STARTED = time.time()
+
+# Threads executing batch sub-commands
+_batch_pool = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+# ================================================================================
+# Additional Functions
+
+# Return the simulated node or fail, if the daemon runs without SIM-Network
+def _sim_node(ctx):
+    if getattr(ctx, 'sim_node', None) is None:
+        raise CommandError('SIM_NETWORK is disabled')
+    return ctx.sim_node
+
+# Hold the locks of all added nodes (sorted, so concurrent callers cannot deadlock)
+@contextlib.contextmanager
+def _all_nodes_locked(ctx):
+    with contextlib.ExitStack() as stack:
+        for node_id in sorted(ctx.network.nodes):
+            stack.enter_context(ctx.lock(('node', node_id)))
+        yield
+
+# Object dictionary entry of index (a variable) or index / subindex
+def _od_variable(node, index, subindex):
+    try:
+        obj = node.object_dictionary[index]
+    except KeyError:
+        raise CommandError('object 0x%04X not in object dictionary of node 0x%02X' % (index, node.id))
+    if isinstance(obj, canopen.objectdictionary.Variable):
+        return obj
+    try:
+        return obj[subindex]
+    except KeyError:
+        raise CommandError('object 0x%04X:%02X not in object dictionary of node 0x%02X' % (index, subindex, node.id))
+
+# Plain bytes of a data parameter: bytes (binary encodings), list of byte values or hex string (JSON)
+def _data_bytes(data):
+    try:
+        if isinstance(data, str):
+            return bytes.fromhex(data)
+        if isinstance(data, (bytes, bytearray, memoryview, list)):
+            return bytes(data)
+    except (TypeError, ValueError):
+        pass
+    raise CommandError('data must be bytes, a list of byte values or a hex string: %r' % (data,))
+
+# Start of the time window of recorder queries (last = the last seconds)
+def _window_start(req):
+    if req.last:
+        # Timestamps of python-can are seconds since the epoch
+        return time.time() - req.last
+    return req.start
+
+# Check whether a reply_cmd reports a failed command
+def _is_error(reply_cmd):
+    return reply_cmd.startswith('err') or reply_cmd == 'unknown_cmd'
+
+# Key grouping batch sub-commands, which have to be executed in sequence
+def _batch_group(ctx, parameters):
+    # Bus by name - without 'bus' the bus of the batch, so all sub-commands of a node share one group
+    bus = parameters.get('bus', None)
+    bus = ctx.bus.name if bus is None else str(bus)
+    node_id = parameters.get('node_id', 0x00)
+    if node_id:
+        return bus, node_id
+    # Everything without a node (raw CAN, SYNC, ...) stays in order on the network
+    return bus, 'network'
+
+# Execute the sub-commands of one group in order
+def _run_batch_group(ctx, items, results, failed, stop_on_error):
+    for position, cmd, parameters in items:
+        if stop_on_error and failed.is_set():
+            results[position] = {'reply_cmd': 'skipped', 'reply_parameters': {}}
+            continue
+        try:
+            # Sub-commands may address another bus than the batch itself
+            target = ctx.buses.get(parameters['bus']).context if 'bus' in parameters else ctx
+            reply_cmd, reply_parameters = registry.dispatch(target, cmd, parameters)
+        except Exception as e:
+            reply_cmd, reply_parameters = 'err: %s' % e, {}
+        results[position] = {'reply_cmd': reply_cmd, 'reply_parameters': reply_parameters}
+        if _is_error(reply_cmd):
+            failed.set()
+
+# ================================================================================
+# Stop daemon
+@command('turn_off')
+def turn_off(ctx, req):
+    # stop daemon (after the reply has been sent)
+    ctx.stop.set()
+
+# ================================================================================
+# Encodings supported on the wire (the reply always uses the encoding of the request)
+@command('wire_protocols')
+def wire_protocols(ctx, req):
+    return {'encodings': wire_protocol.encodings()}
+
+# ================================================================================
+# Add node
+@command('add_node', params=(NODE_ID, Param('EDS', '', str, nonzero=True)), lock='node')
+def add_node(ctx, req):
+    # Add remote node to CANopen network
+    # Parsed EDS files are shared by all nodes using the same file
+    od = ctx.od_cache.get(os.path.join(EDS_DIR, req.EDS), req.node_id)
+    ctx.nodes[req.node_id] = ctx.network.add_node(req.node_id, od)
+    if DEBUG:
+        print('Addind remote node: ', hex(req.node_id))
+        print(ctx.nodes)
+    return {'node_id': req.node_id}
+
+# ================================================================================
+# Health and load of this daemon process (one per bus in the sharded mode)
+@command('shard_stats')
+def shard_stats(ctx, req):
+    return {'pid': os.getpid(), 'uptime': round(time.time() - STARTED, 3),
+            'cpu_time': round(time.process_time(), 3), 'threads': threading.active_count(),
+            'buses': [bus.info() for bus in ctx.buses]}
+
+# ================================================================================
+# CAN buses managed by the daemon
+@command('bus_list')
+def bus_list(ctx, req):
+    return {'default': ctx.buses.default.name, 'buses': [bus.info() for bus in ctx.buses]}
+
+# ================================================================================
+# Hits / misses of the cache of parsed EDS files
+@command('eds_cache_stats')
+def eds_cache_stats(ctx, req):
+    return ctx.od_cache.stats()
+
+# ================================================================================
+# Drop all parsed EDS files from memory (pickles on disk are kept)
+@command('eds_cache_clear')
+def eds_cache_clear(ctx, req):
+    ctx.od_cache.clear()
+
+# ================================================================================
+# Scanner
+@command('scanner', params=(Param('expected', None, list),), lock='scanner')
+def scanner(ctx, req):
+    # Scan network via Index 0x1000 Subindex 0x00 - returns when the bus got quiet
+    # (SDO responses of the scan must not interfere with running SDO transfers)
+    with _all_nodes_locked(ctx):
+        result = ctx.network_scanner.scan(expected=req.expected)
+    # Nodes found passively (heartbeats, PDOs, ...) by the scanner of python-canopen are included
+    found = sorted(set(result['nodes']) | set(ctx.network.scanner.nodes))
+    if DEBUG:
+        for node_id in found:
+            print('Found node: ', hex(node_id))
+    return found
+
+# ================================================================================
+# Scan with per-node response latency and optional identity (0x1018)
+@command('scan_nodes', params=(Param('limit', 127, int), Param('expected', None, list),
+                               Param('timeout', 1.0, float), Param('identity', False, bool)),
+         lock='scanner')
+def scan_nodes(ctx, req):
+    if not 1 <= req.limit <= 127:
+        raise CommandError('limit must be within 1 ... 127')
+    with _all_nodes_locked(ctx):
+        return ctx.network_scanner.scan(req.limit, req.expected, req.timeout, req.identity)
+
+# ================================================================================
+# Control NMT
+# (wait > 0: until the new state is confirmed by a heartbeat of the node, at most wait seconds)
+@command('nmt_change_state', params=(NODE_ID, Param('new_state', 'INITIALISING', str), Param('wait', 0, float)),
+         lock='node', resolve_node=True)
+def nmt_change_state(ctx, req):
+    sent = time.monotonic()
+    req.node.nmt.state = req.new_state
+    result = {'node_id': req.node_id, 'new_state': req.new_state}
+    if req.wait > 0:
+        state = heartbeat_monitor.COMMAND_STATES.get(req.new_state.upper())
+        if state is None:
+            raise CommandError('no heartbeat confirms NMT state %s' % req.new_state)
+        confirmed = ctx.heartbeat_monitor.wait_states({req.node_id: state}, req.wait, since=sent)[req.node_id]
+        result.update(confirmed=confirmed is not None,
+                      confirm_ms=round(confirmed * 1e3, 3) if confirmed is not None else None)
+    return result
+
+# ================================================================================
+# NMT for many nodes at once: one frame per node back to back (or one broadcast frame),
+# then a single confirmation window for all nodes
+# (node_ids empty: broadcast to node 0, confirmed by all nodes with a current heartbeat)
+@command('nmt_change_states', params=(Param('node_ids', [], list), Param('new_state', 'INITIALISING', str),
+                                      Param('broadcast', False, bool), Param('wait', 0, float)), lock='nmt')
+def nmt_change_states(ctx, req):
+    new_state = req.new_state.upper()
+    if new_state not in NMT_COMMANDS:
+        raise CommandError('unknown NMT state %s' % req.new_state)
+    state = heartbeat_monitor.COMMAND_STATES.get(new_state)
+    if req.wait > 0 and state is None:
+        raise CommandError('no heartbeat confirms NMT state %s' % req.new_state)
+    node_ids = sorted(set(req.node_ids))
+    if any(not 1 <= node_id <= 127 for node_id in node_ids):
+        raise CommandError('node_ids must be within 1 ... 127')
+    if not node_ids:
+        node_ids = ctx.heartbeat_monitor.alive()
+    broadcast = req.broadcast or not req.node_ids
+    sent = time.monotonic()
+    if broadcast:
+        ctx.network.send_message(0x000, [NMT_COMMANDS[new_state], 0x00])
+    else:
+        for node_id in node_ids:
+            ctx.network.send_message(0x000, [NMT_COMMANDS[new_state], node_id])
+    result = {'node_ids': node_ids, 'new_state': new_state, 'broadcast': broadcast}
+    if req.wait > 0:
+        confirmed = ctx.heartbeat_monitor.wait_states(dict.fromkeys(node_ids, state), req.wait, since=sent)
+        states = ctx.heartbeat_monitor.states(node_ids)
+        result['nodes'] = nodes = {}
+        for node_id, after in confirmed.items():
+            nodes[node_id] = {'confirmed': after is not None,
+                              'confirm_ms': round(after * 1e3, 3) if after is not None else None,
+                              'state': states[node_id]['state'], 'alive': states[node_id]['alive']}
+        # Nothing confirmed without a node to confirm it (i.e. broadcast while no heartbeat is known)
+        result['confirmed'] = bool(nodes) and all(node['confirmed'] for node in nodes.values())
+        result['duration_ms'] = round((time.monotonic() - sent) * 1e3, 3)
+    return result
+
+# ================================================================================
+# Wait until a node reports a state in its heartbeat - returns the moment the frame arrives
+# (fresh: only a heartbeat received after the request counts, not the state already known)
+@command('nmt_wait_state', params=(NODE_ID, Param('state', 'OPERATIONAL', str, choices=NMT_STATES),
+                                   Param('timeout', 3, float), Param('fresh', False, bool)))
+def nmt_wait_state(ctx, req):
+    started = time.monotonic()
+    reached = ctx.heartbeat_monitor.wait_states({req.node_id: req.state}, req.timeout,
+                                                since=started if req.fresh else None)[req.node_id]
+    return {'node_id': req.node_id, 'state': req.state, 'reached': reached is not None,
+            'wait_ms': round((time.monotonic() - started) * 1e3, 3),
+            'node': ctx.heartbeat_monitor.states([req.node_id])[req.node_id]}
+
+# ================================================================================
+# NMT state table of the bus from the heartbeats (state, alive, age, period)
+# (state changes / heartbeat loss are pushed on the stream socket, topics 'event.nmt' / 'event.heartbeat')
+@command('nmt_states', params=(Param('node_ids', None, list),))
+def nmt_states(ctx, req):
+    return {'nodes': ctx.heartbeat_monitor.states(req.node_ids), 'endpoint': ctx.streamer.public_endpoint}
+
+# ================================================================================
+# Heartbeat period of a node for the loss detection (0 = learned from the frames),
+# optionally written to the producer heartbeat time 0x1017 of the node
+@command('heartbeat_expect', params=(NODE_ID, Param('period_ms', 0, int), Param('write', False, bool)),
+         lock='node')
+def heartbeat_expect(ctx, req):
+    if not 0 <= req.period_ms <= 0xFFFF:
+        raise CommandError('period_ms must be within 0 ... 65535')
+    if req.write:
+        ctx.sdo_engine.download(req.node_id, 0x1017, 0x00, struct.pack('<H', req.period_ms)).result()
+    ctx.heartbeat_monitor.expect(req.node_id, req.period_ms / 1000.0)
+    return {'node_id': req.node_id, 'period_ms': req.period_ms}
+
+# ================================================================================
+# SDO Upload
+@command('sdo_upload', params=(NODE_ID, INDEX, SUBINDEX, MODE, RAW), lock='node', resolve_node=True, sdo=True)
+def sdo_upload(ctx, req):
+    if req.raw:
+        # Plain bytes as sent by the node - no decoding via the object dictionary
+        value = ctx.sdo_engine.upload(req.node_id, req.index, req.subindex).result()
+    elif req.mode == 'block-filelike':
+        # Upload large data (binary) via BLOCK transfer from the node via file-like access
+        fp = req.node.sdo.open(req.index, req.subindex, 'rb', block_transfer=True) # rb = read binary
+        value = fp.read()
+        fp.close()
+    else:
+        var = _od_variable(req.node, req.index, req.subindex)
+        value = var.decode_raw(ctx.sdo_engine.upload(req.node_id, var.index, var.subindex).result())
+    return {'index': req.index, 'subindex': req.subindex, 'value': value}
+
+# ================================================================================
+# Upload the same object from several nodes - all transfers are in flight at once
+@command('sdo_upload_nodes', params=(Param('node_ids', [], list, nonzero=True), INDEX, SUBINDEX, RAW,
+                                     Param('timeout', 0, float)))
+def sdo_upload_nodes(ctx, req):
+    node_ids = sorted(set(int(node_id) for node_id in req.node_ids))
+    for node_id in node_ids:
+        if not req.raw and node_id not in ctx.network:
+            raise CommandError('node 0x%02X has not been added' % node_id)
+    started = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        # Sorted, so concurrent callers cannot deadlock
+        for node_id in node_ids:
+            stack.enter_context(ctx.lock(('node', node_id)))
+        variables = {}
+        futures = {}
+        for node_id in node_ids:
+            if req.raw:
+                variables[node_id] = None
+                index, subindex = req.index, req.subindex
+            else:
+                variables[node_id] = var = _od_variable(ctx.network[node_id], req.index, req.subindex)
+                index, subindex = var.index, var.subindex
+            futures[node_id] = ctx.sdo_engine.upload(node_id, index, subindex, req.timeout or None)
+        values = {}
+        errors = {}
+        for node_id, future in futures.items():
+            try:
+                data = future.result()
+            except (canopen.SdoCommunicationError, canopen.SdoAbortedError) as e:
+                errors[node_id] = str(e)
+                continue
+            values[node_id] = data if variables[node_id] is None else variables[node_id].decode_raw(data)
+    return {'index': req.index, 'subindex': req.subindex, 'values': values, 'errors': errors,
+            'duration_ms': round((time.perf_counter() - started) * 1e3, 3)}
+
+# ================================================================================
+# Response latency histogram, adaptive timeout and circuit breaker state per node
+@command('sdo_stats', params=(Param('node_id', None, int), Param('reset', False, bool)))
+def sdo_stats(ctx, req):
+    stats = ctx.sdo_engine.node_stats(req.node_id)
+    if req.reset and req.node_id is not None:
+        ctx.sdo_engine.reset_node(req.node_id)
+    return stats
+
+# ================================================================================
+# SDO Download
+@command('sdo_download', params=(NODE_ID, INDEX, SUBINDEX, MODE, RAW, Param('data', b'')),
+         lock='node', resolve_node=True, sdo=True)
+def sdo_download(ctx, req):
+    if req.raw:
+        # Plain bytes written as they are - no encoding via the object dictionary
+        ctx.sdo_engine.download(req.node_id, req.index, req.subindex, _data_bytes(req.data)).result()
+    elif req.mode == 'block-filelike':
+        # Download large data via BLOCK transfer from the node via file-like access
+        fp = req.node.sdo.open(req.index, req.subindex, 'wb', block_transfer=True)
+        fp.write(_data_bytes(req.data))
+        fp.close()
+    else:
+        var = _od_variable(req.node, req.index, req.subindex)
+        ctx.sdo_engine.download(req.node_id, var.index, var.subindex, var.encode_raw(req.data)).result()
+    return {'index': req.index, 'subindex': req.subindex,
+            'success': 0x01} # Permanently TRUE (= 0x01)
+
+# ================================================================================
+# SDO streams - chunked block transfers of large objects spanning several requests
+# (chunks travel as binary frames - msgpack attachments or struct payloads - JSON clients send byte lists)
+STREAM_ID = Param('stream_id', 0, int, nonzero=True)
+
+@contextlib.contextmanager
+def _stream_locked(ctx, stream_id):
+    stream = ctx.sdo_streams.get(stream_id)
+    if stream is None:
+        raise CommandError('unknown stream %d' % stream_id)
+    # Requests of a stream are serialized with the other SDO commands of its node
+    with ctx.lock(('node', stream.node_id)), stream.lock:
+        try:
+            yield stream
+        except (IOError, ValueError) as e:
+            raise CommandError(str(e))
+
+# ================================================================================
+# Open a block upload / download (size: bytes of the download, 0 = unknown - ended by sdo_stream_close)
+@command('sdo_stream_open', params=(NODE_ID, INDEX, SUBINDEX,
+                                    Param('direction', 'upload', str, choices=sdo_stream.DIRECTIONS),
+                                    Param('size', 0, int)), lock='node', resolve_node=True)
+def sdo_stream_open(ctx, req):
+    try:
+        stream = ctx.sdo_streams.open(req.node, req.index, req.subindex, req.direction, req.size or None)
+    except IOError as e:
+        raise CommandError(str(e))
+    return stream.info()
+
+# ================================================================================
+# Write the next chunk(s) of a download - straight from the request frames into the block writer
+@command('sdo_stream_write', params=(STREAM_ID, Param('data', b''), Param('chunks', [], list)))
+def sdo_stream_write(ctx, req):
+    chunks = ([req.data] if len(req.data) else []) + req.chunks
+    if sum(len(chunk) for chunk in chunks) > sdo_stream.CHUNK_LIMIT:
+        raise CommandError('more than %d bytes per request' % sdo_stream.CHUNK_LIMIT)
+    with _stream_locked(ctx, req.stream_id) as stream:
+        if stream.direction != 'download':
+            raise CommandError('stream %d is an upload' % req.stream_id)
+        for chunk in chunks:
+            # JSON clients send byte values as list
+            stream.write(chunk if not isinstance(chunk, list) else bytes(chunk))
+        return stream.info()
+
+# ================================================================================
+# Read the next chunk of an upload (shorter than size at the end of the object: eof)
+@command('sdo_stream_read', params=(STREAM_ID, Param('size', sdo_stream.CHUNK_SIZE, int, nonzero=True)))
+def sdo_stream_read(ctx, req):
+    if req.size > sdo_stream.CHUNK_LIMIT:
+        raise CommandError('size must not exceed %d bytes' % sdo_stream.CHUNK_LIMIT)
+    with _stream_locked(ctx, req.stream_id) as stream:
+        if stream.direction != 'upload':
+            raise CommandError('stream %d is a download' % req.stream_id)
+        data = stream.read(req.size)
+        result = stream.info()
+        result.update(data=data, eof=stream.state == 'done')
+        return result
+
+# ================================================================================
+# Progress (transferred, progress, bytes_per_s) and state of a stream
+@command('sdo_stream_status', params=(STREAM_ID,))
+def sdo_stream_status(ctx, req):
+    with _stream_locked(ctx, req.stream_id) as stream:
+        return stream.info()
+
+# ================================================================================
+# Abort the transfer on the node - the stream keeps its position for sdo_stream_resume
+@command('sdo_stream_abort', params=(STREAM_ID,))
+def sdo_stream_abort(ctx, req):
+    with _stream_locked(ctx, req.stream_id) as stream:
+        stream.abort()
+        return stream.info()
+
+# ================================================================================
+# Restart an aborted / failed transfer - the client continues at 'transferred'
+@command('sdo_stream_resume', params=(STREAM_ID,))
+def sdo_stream_resume(ctx, req):
+    with _stream_locked(ctx, req.stream_id) as stream:
+        ctx.sdo_streams.resume(stream)
+        return stream.info()
+
+# ================================================================================
+# Close a stream - ends a download of unknown size regularly (abort: abort an unfinished transfer)
+@command('sdo_stream_close', params=(STREAM_ID, Param('abort', False, bool)))
+def sdo_stream_close(ctx, req):
+    with _stream_locked(ctx, req.stream_id) as stream:
+        if not req.abort and stream.direction == 'download':
+            stream.finish()
+        stream.close()
+    ctx.sdo_streams.close(req.stream_id)
+    return stream.info()
+
+# ================================================================================
+# Open streams of the bus
+@command('sdo_stream_list')
+def sdo_stream_list(ctx, req):
+    return {'streams': ctx.sdo_streams.streams()}
+
+# ================================================================================
+# Flash the nodes of one bus one after the other
+def _flash_bus(ctx, nodes, image, req):
+    def publish(event):
+        if ctx.streamer is not None:
+            event['bus'] = ctx.bus.name
+            ctx.streamer.publish_event('flash', event)
+
+    results = []
+    for node in nodes:
+        with ctx.lock(('node', node.id)):
+            result = firmware_flash.flash_node(ctx.sdo_engine, node, image, req.program, req.clear, req.start,
+                                               publish)
+        result['bus'] = ctx.bus.name
+        results.append(result)
+    return results
+
+# ================================================================================
+# Program download (0x1F51 stop / clear, 0x1F50 block download, 0x1F51 start) of an image file
+# on the daemon host. Nodes on different buses are flashed in parallel, the nodes of one bus in turn.
+# (targets: [[bus, node_id], ...], node_ids: nodes of the bus of the request; progress on topic 'event.flash')
+@command('flash_firmware', params=(Param('image', '', str, nonzero=True), Param('node_ids', [], list),
+                                   Param('targets', [], list), Param('program', 1, int, nonzero=True),
+                                   Param('clear', True, bool), Param('start', True, bool)))
+def flash_firmware(ctx, req):
+    targets = [(ctx.bus.name, node_id) for node_id in req.node_ids]
+    for position, target in enumerate(req.targets):
+        if not isinstance(target, (list, tuple)) or len(target) != 2:
+            raise CommandError('targets[%d] must be [bus, node_id]' % position)
+        targets.append(tuple(target))
+    if not targets:
+        raise CommandError('no nodes to flash')
+    groups = {}
+    for bus_name, node_id in dict.fromkeys(targets):
+        bus_ctx = ctx.buses.get(bus_name).context
+        try:
+            node = bus_ctx.network[node_id]
+        except KeyError:
+            raise CommandError('node 0x%02X has not been added on bus %s' % (node_id, bus_name))
+        groups.setdefault(bus_name, (bus_ctx, []))[1].append(node)
+    if not os.path.isfile(req.image) or not os.path.getsize(req.image):
+        raise CommandError('image %s is missing or empty' % req.image)
+
+    started = time.monotonic()
+    with firmware_flash.open_image(req.image) as image:
+        crc = firmware_flash.image_crc(image)
+        with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix='flash') as pool:
+            futures = [pool.submit(_flash_bus, bus_ctx, nodes, image, req) for bus_ctx, nodes in groups.values()]
+            results = [result for future in futures for result in future.result()]
+        size = len(image)
+    duration = time.monotonic() - started
+    flashed = sum(1 for result in results if result['success'])
+    return {'image': req.image, 'size': size, 'crc': crc, 'nodes': results, 'flashed': flashed,
+            'errors': len(results) - flashed, 'duration_ms': round(duration * 1e3, 3),
+            'bytes_per_s': round(flashed * size / duration, 1) if duration > 0 else None}
+
+# ================================================================================
+# Upload all readable objects (from the EDS) and optionally compare with a golden snapshot
+@command('od_snapshot', params=(NODE_ID, Param('golden', None, dict), Param('ignore', [], list),
+                                Param('block_transfer', True, bool)),
+         lock='node', resolve_node=True, sdo=True)
+def od_snapshot_cmd(ctx, req):
+    try:
+        result = od_snapshot.take_snapshot(ctx.sdo_engine, req.node, req.block_transfer)
+    except canopen.SdoCommunicationError as e:
+        raise CommandError('snapshot of node 0x%02X aborted: %s' % (req.node_id, e))
+    result['node_id'] = req.node_id
+    if req.golden is not None:
+        result['diff'] = od_snapshot.diff_snapshots(req.golden, result['snapshot'], req.ignore)
+        result['match'] = not result['diff']
+    return result
+
+# ================================================================================
+# Read active EMCYs (since the last error reset) - records with code, register, data, timestamp
+@command('emcys_read_active', params=(NODE_ID,))
+def emcys_read_active(ctx, req):
+    return {'node_id': req.node_id, 'value': ctx.emcy_monitor.active(req.node_id)}
+
+# ================================================================================
+# Read log EMCYs
+@command('emcys_read_log', params=(NODE_ID,))
+def emcys_read_log(ctx, req):
+    return {'node_id': req.node_id, 'value': ctx.emcy_monitor.query(req.node_id)}
+
+# ================================================================================
+# EMCY history by node (0 = all nodes), code range and time window
+# (EMCYs are pushed as they arrive on the stream socket, topic 'event.emcy')
+@command('emcy_query', params=(Param('node_id', 0x00, int), Param('code_min', 0x0000, int),
+                               Param('code_max', 0xFFFF, int)) + WINDOW)
+def emcy_query(ctx, req):
+    records = ctx.emcy_monitor.query(req.node_id or None, req.code_min, req.code_max,
+                                     _window_start(req), req.end, req.limit)
+    return {'records': records, 'count': len(records), 'endpoint': ctx.streamer.public_endpoint}
+
+# ================================================================================
+# Forget the EMCY history of a node (0 = all nodes)
+@command('emcy_clear', params=(Param('node_id', 0x00, int),))
+def emcy_clear(ctx, req):
+    ctx.emcy_monitor.clear(req.node_id or None)
+
+# ================================================================================
+# Number of EMCYs received and kept per node
+@command('emcy_stats')
+def emcy_stats(ctx, req):
+    return ctx.emcy_monitor.stats()
+
+# ================================================================================
+# Read next msg with specific CAN-ID
+@command('subscribe_next_msg', params=(Param('can_id', 0x00000000, int), Param('timeout', 3, float)))
+def subscribe_next_msg(ctx, req):
+    # Reply goes out the moment the frame arrives (no polling)
+    with Subscription(ctx.network, req.can_id) as subscription:
+        subscription.wait(req.timeout)
+    if subscription.received:
+        if DEBUG:
+            print('CAN-ID: ', hex(subscription.msg_id), ' - Data: ', subscription.msg_data,
+                  '- Timestamp: ', subscription.msg_timestamp)
+        return {'subscribe_msg_id': subscription.msg_id,
+                'subscribe_msg_data': subscription.msg_data,
+                'subscribe_msg_timestamp': subscription.msg_timestamp}
+    return {'note': 'incorrect number of msgs received'}
+
+# ================================================================================
+# Stream frames matching an ID/mask filter via the PUB socket (topic 'can.<name>')
+@command('stream_add_filter', params=(Param('name', '', str, nonzero=True), Param('can_id', 0x000, int),
+                                      Param('mask', 0x7FF, int),
+                                      Param('queue_limit', frame_stream.QUEUE_LIMIT, int, nonzero=True),
+                                      Param('policy', 'drop_oldest', str, choices=frame_stream.DROP_POLICIES),
+                                      Param('all_buses', False, bool)))
+def stream_add_filter(ctx, req):
+    # Frames of the bus of the request only, unless all_buses is set
+    bus = None if req.all_buses else ctx.bus.name
+    ctx.streamer.add_filter(req.name, req.can_id, req.mask, req.queue_limit, req.policy, bus)
+    return {'name': req.name, 'topic': 'can.' + req.name, 'bus': bus, 'endpoint': ctx.streamer.public_endpoint}
+
+# ================================================================================
+# Stop streaming of a filter
+@command('stream_remove_filter', params=(Param('name', '', str, nonzero=True),))
+def stream_remove_filter(ctx, req):
+    if not ctx.streamer.remove_filter(req.name):
+        raise CommandError('no stream filter named %s' % req.name)
+    return {'name': req.name}
+
+# ================================================================================
+# Counters (matched, published, dropped, ...) of all stream filters
+@command('stream_stats')
+def stream_stats(ctx, req):
+    return {'endpoint': ctx.streamer.public_endpoint, 'filters': ctx.streamer.stats(),
+            'events_published': ctx.streamer.events_published, 'events_dropped': ctx.streamer.events_dropped}
+
+# ================================================================================
+# Frames recorded within a time window (i.e. everything on 0x1AF in the last 2 s)
+@command('recorder_query', params=(Param('can_ids', None, list),) + WINDOW)
+def recorder_query(ctx, req):
+    frames = ctx.recorder.query(req.can_ids, _window_start(req), req.end, req.limit)
+    frames['count'] = len(frames['can_id'])
+    return frames
+
+# ================================================================================
+# Recorded frames as columnar time series (timestamp, can_id, dlc, data[n, 8])
+@command('recorder_export', params=(Param('can_ids', None, list),) + WINDOW + EXPORT)
+def recorder_export(ctx, req):
+    frames = ctx.recorder.query(req.can_ids, _window_start(req), req.end, req.limit, raw_data=True)
+    return _export(ctx, req, timeseries_export.frame_columns(frames))
+
+# ================================================================================
+# Fill level of the frame recorder
+@command('recorder_stats')
+def recorder_stats(ctx, req):
+    return ctx.recorder.stats()
+
+# ================================================================================
+# Forget all recorded frames
+@command('recorder_clear')
+def recorder_clear(ctx, req):
+    ctx.recorder.clear()
+
+# ================================================================================
+# Activate periodic SYNC
+@command('sync_activate_periodic', params=(Param('sync_period', 5, float, nonzero=True),
+                                           Param('mode', 'auto', str, choices=sync_producer.SYNC_MODES)),
+         lock='sync')
+def sync_activate_periodic(ctx, req):
+    try:
+        mode = ctx.sync_producer.start(req.sync_period, req.mode)
+    except ValueError as e:
+        raise CommandError(str(e))
+    return {'sync_period': req.sync_period, 'mode': mode}
+
+# ================================================================================
+# Deactivate periodic SYNC
+@command('sync_deactivate_periodic', lock='sync')
+def sync_deactivate_periodic(ctx, req):
+    ctx.sync_producer.stop()
+
+# ================================================================================
+# Achieved SYNC period: jitter, overruns and missed slots
+@command('sync_stats')
+def sync_stats(ctx, req):
+    return ctx.sync_producer.stats()
+
+# ================================================================================
+# Send raw CAN message
+@command('can_send_msg', params=(Param('can_id', 0x00000000, int),
+                                 Param('can_bytes', [0xAB, 0xCD, 0xEF, 0x00, 0xAB, 0xCD, 0xEF, 0x99], list)))
+def can_send_msg(ctx, req):
+    ctx.network.send_message(req.can_id, req.can_bytes)
+    return {'can_id': req.can_id, 'can_bytes': req.can_bytes}
+
+# ================================================================================
+# Send many raw CAN messages with one request, paced to bus_load (0 = back to back)
+# frames: packed frame_burst.BURST_FRAME records (binary) or [[can_id, can_bytes, gap_us], ...]
+@command('can_send_burst', params=(Param('frames', b'', nonzero=True),
+                                   Param('bus_load', frame_burst.BUS_LOAD, float)),
+         lock='burst')
+def can_send_burst(ctx, req):
+    if not 0 <= req.bus_load <= 1:
+        raise CommandError('bus_load must be within 0 ... 1')
+    try:
+        payload = frame_burst.pack_frames(req.frames) if isinstance(req.frames, list) else bytes(req.frames)
+        frames = frame_burst.unpack_frames(payload)
+    except (ValueError, TypeError, IndexError, struct.error) as e:
+        raise CommandError('invalid frames: %s' % e)
+    if len(frames) > frame_burst.BURST_LIMIT:
+        raise CommandError('more than %d frames' % frame_burst.BURST_LIMIT)
+    return frame_burst.send_burst(ctx.network, frames, ctx.bus.bitrate, req.bus_load)
+
+# ================================================================================
+# Send a raw CAN message cyclically (kernel broadcast manager on socketcan) - no per-frame requests
+# A running task of the same name is replaced, with the same can_id and period its data is updated in place
+@command('can_start_periodic', params=(Param('name', '', str, nonzero=True), Param('can_id', 0x00000000, int),
+                                       Param('can_bytes', [], list), Param('period', 0, float, nonzero=True)),
+         lock='periodic')
+def can_start_periodic(ctx, req):
+    if len(req.can_bytes) > 8:
+        raise CommandError('can_bytes holds more than 8 bytes')
+    task = ctx.periodic_tasks.start(req.name, req.can_id, req.can_bytes, req.period)
+    return dict(task.info(), kernel=ctx.periodic_tasks.kernel)
+
+# ================================================================================
+# Replace the data of a running cyclic transmission
+@command('can_update_periodic', params=(Param('name', '', str, nonzero=True), Param('can_bytes', [], list)),
+         lock='periodic')
+def can_update_periodic(ctx, req):
+    if len(req.can_bytes) > 8:
+        raise CommandError('can_bytes holds more than 8 bytes')
+    if not ctx.periodic_tasks.update(req.name, req.can_bytes):
+        raise CommandError('no periodic task %s' % req.name)
+    return {'name': req.name, 'can_bytes': req.can_bytes}
+
+# ================================================================================
+# Stop a cyclic transmission (without name: all of this bus)
+@command('can_stop_periodic', params=(Param('name', None, str),), lock='periodic')
+def can_stop_periodic(ctx, req):
+    stopped = ctx.periodic_tasks.stop(req.name)
+    if req.name is not None and not stopped:
+        raise CommandError('no periodic task %s' % req.name)
+    return {'stopped': stopped}
+
+# ================================================================================
+# Running cyclic transmissions
+@command('can_list_periodic')
+def can_list_periodic(ctx, req):
+    return {'kernel': ctx.periodic_tasks.kernel, 'tasks': ctx.periodic_tasks.tasks()}
+
+# ================================================================================
+# Trigger EMCY
+@command('emcys_trigger_sim', lock='sim')
+def emcys_trigger_sim(ctx, req):
+    sim_node = _sim_node(ctx)
+    sim_node.emcy.send(0x3001, register=4, data=b"Under")
+    return {'node_id': sim_node.id, 'value': 'triggered'}
+
+# ================================================================================
+# Clear EMCY
+@command('emcys_reset_sim', lock='sim')
+def emcys_reset_sim(ctx, req):
+    _sim_node(ctx).emcy.reset(register=4, data=b"CLEAR")
+    return {'value': 'reset'}
+
+# ================================================================================
+# ================================================================================
+# ================================================================================
+# Return the PDO map pdo_number of tpdo / rpdo
+def _pdo_map(pdos, pdo_number):
+    try:
+        return pdos[pdo_number]
+    except KeyError:
+        raise CommandError('pdo_number %d does not exist' % pdo_number)
+
+# Mapping entry: index, [index, subindex] or [index, subindex, length in bits]
+def _mapping_entry(entry):
+    if isinstance(entry, int):
+        return entry, 0, None
+    if isinstance(entry, (list, tuple)) and 2 <= len(entry) <= 3:
+        return int(entry[0]), int(entry[1]), int(entry[2]) if len(entry) == 3 else None
+    raise CommandError('invalid mapping entry %r' % (entry,))
+
+# Variable of a PDO map
+def _pdo_variable(pdo_map, index, subindex):
+    for var in pdo_map.map:
+        if var.index == index and var.subindex == subindex:
+            return var
+    raise CommandError('0x%04X:%02X is not mapped' % (index, subindex))
+
+def _describe_pdo(node_id, pdo_number, pdo_map):
+    return {'node_id': node_id, 'pdo_number': pdo_number, 'cob_id': pdo_map.cob_id,
+            'trans_type': pdo_map.trans_type, 'event_timer': pdo_map.event_timer,
+            'inhibit_time': pdo_map.inhibit_time, 'enabled': pdo_map.enabled,
+            'mapping': [[var.index, var.subindex, var.length] for var in pdo_map.map]}
+
+# Write communication parameters and (optionally) a new mapping of a PDO to the node
+def _configure_pdo(req, pdos):
+    pdo_map = _pdo_map(pdos, req.pdo_number)
+    # Current configuration (COB-ID, mapping) of the node
+    pdo_map.read()
+    if req.mapping is not None:
+        entries = [_mapping_entry(entry) for entry in req.mapping]
+        pdo_map.clear()
+        for index, subindex, length in entries:
+            pdo_map.add_variable(index, subindex, length)
+    pdo_map.trans_type = req.trans_type
+    if req.event_timer is not None:
+        pdo_map.event_timer = req.event_timer
+    if req.inhibit_time is not None:
+        pdo_map.inhibit_time = req.inhibit_time
+    pdo_map.enabled = req.enabled
+    # Save new PDO configuration to node
+    pdo_map.save()
+    return pdo_map
+
+PDO_NUMBER = Param('pdo_number', 1, int, nonzero=True)
+PDO_MAPPING = Param('mapping', None, list)
+
+# ================================================================================
+# Config TX-PDO - received values are cached (see pdo_read_cached)
+@command('pdo_config_tx', params=(NODE_ID, PDO_NUMBER, PDO_MAPPING, Param('trans_type', 0xFF, int),
+                                  Param('event_timer', 1500, int), Param('inhibit_time', None, int),
+                                  Param('enabled', True, bool)),
+         lock='node', resolve_node=True, sdo=True)
+def pdo_config_tx(ctx, req):
+    pdo_map = _configure_pdo(req, req.node.tpdo)
+    ctx.pdo_cache.attach(req.node_id, pdo_map)
+    return _describe_pdo(req.node_id, req.pdo_number, pdo_map)
+
+# ================================================================================
+# Start TX-PDO: cache the values of the node's TPDO, optionally switch the node to OPERATIONAL
+@command('pdo_start_tx', params=(NODE_ID, PDO_NUMBER, Param('operational', True, bool)),
+         lock='node', resolve_node=True, sdo=True)
+def pdo_start_tx(ctx, req):
+    pdo_map = _pdo_map(req.node.tpdo, req.pdo_number)
+    pdo_map.read()
+    ctx.pdo_cache.attach(req.node_id, pdo_map)
+    if req.operational:
+        req.node.nmt.state = 'OPERATIONAL'
+    return _describe_pdo(req.node_id, req.pdo_number, pdo_map)
+
+# ================================================================================
+# Stop caching the values of a TX-PDO
+@command('pdo_stop_tx', params=(NODE_ID, PDO_NUMBER), lock='node', resolve_node=True)
+def pdo_stop_tx(ctx, req):
+    ctx.pdo_cache.detach(_pdo_map(req.node.tpdo, req.pdo_number))
+    return {'node_id': req.node_id, 'pdo_number': req.pdo_number}
+
+# ================================================================================
+# Config RX-PDO
+@command('pdo_config_rx', params=(NODE_ID, PDO_NUMBER, PDO_MAPPING, Param('trans_type', 0xFF, int),
+                                  Param('event_timer', None, int), Param('inhibit_time', None, int),
+                                  Param('enabled', True, bool)),
+         lock='node', resolve_node=True, sdo=True)
+def pdo_config_rx(ctx, req):
+    pdo_map = _configure_pdo(req, req.node.rpdo)
+    return _describe_pdo(req.node_id, req.pdo_number, pdo_map)
+
+# ================================================================================
+# Set values of a RX-PDO ([index, subindex, value], ...) and send it once (period = 0) or every period seconds
+@command('pdo_write_rx', params=(NODE_ID, PDO_NUMBER, Param('values', [], list), Param('period', 0, float)),
+         lock='node', resolve_node=True, sdo=True)
+def pdo_write_rx(ctx, req):
+    pdo_map = _pdo_map(req.node.rpdo, req.pdo_number)
+    if pdo_map.cob_id is None:
+        pdo_map.read()
+    for entry in req.values:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+            raise CommandError('invalid value entry %r' % (entry,))
+        _pdo_variable(pdo_map, int(entry[0]), int(entry[1])).raw = entry[2]
+    # Data of a running periodic transmission is updated in place
+    pdo_map.update()
+    if req.period > 0:
+        # Restart with the new period
+        pdo_map.stop()
+        pdo_map.start(req.period)
+    else:
+        pdo_map.transmit()
+    return {'node_id': req.node_id, 'pdo_number': req.pdo_number, 'period': req.period}
+
+# ================================================================================
+# Stop sending a RX-PDO periodically
+@command('pdo_stop_rx', params=(NODE_ID, PDO_NUMBER), lock='node', resolve_node=True)
+def pdo_stop_rx(ctx, req):
+    _pdo_map(req.node.rpdo, req.pdo_number).stop()
+    return {'node_id': req.node_id, 'pdo_number': req.pdo_number}
+
+# ================================================================================
+# Recorded frames of a TX-PDO within the requested window, decoded into columns
+def _decode_pdo_frames(ctx, req):
+    pdo_map = _pdo_map(req.node.tpdo, req.pdo_number)
+    if pdo_map.cob_id is None:
+        pdo_map.read()
+    decoder = ctx.pdo_cache.decoders.get(pdo_map.cob_id) or pdo_decoder.compile_map(pdo_map)
+    if decoder is None:
+        raise CommandError('mapping of TPDO%d cannot be compiled' % req.pdo_number)
+    frames = ctx.recorder.query([decoder.cob_id], _window_start(req), req.end, req.limit, raw_data=True)
+    # Frames shorter than the mapping are skipped by the decoder - and their timestamps here
+    timestamps = [timestamp for timestamp, data in zip(frames['timestamp'], frames['data'])
+                  if len(data) >= decoder.size]
+    columns, skipped = decoder.decode_batch(frames['data'])
+    return decoder, timestamps, columns, skipped
+
+# Export columns as .npy files (output = 'file') or as bytes within the reply (output = 'binary')
+def _export(ctx, req, columns):
+    reply = {'count': columns[0].shape[0], 'output': req.output}
+    if req.output == 'file':
+        try:
+            name = timeseries_export.safe_name(req.name or time.strftime('export-%Y%m%d-%H%M%S'))
+        except ValueError as e:
+            raise CommandError(str(e))
+        reply['directory'] = os.path.join(ctx.export_dir, name)
+        reply['columns'] = timeseries_export.export_files(reply['directory'], columns)
+    else:
+        reply['columns'] = timeseries_export.export_binary(columns)
+    return reply
+
+# ================================================================================
+# Recorded frames of a TX-PDO decoded into columns (one batch decode via the compiled decoder)
+@command('pdo_history', params=(NODE_ID, PDO_NUMBER) + WINDOW, lock='node', resolve_node=True)
+def pdo_history(ctx, req):
+    decoder, timestamps, columns, skipped = _decode_pdo_frames(ctx, req)
+    return {'node_id': req.node_id, 'pdo_number': req.pdo_number, 'cob_id': decoder.cob_id,
+            'timestamp': timestamps,
+            'columns': {name: column.tolist() if hasattr(column, 'tolist') else column
+                        for name, column in columns.items()},
+            'count': len(timestamps), 'skipped': skipped}
+
+# ================================================================================
+# Decoded signals of a TX-PDO as columnar time series (timestamp + one array per signal)
+@command('pdo_export', params=(NODE_ID, PDO_NUMBER) + WINDOW + EXPORT, lock='node', resolve_node=True)
+def pdo_export(ctx, req):
+    decoder, timestamps, columns, skipped = _decode_pdo_frames(ctx, req)
+    reply = _export(ctx, req, timeseries_export.signal_columns(timestamps, decoder, columns))
+    reply.update({'node_id': req.node_id, 'pdo_number': req.pdo_number, 'cob_id': decoder.cob_id,
+                  'skipped': skipped})
+    return reply
+
+# ================================================================================
+# Latest value of a PDO mapped variable from the cache - no bus traffic
+# (index = 0: all cached variables of the node)
+@command('pdo_read_cached', params=(NODE_ID, Param('index', 0x0000, int), SUBINDEX,
+                                    Param('max_age', 0, float)))
+def pdo_read_cached(ctx, req):
+    if not req.index:
+        return {'node_id': req.node_id, 'entries': ctx.pdo_cache.entries(req.node_id)}
+    entry = ctx.pdo_cache.get(req.node_id, req.index, req.subindex)
+    if entry is None:
+        raise CommandError('no PDO value of node 0x%02X 0x%04X:%02X received' % (req.node_id, req.index,
+                                                                                 req.subindex))
+    if req.max_age and entry['age_ms'] > req.max_age * 1e3:
+        raise CommandError('PDO value of node 0x%02X 0x%04X:%02X is %.1f ms old' % (req.node_id, req.index,
+                                                                                   req.subindex, entry['age_ms']))
+    return entry
+
+# ================================================================================
+# Batch of commands in one round trip
+@command('batch', params=(Param('commands', [], list, nonzero=True), Param('stop_on_error', True, bool),
+                          Param('parallel', True, bool)))
+def batch(ctx, req):
+    # Sub-commands addressed to the same node are executed in order, different nodes in parallel.
+    # With stop_on_error, sub-commands not yet started after the first error are skipped - best effort
+    # with parallel groups: sub-commands of other nodes already running are completed (parallel = False
+    # stops the batch exactly at the first error).
+    groups = {}
+    for position, item in enumerate(req.commands):
+        if not isinstance(item, dict):
+            raise CommandError('commands[%d] must be an object with cmd and parameters' % position)
+        cmd = item.get('cmd', '')
+        parameters = item.get('parameters', None) or {}
+        if not isinstance(parameters, dict):
+            raise CommandError('commands[%d]: parameters must be an object' % position)
+        if cmd in ('batch', 'turn_off'):
+            raise CommandError('commands[%d]: %s is not allowed within a batch' % (position, cmd))
+        key = _batch_group(ctx, parameters) if req.parallel else None
+        groups.setdefault(key, []).append((position, cmd, parameters))
+
+    results = [None] * len(req.commands)
+    failed = threading.Event()
+    if len(groups) == 1:
+        # Nothing to pipeline - run within the worker thread of the request
+        _run_batch_group(ctx, groups.popitem()[1], results, failed, req.stop_on_error)
+    else:
+        futures = [_batch_pool.submit(_run_batch_group, ctx, items, results, failed, req.stop_on_error)
+                   for items in groups.values()]
+        for future in futures:
+            future.result()
+
+    errors = sum(1 for result in results if _is_error(result['reply_cmd']))
+    skipped = sum(1 for result in results if result['reply_cmd'] == 'skipped')
+    return {'results': results, 'errors': errors, 'skipped': skipped}
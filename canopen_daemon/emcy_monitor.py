@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    emcy_monitor
+
+    EMCY messages of all nodes of one bus (0x081 ... 0x0FF), fed by the
+    notifier. Every EMCY becomes a structured record (node, code, register,
+    data, timestamp) kept in a bounded history per node, can be queried by
+    code range and time and is pushed to subscribers of the stream socket
+    (topic 'event.emcy') the moment it arrives. Code 0x0000 (error reset)
+    clears the active EMCYs of the node.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import collections
+import struct
+import threading
+
+import can
+
+EMCY_BASE = 0x080
+
+# EMCY: error code, error register, manufacturer specific data
+EMCY_STRUCT = struct.Struct('<HB5s')
+
+# Records kept per node
+HISTORY_LIMIT = 1000
+
+
+# ================================================================================
+class EmcyRecord(object):
+    __slots__ = ('node_id', 'code', 'register', 'data', 'timestamp', 'bus')
+
+    def __init__(self, node_id, code, register, data, timestamp, bus):
+        self.node_id = node_id
+        self.code = code
+        self.register = register
+        self.data = data
+        self.timestamp = timestamp
+        self.bus = bus
+
+    def to_dict(self):
+        return {'node_id': self.node_id, 'code': self.code, 'register': self.register,
+                'data': list(self.data), 'timestamp': self.timestamp, 'bus': self.bus}
+
+
+# ================================================================================
+class EmcyMonitor(can.Listener):
+    """ Listener (attached to the notifier) recording the EMCYs of all nodes """
+
+    def __init__(self, bus_name, streamer=None, history_limit=HISTORY_LIMIT):
+        self.bus_name = bus_name
+        self.streamer = streamer
+        self.history_limit = history_limit
+        # node_id -> deque of records (oldest first) / list of active records
+        self._history = {}
+        self._active = {}
+        self.received = 0
+        self._guard = threading.Lock()
+
+    # Called from the notifier thread - O(1) per frame
+    def on_message_received(self, msg):
+        node_id = msg.arbitration_id - EMCY_BASE
+        if msg.is_extended_id or msg.is_remote_frame or not 1 <= node_id <= 127 or len(msg.data) < 3:
+            return
+        code, register, data = EMCY_STRUCT.unpack(bytes(msg.data[:8]).ljust(8, b'\x00'))
+        record = EmcyRecord(node_id, code, register, data[:len(msg.data) - 3], msg.timestamp, self.bus_name)
+        with self._guard:
+            history = self._history.get(node_id)
+            if history is None:
+                history = self._history[node_id] = collections.deque(maxlen=self.history_limit)
+            history.append(record)
+            if code == 0x0000:
+                # Error reset / no error
+                self._active[node_id] = []
+            else:
+                self._active.setdefault(node_id, []).append(record)
+            self.received += 1
+        if self.streamer is not None:
+            self.streamer.publish_event('emcy', record.to_dict())
+
+    # ================================================================================
+    # Queries (called from worker threads)
+
+    def active(self, node_id):
+        with self._guard:
+            return [record.to_dict() for record in self._active.get(node_id, ())]
+
+    def query(self, node_id=None, code_min=0x0000, code_max=0xFFFF, start=None, end=None, limit=None):
+        """ Records of one node (or all nodes) within a code range and time window, oldest first """
+        with self._guard:
+            node_ids = sorted(self._history) if node_id is None else [node_id]
+            records = [record for node in node_ids for record in self._history.get(node, ())
+                       if code_min <= record.code <= code_max and
+                       (start is None or record.timestamp >= start) and
+                       (end is None or record.timestamp <= end)]
+        if node_id is None:
+            records.sort(key=lambda record: record.timestamp)
+        if limit is not None:
+            records = records[-limit:] if limit else []
+        return [record.to_dict() for record in records]
+
+    def clear(self, node_id=None):
+        with self._guard:
+            if node_id is None:
+                self._history.clear()
+                self._active.clear()
+            else:
+                self._history.pop(node_id, None)
+                self._active.pop(node_id, None)
+
+    def stats(self):
+        with self._guard:
+            return {'received': self.received,
+                    'nodes': {node_id: {'history': len(history), 'active': len(self._active.get(node_id, ()))}
+                              for node_id, history in sorted(self._history.items())}}
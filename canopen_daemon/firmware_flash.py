@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    firmware_flash
+
+    Program download (CiA 302-3) of a firmware image into a node: the
+    program is stopped and cleared via the program control 0x1F51, the image
+    is written to the program data 0x1F50 by SDO block download and the
+    program is started again.
+
+    The image is memory-mapped once and handed to the block writer in slices
+    of one full block (127 segments) - no copy of the image is made, however
+    many nodes are flashed. The block writer sends the CRC of the data with
+    the end of the transfer; the node aborts on a mismatch.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import binascii
+import contextlib
+import mmap
+import struct
+import time
+
+import sdo_stream
+
+PROGRAM_DATA = 0x1F50
+PROGRAM_CONTROL = 0x1F51
+
+# Values of the program control
+CONTROL_STOP = 0
+CONTROL_START = 1
+CONTROL_CLEAR = 3
+
+# Slice handed to the block writer - one block of the largest block size (127 segments of 7 bytes)
+BLOCK_BYTES = 127 * 7
+
+# Timeout of program control writes - clearing erases the flash (seconds)
+CONTROL_TIMEOUT = 10.0
+
+# Interval of the progress events (seconds)
+PROGRESS_INTERVAL = 1.0
+
+
+# ================================================================================
+@contextlib.contextmanager
+def open_image(path):
+    """ Memory-map a firmware image read-only - yields a memoryview of it """
+    with open(path, 'rb') as image_file:
+        mapped = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mapped) as image:
+                yield image
+        finally:
+            mapped.close()
+
+
+def image_crc(image):
+    """ CRC of the image as carried by the SDO block protocol (CRC-16 CCITT) """
+    return binascii.crc_hqx(image, 0)
+
+
+# ================================================================================
+def flash_node(sdo_engine, node, image, program=1, clear=True, start=True, publish=None):
+    """ Flash image into program number program of node
+
+    :param publish:
+        Callable publish(event) receiving the progress of the download.
+    :return:
+        Dict with the result and the throughput of the node.
+    """
+    result = {'node_id': node.id, 'program': program, 'size': len(image), 'transferred': 0,
+              'success': False, 'error': None}
+    started = time.monotonic()
+    step = 'stop'
+    try:
+        sdo_engine.download(node.id, PROGRAM_CONTROL, program, struct.pack('<B', CONTROL_STOP),
+                            CONTROL_TIMEOUT).result()
+        if clear:
+            step = 'clear'
+            sdo_engine.download(node.id, PROGRAM_CONTROL, program, struct.pack('<B', CONTROL_CLEAR),
+                                CONTROL_TIMEOUT).result()
+
+        step = 'download'
+        download_started = time.monotonic()
+        reported = download_started
+        fp = node.sdo.open(PROGRAM_DATA, program, 'wb', block_transfer=True, size=len(image))
+        try:
+            for offset in range(0, len(image), BLOCK_BYTES):
+                fp.write(image[offset:offset + BLOCK_BYTES])
+                result['transferred'] = min(offset + BLOCK_BYTES, len(image))
+                if publish is not None and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                    reported = time.monotonic()
+                    publish({'node_id': node.id, 'state': 'download', 'transferred': result['transferred'],
+                             'size': len(image),
+                             'bytes_per_s': round(result['transferred'] / (reported - download_started), 1)})
+            # End of the transfer - carries the CRC
+            fp.close()
+        except Exception:
+            sdo_stream.abort_transfer(node, PROGRAM_DATA, program, fp)
+            raise
+        download = time.monotonic() - download_started
+        result['download_ms'] = round(download * 1e3, 3)
+        result['bytes_per_s'] = round(len(image) / download, 1) if download > 0 else None
+
+        if start:
+            step = 'start'
+            sdo_engine.download(node.id, PROGRAM_CONTROL, program, struct.pack('<B', CONTROL_START),
+                                CONTROL_TIMEOUT).result()
+        result['success'] = True
+    except Exception as e:
+        result['error'] = '%s: %s' % (step, e)
+    result['duration_ms'] = round((time.monotonic() - started) * 1e3, 3)
+    if publish is not None:
+        publish({'node_id': node.id, 'state': 'done' if result['success'] else 'failed',
+                 'transferred': result['transferred'], 'size': len(image), 'error': result['error']})
+    return result
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    frame_burst
+
+    Injection of many raw CAN frames with one request (fuzzing, load tests).
+    Frames are packed as BURST_FRAME records (CAN-ID, DLC, data, gap after
+    the frame) - sent within a binary frame (msgpack attachment or struct
+    payload) - and transmitted back to back, paced to a share of the bus
+    capacity computed from the length of every frame. TX errors are counted
+    instead of ending the burst.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import struct
+import time
+
+import can
+
+# Packed frame: CAN-ID (bit 31 = extended ID), DLC, data, gap after the frame (µs)
+BURST_FRAME = struct.Struct('<IB8sI')
+EXTENDED_FLAG = 0x80000000
+
+# Maximum number of frames per burst
+BURST_LIMIT = 100000
+
+# Share of the bus capacity used by a burst (0 = no pacing)
+BUS_LOAD = 0.8
+
+# Number of TX errors reported in detail
+ERROR_DETAILS = 10
+
+
+# ================================================================================
+def pack_frames(frames):
+    """ Pack (can_id, data[, gap_us]) tuples into one bytes payload (client side) """
+    packed = bytearray()
+    for frame in frames:
+        can_id, data = frame[0], bytes(frame[1])
+        gap = frame[2] if len(frame) > 2 else 0
+        packed += BURST_FRAME.pack(can_id, len(data), data, gap)
+    return bytes(packed)
+
+
+def unpack_frames(payload):
+    """ Unpack a payload into (can_id, extended, data, gap in seconds) tuples """
+    if len(payload) % BURST_FRAME.size:
+        raise ValueError('payload is not a multiple of %d bytes' % BURST_FRAME.size)
+    return [(can_id & ~EXTENDED_FLAG, bool(can_id & EXTENDED_FLAG), data[:min(dlc, 8)], gap * 1e-6)
+            for can_id, dlc, data, gap in BURST_FRAME.iter_unpack(payload)]
+
+
+def frame_bits(dlc, extended):
+    """ Bits of a frame on the bus (worst case bit stuffing) """
+    if extended:
+        return 8 * dlc + 64 + (54 + 8 * dlc - 1) // 4
+    return 8 * dlc + 44 + (34 + 8 * dlc - 1) // 4
+
+
+# ================================================================================
+def send_burst(network, frames, bitrate, bus_load=BUS_LOAD):
+    """ Transmit frames (see unpack_frames) paced to bus_load of bitrate
+
+    :return:
+        Dict with sent, errors, error_details, duration_ms, frames_per_s and bus_load.
+    """
+    # Everything is prepared before the first frame - the loop only sends and waits
+    messages = [(can.Message(arbitration_id=can_id, is_extended_id=extended, data=data),
+                 frame_bits(len(data), extended), gap) for can_id, extended, data, gap in frames]
+    bits_per_s = bitrate * bus_load if bus_load else None
+    bus = network.bus
+    sent = 0
+    errors = []
+    error_count = 0
+    total_bits = 0
+    started = time.perf_counter()
+    due = started
+    for position, (msg, bits, gap) in enumerate(messages):
+        now = time.perf_counter()
+        if due > now:
+            time.sleep(due - now)
+        try:
+            with network.send_lock:
+                bus.send(msg)
+        except can.CanError as e:
+            error_count += 1
+            if len(errors) < ERROR_DETAILS:
+                errors.append({'position': position, 'can_id': msg.arbitration_id, 'error': str(e)})
+        else:
+            sent += 1
+            total_bits += bits
+        # Token bucket on the bits sent - sleeping too long is caught up by the following frames
+        if bits_per_s:
+            due += bits / bits_per_s
+        if gap:
+            due = max(due, time.perf_counter()) + gap
+    duration = time.perf_counter() - started
+    return {'sent': sent, 'errors': error_count, 'error_details': errors,
+            'duration_ms': round(duration * 1e3, 3),
+            'frames_per_s': round(sent / duration, 1) if duration else None,
+            'bus_load': round(total_bits / duration / bitrate, 4) if duration else None}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    frame_recorder
+
+    Bounded ring buffer of all received CAN frames, fed by the notifier.
+    Frames are stored in preallocated arrays (id, dlc, 8 data bytes, timestamp)
+    instead of one object per frame, so recording is cheap and a query for
+    a time window is a binary search plus a slice.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import array
+import bisect
+import threading
+
+import can
+
+# Default number of frames kept
+CAPACITY = 100000
+
+# CAN-ID flag marking extended IDs within the recorder
+EXTENDED_FLAG = 0x80000000
+
+
+# ================================================================================
+class _Timestamps(object):
+    # Timestamps in chronological order (oldest first) - sequence view for bisect
+    __slots__ = ('recorder',)
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def __len__(self):
+        return self.recorder.count
+
+    def __getitem__(self, position):
+        return self.recorder.timestamps[self.recorder._slot(position)]
+
+
+# ================================================================================
+class FrameRecorder(can.Listener):
+    """ Listener (attached to the notifier) recording all frames into a ring buffer """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.can_ids = array.array('I', bytes(4 * capacity))
+        self.dlcs = array.array('B', bytes(capacity))
+        self.data = bytearray(8 * capacity)
+        self.timestamps = array.array('d', bytes(8 * capacity))
+        # Next slot written and number of valid frames
+        self.head = 0
+        self.count = 0
+        self.recorded = 0
+        self._guard = threading.Lock()
+
+    def _slot(self, position):
+        # Slot of the frame at position (0 = oldest frame)
+        return (self.head - self.count + position) % self.capacity
+
+    # Called from the notifier thread
+    def on_message_received(self, msg):
+        if msg.is_error_frame:
+            return
+        # Bytes actually received - remote frames (i.e. node guarding requests) have a DLC, but no data
+        data = bytes(msg.data[:8])
+        with self._guard:
+            slot = self.head
+            self.can_ids[slot] = msg.arbitration_id | (EXTENDED_FLAG if msg.is_extended_id else 0)
+            self.dlcs[slot] = len(data)
+            # Always exactly 8 bytes per slot - the buffer must never change its size
+            self.data[slot * 8:slot * 8 + 8] = data.ljust(8, b'\x00')
+            self.timestamps[slot] = msg.timestamp
+            self.head = (slot + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+            self.recorded += 1
+
+    def query(self, can_ids=None, start=None, end=None, limit=None, raw_data=False):
+        """ Return the frames received within [start, end] as columns
+
+        :param can_ids:
+            Set of CAN-IDs to return, None returns all frames.
+        :param float start:
+            Timestamp of the oldest frame to return (None = oldest recorded).
+        :param float end:
+            Timestamp of the newest frame to return (None = newest recorded).
+        :param int limit:
+            Return at most the newest limit frames.
+        :param boolean raw_data:
+            Return data as bytes (i.e. for decoding) instead of lists of ints.
+        :return:
+            Dict with the lists can_id, timestamp and data.
+        """
+        columns = {'can_id': [], 'timestamp': [], 'data': []}
+        with self._guard:
+            timestamps = _Timestamps(self)
+            first = 0 if start is None else bisect.bisect_left(timestamps, start)
+            last = self.count if end is None else bisect.bisect_right(timestamps, end)
+            positions = range(first, last)
+            if can_ids is not None:
+                can_ids = set(can_ids)
+                positions = [position for position in positions
+                             if self.can_ids[self._slot(position)] & ~EXTENDED_FLAG in can_ids]
+            if limit is not None:
+                positions = positions[-limit:] if limit else []
+            for position in positions:
+                slot = self._slot(position)
+                columns['can_id'].append(self.can_ids[slot] & ~EXTENDED_FLAG)
+                columns['timestamp'].append(self.timestamps[slot])
+                data = bytes(self.data[slot * 8:slot * 8 + self.dlcs[slot]])
+                columns['data'].append(data if raw_data else list(data))
+        return columns
+
+    def stats(self):
+        with self._guard:
+            oldest = self.timestamps[self._slot(0)] if self.count else None
+            newest = self.timestamps[self._slot(self.count - 1)] if self.count else None
+            return {'capacity': self.capacity, 'count': self.count, 'recorded': self.recorded,
+                    'overwritten': self.recorded - self.count, 'oldest': oldest, 'newest': newest}
+
+    def clear(self):
+        with self._guard:
+            self.count = 0
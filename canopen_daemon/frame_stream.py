@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    frame_stream
+
+    Streams received CAN frames of all buses via one ZMQ (X)PUB socket.
+    Clients register named ID/mask filters (optionally limited to one bus) -
+    filtering happens in the daemon, so only matching frames are published.
+    Matching frames are coalesced
+    into batches, one multipart message per filter and interval:
+
+    [b'can.<name>', header (count, sequence, dropped), packed frames]
+
+    Each packed frame is FRAME_STRUCT (timestamp, id, dlc, 8 data bytes).
+    Every filter has a bounded queue - when a burst exceeds it, frames are
+    dropped according to the filter's policy and counted. The socket is an
+    XPUB with XPUB_NODROP: a batch, which does not fit into the send queue of
+    a subscriber (SNDHWM), is not silently discarded by ZMQ, but counted as
+    dropped as well.
+
+    Events of the daemon (i.e. EMCYs) are published immediately on the same
+    socket as [b'event.<kind>', JSON object].
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import collections
+import json
+import struct
+import threading
+
+import can
+import zmq
+
+# Packed frame: timestamp, CAN-ID (bit 31 = extended ID), DLC, data
+FRAME_STRUCT = struct.Struct('<dIB8s')
+# Batch header: number of frames, sequence number of the batch, frames dropped so far
+HEADER_STRUCT = struct.Struct('<IQQ')
+EXTENDED_FLAG = 0x80000000
+
+# Topic prefix of published batches
+TOPIC_PREFIX = b'can.'
+
+# Topic prefix of published events
+EVENT_PREFIX = b'event.'
+
+# Events queued for the publisher (the oldest are dropped)
+EVENT_QUEUE_LIMIT = 10000
+
+# Interval in which matched frames are coalesced into one batch (seconds)
+COALESCE_INTERVAL = 0.01
+
+# Maximum number of frames per batch
+MAX_BATCH = 512
+
+# Default number of frames queued per filter
+QUEUE_LIMIT = 10000
+
+# Send high-water-mark of the XPUB socket (batches per subscriber)
+SNDHWM = 1000
+
+# Policies when the queue of a filter is full
+DROP_POLICIES = ('drop_oldest', 'drop_newest')
+
+# Masks matching a single CAN-ID
+_FULL_MASKS = (0x7FF, 0x1FFFFFFF)
+
+
+# ================================================================================
+def decode_batch(frames):
+    """ Decode a published batch - returns topic, sequence, dropped and list of (timestamp, can_id, data) """
+    topic, header, payload = frames
+    count, sequence, dropped = HEADER_STRUCT.unpack(header)
+    decoded = []
+    for timestamp, can_id, dlc, data in FRAME_STRUCT.iter_unpack(payload[:count * FRAME_STRUCT.size]):
+        decoded.append((timestamp, can_id & ~EXTENDED_FLAG, data[:dlc]))
+    return topic[len(TOPIC_PREFIX):].decode('utf-8'), sequence, dropped, decoded
+
+
+def decode_event(frames):
+    """ Decode a published event - returns kind and the event (dict) """
+    topic, payload = frames
+    return topic[len(EVENT_PREFIX):].decode('utf-8'), json.loads(payload.decode('utf-8'))
+
+
+# ================================================================================
+class StreamFilter(object):
+    """ Named ID/mask filter with its queue and counters """
+
+    __slots__ = ('name', 'topic', 'can_id', 'mask', 'bus', 'policy', 'queue', 'limit',
+                 'matched', 'published', 'dropped', 'batches')
+
+    def __init__(self, name, can_id, mask, limit=QUEUE_LIMIT, policy='drop_oldest', bus=None):
+        self.name = name
+        self.bus = bus
+        self.topic = TOPIC_PREFIX + name.encode('utf-8')
+        self.can_id = can_id & mask
+        self.mask = mask
+        self.policy = policy
+        self.limit = limit
+        # Bounded for drop_oldest - the append evicts the oldest frame atomically, the
+        # publisher thread pops from the other end concurrently
+        self.queue = collections.deque(maxlen=limit if policy == 'drop_oldest' else None)
+        self.matched = 0
+        self.published = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def push(self, msg):
+        self.matched += 1
+        if len(self.queue) >= self.limit:
+            self.dropped += 1
+            if self.policy == 'drop_newest':
+                return
+        self.queue.append(msg)
+
+    def stats(self):
+        return {'can_id': self.can_id, 'mask': self.mask, 'bus': self.bus, 'policy': self.policy,
+                'limit': self.limit, 'queued': len(self.queue), 'matched': self.matched, 'published': self.published,
+                'dropped': self.dropped, 'batches': self.batches}
+
+
+# ================================================================================
+class _BusListener(can.Listener):
+    # Listener attached to the notifier of one bus
+
+    def __init__(self, streamer, bus):
+        self.streamer = streamer
+        self.bus = bus
+
+    def on_message_received(self, msg):
+        self.streamer.on_message_received(msg, self.bus)
+
+    def stop(self):
+        # The streamer is shared and stopped by the daemon
+        pass
+
+
+# ================================================================================
+class FrameStreamer(object):
+    """ Publishes frames matching the filters via ZMQ PUB - fed by one listener per bus """
+
+    def __init__(self, context, endpoint, bind=True, public_endpoint=None):
+        """
+        :param context:
+            ZMQ context of the daemon.
+        :param str endpoint:
+            Endpoint of the XPUB socket, i.e. 'tcp://*:5556'.
+        :param boolean bind:
+            Bind the XPUB socket - otherwise connect it (i.e. to the broker of the sharded mode).
+        :param str public_endpoint:
+            Endpoint the clients subscribe to, if not endpoint (i.e. the one of the broker).
+        """
+        self.context = context
+        self.endpoint = endpoint
+        self.public_endpoint = public_endpoint or endpoint
+        self.bind = bind
+        self._filters = {}
+        # Filters by exact CAN-ID and filters with a mask - replaced as a whole (copy-on-write)
+        self._exact = {}
+        self._masked = ()
+        self._guard = threading.Lock()
+        self._events = collections.deque(maxlen=EVENT_QUEUE_LIMIT)
+        self.events_published = 0
+        self.events_dropped = 0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._publish_loop, name='frame-stream', daemon=True)
+        self._thread.start()
+
+    # ================================================================================
+    # Filter table (called from worker threads)
+
+    def add_filter(self, name, can_id, mask=0x7FF, limit=QUEUE_LIMIT, policy='drop_oldest', bus=None):
+        with self._guard:
+            self._filters[name] = StreamFilter(name, can_id, mask, limit, policy, bus)
+            self._rebuild()
+
+    def remove_filter(self, name):
+        with self._guard:
+            stream_filter = self._filters.pop(name, None)
+            self._rebuild()
+        return stream_filter is not None
+
+    def _rebuild(self):
+        exact = {}
+        masked = []
+        for stream_filter in self._filters.values():
+            if stream_filter.mask in _FULL_MASKS:
+                exact.setdefault(stream_filter.can_id, []).append(stream_filter)
+            else:
+                masked.append(stream_filter)
+        self._exact = exact
+        self._masked = tuple(masked)
+
+    def stats(self):
+        with self._guard:
+            return {name: stream_filter.stats() for name, stream_filter in self._filters.items()}
+
+    def listener(self, bus):
+        """ Return the listener to be attached to the notifier of bus """
+        return _BusListener(self, bus)
+
+    # ================================================================================
+    # Called from the notifier threads - O(1) for exact filters
+
+    def on_message_received(self, msg, bus=None):
+        can_id = msg.arbitration_id
+        for stream_filter in self._exact.get(can_id, ()):
+            if stream_filter.bus is None or stream_filter.bus == bus:
+                stream_filter.push(msg)
+        for stream_filter in self._masked:
+            if can_id & stream_filter.mask == stream_filter.can_id and stream_filter.bus in (None, bus):
+                stream_filter.push(msg)
+
+    # ================================================================================
+    # Events - called from any thread, published without waiting for the coalesce interval
+
+    def publish_event(self, kind, event):
+        if len(self._events) >= EVENT_QUEUE_LIMIT:
+            # The append below drops the oldest event
+            self.events_dropped += 1
+        self._events.append((EVENT_PREFIX + kind.encode('utf-8'), json.dumps(event).encode('utf-8')))
+        self._wakeup.set()
+
+    # ================================================================================
+    # Publisher thread - the only user of the XPUB socket
+
+    def _publish_loop(self):
+        socket = self.context.socket(zmq.XPUB)
+        socket.setsockopt(zmq.SNDHWM, SNDHWM)
+        # Report a full send queue (zmq.Again) instead of dropping the message silently
+        socket.setsockopt(zmq.XPUB_NODROP, 1)
+        if self.bind:
+            socket.bind(self.endpoint)
+        else:
+            socket.connect(self.endpoint)
+        sequence = 0
+        buffer = bytearray(FRAME_STRUCT.size * MAX_BATCH)
+        while not self._stop.is_set():
+            self._wakeup.wait(COALESCE_INTERVAL)
+            self._wakeup.clear()
+            # Subscriptions arrive as messages - filtering is done by ZMQ, they are only consumed
+            while socket.poll(0, zmq.POLLIN):
+                socket.recv_multipart()
+            while self._events:
+                try:
+                    socket.send_multipart(list(self._events.popleft()), flags=zmq.NOBLOCK)
+                    self.events_published += 1
+                except zmq.Again:
+                    # High-water-mark reached
+                    self.events_dropped += 1
+            for stream_filter in list(self._filters.values()):
+                while stream_filter.queue:
+                    count = 0
+                    while count < MAX_BATCH and stream_filter.queue:
+                        msg = stream_filter.queue.popleft()
+                        can_id = msg.arbitration_id | (EXTENDED_FLAG if msg.is_extended_id else 0)
+                        FRAME_STRUCT.pack_into(buffer, count * FRAME_STRUCT.size, msg.timestamp, can_id,
+                                               msg.dlc, bytes(msg.data))
+                        count += 1
+                    sequence += 1
+                    header = HEADER_STRUCT.pack(count, sequence, stream_filter.dropped)
+                    try:
+                        socket.send_multipart([stream_filter.topic, header,
+                                               bytes(buffer[:count * FRAME_STRUCT.size])],
+                                              flags=zmq.NOBLOCK)
+                    except zmq.Again:
+                        # High-water-mark reached
+                        stream_filter.dropped += count
+                        continue
+                    stream_filter.published += count
+                    stream_filter.batches += 1
+        socket.close(linger=0)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
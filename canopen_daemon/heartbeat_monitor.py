@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    heartbeat_monitor
+
+    Liveness and NMT state of all nodes of one bus, from their heartbeat /
+    node guarding frames (0x701 ... 0x77F) - one dict lookup per frame.
+    Heartbeat loss is detected by a checker thread: a node is lost, when no
+    frame arrived within LOSS_FACTOR times its period (configured via
+    0x1017 or learned from the frames).
+
+    NMT state changes and heartbeat loss / return are pushed to subscribers
+    of the stream socket (topics 'event.nmt' and 'event.heartbeat'), and
+    waiters for a state are woken the moment the frame arrives.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import threading
+import time
+
+import can
+
+HEARTBEAT_BASE = 0x700
+
+# NMT states reported in heartbeats (bit 7 is the toggle bit of node guarding)
+NMT_STATES = {0x00: 'INITIALISING', 0x04: 'STOPPED', 0x05: 'OPERATIONAL', 0x7F: 'PRE-OPERATIONAL'}
+
+# State expected after an NMT command (a reset ends with the boot-up message)
+COMMAND_STATES = {'OPERATIONAL': 'OPERATIONAL', 'STOPPED': 'STOPPED', 'PRE-OPERATIONAL': 'PRE-OPERATIONAL',
+                  'INITIALISING': 'INITIALISING', 'RESET': 'INITIALISING', 'RESET COMMUNICATION': 'INITIALISING'}
+
+# A node is lost after LOSS_FACTOR times its heartbeat period without a frame
+LOSS_FACTOR = 1.5
+
+# Interval of the loss check (seconds)
+CHECK_INTERVAL = 0.05
+
+
+# ================================================================================
+class _NodeState(object):
+    __slots__ = ('node_id', 'state', 'last_seen', 'timestamp', 'period', 'expected_period', 'alive',
+                 'count', 'changes', 'losses')
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.state = None
+        self.last_seen = None
+        self.timestamp = None
+        # Learned period (smoothed) and the period configured via 0x1017 (seconds)
+        self.period = None
+        self.expected_period = None
+        self.alive = False
+        self.count = 0
+        self.changes = 0
+        self.losses = 0
+
+    def timeout(self):
+        period = self.expected_period or self.period
+        return period * LOSS_FACTOR if period else None
+
+    def info(self, now):
+        return {'node_id': self.node_id, 'state': self.state, 'alive': self.alive,
+                'age_ms': round((now - self.last_seen) * 1e3, 3) if self.last_seen is not None else None,
+                'timestamp': self.timestamp,
+                'period_ms': round(self.period * 1e3, 3) if self.period else None,
+                'expected_period_ms': round(self.expected_period * 1e3, 3) if self.expected_period else None,
+                'count': self.count, 'changes': self.changes, 'losses': self.losses}
+
+
+# ================================================================================
+class HeartbeatMonitor(can.Listener):
+    """ Listener (attached to the notifier) keeping the state table of all nodes """
+
+    def __init__(self, bus_name, streamer=None):
+        self.bus_name = bus_name
+        self.streamer = streamer
+        self._nodes = {}
+        # Callables callback(node_id, alive) notified of heartbeat loss / return
+        self._callbacks = []
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._check_loop, name='heartbeat-' + bus_name, daemon=True)
+        self._thread.start()
+
+    def _node(self, node_id):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = _NodeState(node_id)
+        return node
+
+    def _publish(self, kind, event):
+        if kind == 'heartbeat':
+            for callback in self._callbacks:
+                callback(event['node_id'], event['event'] == 'restored')
+        if self.streamer is not None:
+            event['bus'] = self.bus_name
+            self.streamer.publish_event(kind, event)
+
+    def add_callback(self, callback):
+        """ Call callback(node_id, alive) on every heartbeat loss / return """
+        self._callbacks.append(callback)
+
+    # Called from the notifier thread
+    def on_message_received(self, msg):
+        node_id = msg.arbitration_id - HEARTBEAT_BASE
+        # Remote frames (node guarding requests) carry no state - an exception here would end the notifier
+        if msg.is_extended_id or msg.is_remote_frame or not 1 <= node_id <= 127 or not msg.data:
+            return
+        now = time.monotonic()
+        state = NMT_STATES.get(msg.data[0] & 0x7F, 'UNKNOWN')
+        events = []
+        with self._condition:
+            node = self._node(node_id)
+            if node.last_seen is not None and state != 'INITIALISING':
+                interval = now - node.last_seen
+                node.period = interval if node.period is None else 0.8 * node.period + 0.2 * interval
+            previous = node.state
+            node.last_seen = now
+            node.timestamp = msg.timestamp
+            node.count += 1
+            if not node.alive:
+                node.alive = True
+                if node.losses:
+                    events.append(('heartbeat', {'node_id': node_id, 'event': 'restored', 'state': state,
+                                                 'timestamp': msg.timestamp}))
+            if state != previous:
+                node.state = state
+                node.changes += 1
+                events.append(('nmt', {'node_id': node_id, 'state': state, 'previous': previous,
+                                       'timestamp': msg.timestamp}))
+            self._condition.notify_all()
+        for kind, event in events:
+            self._publish(kind, event)
+
+    def _check_loop(self):
+        while not self._stop.wait(CHECK_INTERVAL):
+            now = time.monotonic()
+            lost = []
+            with self._condition:
+                for node in self._nodes.values():
+                    timeout = node.timeout()
+                    if node.alive and timeout is not None and now - node.last_seen > timeout:
+                        node.alive = False
+                        node.losses += 1
+                        lost.append({'node_id': node.node_id, 'event': 'lost', 'state': node.state,
+                                     'silent_ms': round((now - node.last_seen) * 1e3, 3)})
+                if lost:
+                    self._condition.notify_all()
+            for event in lost:
+                self._publish('heartbeat', event)
+
+    def stop(self):
+        """ Stop the loss check (also called by the notifier on shutdown) """
+        self._stop.set()
+
+    # ================================================================================
+    # Called from worker threads
+
+    def expect(self, node_id, period):
+        """ Heartbeat period of a node in seconds (0 = learn it from the frames) """
+        with self._condition:
+            self._node(node_id).expected_period = period or None
+
+    def states(self, node_ids=None):
+        now = time.monotonic()
+        with self._condition:
+            if node_ids is None:
+                node_ids = sorted(self._nodes)
+            return {node_id: self._nodes.get(node_id, _NodeState(node_id)).info(now) for node_id in node_ids}
+
+    def alive(self):
+        """ Node-IDs of all nodes with a current heartbeat """
+        with self._condition:
+            return sorted(node_id for node_id, node in self._nodes.items() if node.alive)
+
+    def wait_states(self, targets, timeout, since=None):
+        """ Wait until every node reached its target state
+
+        :param targets:
+            Dict node_id -> state name.
+        :param float since:
+            Only heartbeats received after this time (time.monotonic()) confirm a state.
+        :return:
+            Dict node_id -> time of confirmation (seconds since the call) or None.
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        reached = {}
+        with self._condition:
+            while True:
+                for node_id, state in targets.items():
+                    if node_id in reached:
+                        continue
+                    # Not heard of yet - not reached (and not registered as a node)
+                    node = self._nodes.get(node_id)
+                    if node is not None and node.state == state and node.alive and (since is None or node.last_seen > since):
+                        reached[node_id] = round(max(node.last_seen - started, 0.0), 6)
+                remaining = deadline - time.monotonic()
+                if len(reached) == len(targets) or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return {node_id: reached.get(node_id) for node_id in targets}
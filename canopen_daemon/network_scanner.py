@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    network_scanner
+
+    Scan engine finding nodes via SDO upload requests of 0x1000 (Device Type).
+    The requests are paced to the capacity of the bus, the scan returns as soon
+    as all expected nodes answered or an adaptive quiet time elapsed (instead
+    of a fixed 1 s sleep) and the identity object 0x1018 of the found nodes
+    can be read in parallel (one request per node in flight).
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import struct
+import threading
+import time
+
+# Bits of a standard 8 byte frame on the bus (incl. worst case bit stuffing)
+FRAME_BITS = 135
+
+# Share of the bus capacity used by the scan requests
+BUS_LOAD = 0.5
+
+# Quiet time (no further response) ending the scan = max(MIN_QUIET_TIME, QUIET_FACTOR * slowest response)
+MIN_QUIET_TIME = 0.05
+QUIET_FACTOR = 3.0
+
+# Hard limit of the response phase (seconds)
+TIMEOUT = 1.0
+
+# SDO request / response
+SDO_REQUEST = struct.Struct('<BHB4x')
+SDO_UPLOAD_REQUEST = 0x40
+
+# Subindices of the identity object 0x1018
+IDENTITY_OBJECTS = ((1, 'vendor_id'), (2, 'product_code'), (3, 'revision'), (4, 'serial'))
+
+
+# ================================================================================
+class NetworkScanner(object):
+    """ Scans a :class:`canopen.Network` for nodes """
+
+    def __init__(self, network, bitrate=250000, bus_load=BUS_LOAD):
+        self.network = network
+        # Minimum interval between two scan requests
+        self.frame_interval = FRAME_BITS / float(bitrate) / bus_load
+        self._condition = threading.Condition()
+        self._sent = {}
+        self._responses = {}
+        self._mux = None
+
+    # Called from the notifier thread for every SDO response (0x580 + node_id)
+    def _on_response(self, can_id, data, timestamp):
+        received = time.perf_counter()
+        node_id = can_id - 0x580
+        with self._condition:
+            if node_id not in self._sent or node_id in self._responses:
+                return
+            if len(data) < 4 or bytes(data[1:4]) != self._mux:
+                # Response to some other SDO request
+                return
+            self._responses[node_id] = (received, bytes(data))
+            self._condition.notify_all()
+
+    def _transfer(self, node_ids, index, subindex, expected, timeout):
+        # Send one SDO upload request to each node (paced) and collect the responses
+        request = SDO_REQUEST.pack(SDO_UPLOAD_REQUEST, index, subindex)
+        with self._condition:
+            self._sent = {}
+            self._responses = {}
+            self._mux = request[1:4]
+        start = time.perf_counter()
+
+        # Token bucket - a burst of requests is allowed after a coarse sleep (i.e. on Windows)
+        sent_count = 0
+        node_ids = list(node_ids)
+        while sent_count < len(node_ids):
+            allowed = int((time.perf_counter() - start) / self.frame_interval) + 1
+            while sent_count < min(allowed, len(node_ids)):
+                node_id = node_ids[sent_count]
+                with self._condition:
+                    self._sent[node_id] = time.perf_counter()
+                self.network.send_message(0x600 + node_id, request)
+                sent_count += 1
+            if sent_count < len(node_ids):
+                time.sleep(self.frame_interval)
+        last_event = time.perf_counter()
+
+        # Wait for responses - end early when all expected nodes answered or the bus got quiet
+        with self._condition:
+            while True:
+                now = time.perf_counter()
+                if expected and expected.issubset(self._responses):
+                    break
+                slowest = max([received - self._sent[node_id]
+                               for node_id, (received, data) in self._responses.items()] or [0])
+                if self._responses:
+                    last_event = max(last_event, max(received for received, data in self._responses.values()))
+                quiet_time = max(MIN_QUIET_TIME, QUIET_FACTOR * slowest)
+                remaining = min(last_event + quiet_time, start + timeout) - now
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            results = {node_id: (received - self._sent[node_id], data)
+                       for node_id, (received, data) in self._responses.items()}
+            self._sent = {}
+        return results
+
+    def scan(self, limit=127, expected=None, timeout=TIMEOUT, identity=False):
+        """ Scan node IDs 1 ... limit
+
+        :param int limit:
+            Highest node ID scanned.
+        :param expected:
+            Node IDs expected - the scan ends as soon as all of them answered.
+        :param float timeout:
+            Maximum duration of the response phase in seconds.
+        :param boolean identity:
+            Read vendor ID, product code, revision and serial (0x1018) of the found nodes.
+        :return:
+            Dict with nodes, latency_ms (per node), identity (per node) and duration_ms.
+        """
+        expected = set(expected or ())
+        started = time.perf_counter()
+        node_ids = range(1, limit + 1)
+        for node_id in node_ids:
+            self.network.subscribe(0x580 + node_id, self._on_response)
+        try:
+            found = self._transfer(node_ids, 0x1000, 0x00, expected, timeout)
+            # Any response (even an SDO abort) proves the node is present
+            nodes = sorted(found)
+            result = {'nodes': nodes,
+                      'latency_ms': {node_id: round(found[node_id][0] * 1e3, 3) for node_id in nodes}}
+            if identity:
+                result['identity'] = self._read_identity(nodes, timeout)
+        finally:
+            for node_id in node_ids:
+                self.network.unsubscribe(0x580 + node_id, self._on_response)
+        result['duration_ms'] = round((time.perf_counter() - started) * 1e3, 3)
+        return result
+
+    def _read_identity(self, nodes, timeout):
+        # One subindex per round, all nodes in parallel
+        identity = {node_id: {} for node_id in nodes}
+        for subindex, name in IDENTITY_OBJECTS:
+            responses = self._transfer(nodes, 0x1018, subindex, set(nodes), timeout)
+            for node_id in nodes:
+                value = None
+                if node_id in responses:
+                    data = responses[node_id][1]
+                    command = data[0]
+                    if command & 0xE0 == 0x40 and command & 0x02:
+                        # Expedited upload response - size indicated in bits 2/3
+                        size = 4 - ((command >> 2) & 0x03) if command & 0x01 else 4
+                        value = int.from_bytes(data[4:4 + size], 'little')
+                identity[node_id][name] = value
+        return identity
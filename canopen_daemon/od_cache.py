@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    od_cache
+
+    Cache of parsed object dictionaries (EDS files), keyed by the hash of the
+    file content. Nodes sharing an EDS share one :class:`canopen.ObjectDictionary`
+    instead of re-parsing the file for every add_node.
+
+    The file is only re-read (and re-hashed), when its mtime or size changed.
+    Optionally, parsed dictionaries are pickled to a cache directory, so a
+    restarted daemon does not parse its EDS files again. Pickles are named
+    after the source path and content hash - when an edited file is stored,
+    the pickles of its older contents are removed.
+
+    EDS files using $NODEID (i.e. in COB-ID defaults) are parsed per node ID,
+    since the parsed default values depend on it.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import glob
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+import canopen
+
+
+# ================================================================================
+class ObjectDictionaryCache(object):
+    """ Content-hash keyed cache of parsed object dictionaries """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param str cache_dir:
+            Directory for pickled object dictionaries, None keeps them in memory only.
+        """
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # path -> (mtime, size, content hash, uses $NODEID)
+        self._files = {}
+        # (content hash, node_id or None) -> ObjectDictionary
+        self._dictionaries = {}
+        self._guard = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.parse_time = 0.0
+
+    def _identify(self, path):
+        # Hash the file only, if it changed since it was seen last
+        stat = os.stat(path)
+        known = self._files.get(path)
+        if known is not None and known[0] == stat.st_mtime and known[1] == stat.st_size:
+            return known[2], known[3]
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        identity = (stat.st_mtime, stat.st_size, hashlib.sha1(content).hexdigest(), b'$NODEID' in content.upper())
+        self._files[path] = identity
+        return identity[2], identity[3]
+
+    def _source_tag(self, path):
+        # Pickles of one source file share this prefix
+        return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+
+    def _pickle_path(self, path, key):
+        content_hash, node_id = key
+        name = content_hash if node_id is None else '%s-%d' % (content_hash, node_id)
+        # Pickles are only valid for the version of python-canopen which created them
+        return os.path.join(self.cache_dir, '%s-%s-%s.pickle' % (self._source_tag(path), name, canopen.__version__))
+
+    def _evict(self, path, content_hash):
+        # Remove pickles of older contents of the file (and of other python-canopen versions)
+        current = os.path.join(self.cache_dir, '%s-%s' % (self._source_tag(path), content_hash))
+        suffix = '-%s.pickle' % canopen.__version__
+        for stale in glob.glob(os.path.join(self.cache_dir, '%s-*.pickle' % self._source_tag(path))):
+            if not stale.startswith(current) or not stale.endswith(suffix):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def _load(self, path, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._pickle_path(path, key), 'rb') as fp:
+                return pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+    def _store(self, path, key, od):
+        if self.cache_dir is None:
+            return
+        pickle_path = self._pickle_path(path, key)
+        try:
+            with open(pickle_path + '.tmp', 'wb') as fp:
+                pickle.dump(od, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(pickle_path + '.tmp', pickle_path)
+        except (OSError, pickle.PicklingError, RecursionError):
+            # The in-memory cache still works
+            return
+        self._evict(path, key[0])
+
+    def get(self, path, node_id=None):
+        """ Return the parsed object dictionary of the EDS file at path
+
+        :param str path:
+            Path of the EDS file.
+        :param int node_id:
+            Node ID the dictionary is used for (only relevant for $NODEID).
+        :rtype: canopen.ObjectDictionary
+        """
+        with self._guard:
+            content_hash, relative = self._identify(path)
+            key = (content_hash, node_id if relative else None)
+            od = self._dictionaries.get(key)
+            if od is not None:
+                self.hits += 1
+                return od
+            od = self._load(path, key)
+            if od is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                started = time.perf_counter()
+                od = canopen.import_od(path, node_id)
+                self.parse_time += time.perf_counter() - started
+                self._store(path, key, od)
+            self._dictionaries[key] = od
+            return od
+
+    def clear(self):
+        with self._guard:
+            self._files.clear()
+            self._dictionaries.clear()
+
+    def stats(self):
+        with self._guard:
+            return {'files': len(self._files), 'dictionaries': len(self._dictionaries),
+                    'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'parse_time_ms': round(self.parse_time * 1e3, 3), 'cache_dir': self.cache_dir}
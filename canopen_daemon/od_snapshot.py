@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    od_snapshot
+
+    Snapshot of all readable objects of a node, as described by its object
+    dictionary (EDS). Each entry is uploaded once with the cheapest transfer:
+    expedited / segmented via the SDO engine of the bus (adaptive timeout,
+    circuit breaker) and block upload for DOMAIN objects. The snapshot maps
+    'IIII:SS' (hex index and subindex) to the raw value as hex string -
+    compact and diffable against a golden snapshot.
+
+    Objects aborted by the node are reported per entry, a node which stops
+    answering aborts the whole snapshot.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import binascii
+import time
+
+import canopen
+from canopen.objectdictionary import Variable, DOMAIN
+
+# Access types of readable objects
+READABLE_ACCESS = ('ro', 'rw', 'rwr', 'rww', 'const')
+
+
+# ================================================================================
+def snapshot_key(index, subindex):
+    return '%04X:%02X' % (index, subindex)
+
+
+def readable_variables(od):
+    """ Return all readable variables of an object dictionary, ordered by index and subindex """
+    variables = []
+    for index in od:
+        obj = od[index]
+        entries = [obj] if isinstance(obj, Variable) else [obj[subindex] for subindex in obj]
+        for var in entries:
+            if var.access_type in READABLE_ACCESS:
+                variables.append(var)
+    return variables
+
+
+def _upload(sdo_engine, node, var, block_transfer):
+    if block_transfer and var.data_type == DOMAIN:
+        try:
+            fp = node.sdo.open(var.index, var.subindex, 'rb', block_transfer=True)
+            try:
+                return fp.read()
+            finally:
+                fp.close()
+        except canopen.SdoAbortedError:
+            # Node does not support block transfer - fall back to segmented transfer
+            pass
+    return sdo_engine.upload(node.id, var.index, var.subindex).result()
+
+
+def take_snapshot(sdo_engine, node, block_transfer=True):
+    """ Upload all readable objects of node
+
+    :param sdo_engine:
+        :class:`sdo_engine.SdoEngine` of the bus of node.
+    :param node:
+        :class:`canopen.RemoteNode` to read from.
+    :param boolean block_transfer:
+        Use block upload for DOMAIN objects.
+    :return:
+        Dict with snapshot (key -> hex value), errors (key -> abort message),
+        entries, bytes and duration_ms.
+    :raises canopen.SdoCommunicationError:
+        On the first object the node did not answer - every further upload would time out as well.
+    """
+    snapshot = {}
+    errors = {}
+    size = 0
+    started = time.perf_counter()
+    for var in readable_variables(node.object_dictionary):
+        key = snapshot_key(var.index, var.subindex)
+        try:
+            data = _upload(sdo_engine, node, var, block_transfer)
+        except canopen.SdoAbortedError as e:
+            errors[key] = str(e)
+            continue
+        snapshot[key] = binascii.hexlify(data).decode('ascii')
+        size += len(data)
+    return {'snapshot': snapshot, 'errors': errors, 'entries': len(snapshot), 'bytes': size,
+            'duration_ms': round((time.perf_counter() - started) * 1e3, 3)}
+
+
+def diff_snapshots(golden, snapshot, ignore=()):
+    """ Compare a snapshot with a golden snapshot
+
+    :return:
+        Dict key -> {'expected': ..., 'actual': ...} of all differing entries
+        (None marks an entry missing on one side).
+    """
+    ignore = set(key.upper() for key in ignore)
+    golden = {key.upper(): value.lower() if isinstance(value, str) else value for key, value in golden.items()}
+    diff = {}
+    for key in sorted(set(golden) | set(snapshot)):
+        if key in ignore:
+            continue
+        expected = golden.get(key)
+        actual = snapshot.get(key)
+        if expected != actual:
+            diff[key] = {'expected': expected, 'actual': actual}
+    return diff
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    pdo_cache
+
+    Latest decoded value of every variable mapped into a received PDO.
+    The cache is attached to the PDO maps of python-canopen and updated from
+    their callbacks (notifier thread), so reading a process value costs no
+    bus traffic - instead of polling it via SDO. Every entry keeps the time
+    of reception, so readers see how old a sample is. Frames are decoded by
+    the compiled decoder of the PDO (see pdo_decoder), if its mapping has one.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import threading
+import time
+
+import pdo_decoder
+
+
+# ================================================================================
+class PdoValueCache(object):
+    """ Values of the PDO mapped variables of all nodes of one bus """
+
+    def __init__(self):
+        # (node_id, index, subindex) -> (value, timestamp of the frame, time received, count)
+        self._values = {}
+        # id(pdo_map) -> (pdo_map, callback, decoder) of the attached maps
+        self._attached = {}
+        # COB-ID -> compiled decoder of the attached maps
+        self.decoders = {}
+        self._guard = threading.Lock()
+
+    # ================================================================================
+    # Maps (called from worker threads)
+
+    def attach(self, node_id, pdo_map):
+        """ Update the cache from every reception of pdo_map
+
+        Call again after the mapping (or COB-ID) changed - the decoder is compiled anew.
+        """
+        with self._guard:
+            previous = self._attached.pop(id(pdo_map), None)
+            if previous is not None:
+                self._forget(pdo_map, previous)
+            # Compiled decoder or None (decoded via python-canopen)
+            decoder = pdo_decoder.compile_map(pdo_map)
+            if decoder is not None:
+                self.decoders[decoder.cob_id] = decoder
+
+            def callback(received_map):
+                self._update(node_id, received_map, decoder)
+
+            pdo_map.add_callback(callback)
+            self._attached[id(pdo_map)] = (pdo_map, callback, decoder)
+        return decoder
+
+    def detach(self, pdo_map):
+        with self._guard:
+            attached = self._attached.pop(id(pdo_map), None)
+            if attached is not None:
+                self._forget(pdo_map, attached)
+
+    def _forget(self, pdo_map, attached):
+        # Remove callback and decoder of an attachment - the decoder under the COB-ID it was compiled for
+        try:
+            pdo_map.callbacks.remove(attached[1])
+        except ValueError:
+            pass
+        decoder = attached[2]
+        if decoder is not None and self.decoders.get(decoder.cob_id) is decoder:
+            del self.decoders[decoder.cob_id]
+
+    # ================================================================================
+    # Called from the notifier thread
+
+    def _update(self, node_id, pdo_map, decoder):
+        received = time.monotonic()
+        timestamp = pdo_map.timestamp
+        values = self._values
+        if decoder is not None and len(pdo_map.data) >= decoder.size:
+            # One unpack for the whole frame
+            decoded = zip(decoder.keys, decoder.decode(pdo_map.data))
+        else:
+            decoded = (((var.index, var.subindex), var.raw) for var in pdo_map.map)
+        for (index, subindex), value in decoded:
+            key = (node_id, index, subindex)
+            previous = values.get(key)
+            values[key] = (value, timestamp, received, previous[3] + 1 if previous else 1)
+
+    # ================================================================================
+    # Queries - no bus traffic
+
+    def _entry(self, key, entry, now):
+        value, timestamp, received, count = entry
+        return {'node_id': key[0], 'index': key[1], 'subindex': key[2], 'value': value,
+                'timestamp': timestamp, 'age_ms': round((now - received) * 1e3, 3), 'count': count}
+
+    def get(self, node_id, index, subindex):
+        """ Latest sample of one variable, None if it was never received """
+        entry = self._values.get((node_id, index, subindex))
+        if entry is None:
+            return None
+        return self._entry((node_id, index, subindex), entry, time.monotonic())
+
+    def entries(self, node_id=None):
+        """ Latest samples of all variables (of one node) """
+        now = time.monotonic()
+        return [self._entry(key, entry, now) for key, entry in sorted(self._values.items())
+                if node_id is None or key[0] == node_id]
+
+    def clear(self, node_id=None):
+        with self._guard:
+            for key in list(self._values):
+                if node_id is None or key[0] == node_id:
+                    del self._values[key]
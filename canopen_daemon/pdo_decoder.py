@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    pdo_decoder
+
+    PDO mappings compiled into one precomputed struct.Struct per COB-ID, so a
+    received PDO is decoded with a single unpack instead of one object
+    dictionary access per mapped variable. Buffered frames (i.e. from the
+    frame recorder) are decoded in one pass into columns - as numpy arrays,
+    if numpy is installed.
+
+    Mappings with variables not matching a struct format (bit fields,
+    24 bit integers, strings, ...) are not compiled - their frames are
+    decoded via python-canopen.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import struct
+
+from canopen.objectdictionary import datatypes
+
+# numpy is optional - without it batches are decoded into lists
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# struct format of the CANopen data types with a fixed size (little endian)
+STRUCT_CODES = {
+    datatypes.BOOLEAN: '?',
+    datatypes.INTEGER8: 'b',
+    datatypes.INTEGER16: 'h',
+    datatypes.INTEGER32: 'i',
+    datatypes.INTEGER64: 'q',
+    datatypes.UNSIGNED8: 'B',
+    datatypes.UNSIGNED16: 'H',
+    datatypes.UNSIGNED32: 'I',
+    datatypes.UNSIGNED64: 'Q',
+    datatypes.REAL32: 'f',
+    datatypes.REAL64: 'd',
+}
+
+
+# ================================================================================
+def variable_key(index, subindex):
+    return '%04X:%02X' % (index, subindex)
+
+
+class PdoDecoder(object):
+    """ Compiled decoder of the frames of one PDO """
+
+    __slots__ = ('cob_id', 'keys', 'struct', 'dtype')
+
+    def __init__(self, cob_id, keys, fmt):
+        """
+        :param int cob_id:
+            COB-ID of the PDO.
+        :param keys:
+            (index, subindex) of the mapped variables, in mapping order.
+        :param str fmt:
+            struct format of the whole PDO, i.e. '<II'.
+        """
+        self.cob_id = cob_id
+        self.keys = tuple(keys)
+        self.struct = struct.Struct(fmt)
+        if numpy is not None:
+            self.dtype = numpy.dtype([(variable_key(*key), '<' + code) for key, code in zip(self.keys, fmt[1:])])
+        else:
+            self.dtype = None
+
+    @property
+    def size(self):
+        return self.struct.size
+
+    def decode(self, data):
+        """ Values of the mapped variables (tuple in mapping order) """
+        return self.struct.unpack_from(data)
+
+    def decode_batch(self, payloads):
+        """ Decode many frames at once
+
+        :param payloads:
+            Data of the frames (bytes). Frames shorter than the mapping are skipped.
+        :return:
+            Tuple (columns, skipped) - columns maps 'IIII:SS' to the values of all
+            frames (numpy arrays, if numpy is installed, otherwise lists).
+        """
+        size = self.struct.size
+        valid = [payload[:size] for payload in payloads if len(payload) >= size]
+        buffer = b''.join(valid)
+        names = [variable_key(*key) for key in self.keys]
+        if self.dtype is not None:
+            records = numpy.frombuffer(buffer, dtype=self.dtype)
+            columns = {name: records[name] for name in names}
+        elif valid:
+            columns = dict(zip(names, (list(column) for column in zip(*self.struct.iter_unpack(buffer)))))
+        else:
+            columns = {name: [] for name in names}
+        return columns, len(payloads) - len(valid)
+
+
+# ================================================================================
+def compile_map(pdo_map):
+    """ Compile a python-canopen PDO map - returns None, if it has no struct layout """
+    if pdo_map.cob_id is None or not pdo_map.map:
+        return None
+    fmt = '<'
+    for var in pdo_map.map:
+        code = STRUCT_CODES.get(var.od.data_type)
+        if code is None or struct.calcsize('<' + code) * 8 != var.length:
+            return None
+        fmt += code
+    return PdoDecoder(pdo_map.cob_id, [(var.index, var.subindex) for var in pdo_map.map], fmt)
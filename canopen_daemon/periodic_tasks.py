@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    periodic_tasks
+
+    Named cyclic transmissions of raw CAN frames on one bus (i.e. heartbeat
+    emulation, periodic command frames). Frames are sent by python-can's
+    send_periodic - on socketcan by the kernel broadcast manager - so no
+    Python or ZMQ work is done per frame. Data of a running task is updated
+    in place.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import threading
+import time
+
+
+# ================================================================================
+class _PeriodicTask(object):
+    __slots__ = ('name', 'can_id', 'data', 'period', 'task', 'started', 'updates')
+
+    def __init__(self, name, can_id, data, period, task):
+        self.name = name
+        self.can_id = can_id
+        self.data = data
+        self.period = period
+        self.task = task
+        self.started = time.time()
+        self.updates = 0
+
+    def info(self):
+        return {'name': self.name, 'can_id': self.can_id, 'data': list(self.data), 'period': self.period,
+                'started': self.started, 'updates': self.updates}
+
+
+# ================================================================================
+class PeriodicTasks(object):
+    """ Cyclic transmissions of one bus, by name """
+
+    def __init__(self, network, bustype):
+        self.network = network
+        # Cyclic transmissions are done by the kernel on socketcan
+        self.kernel = bustype == 'socketcan'
+        self._tasks = {}
+        self._guard = threading.Lock()
+
+    def start(self, name, can_id, data, period):
+        """ Send can_id / data every period seconds
+
+        A task of the same name is replaced - with the same CAN-ID and period,
+        only its data is updated (no gap in the transmission).
+        """
+        data = bytes(data)
+        with self._guard:
+            running = self._tasks.get(name)
+            if running is not None and running.can_id == can_id and running.period == period:
+                self._update(running, data)
+                return running
+            if running is not None:
+                running.task.stop()
+            entry = _PeriodicTask(name, can_id, data, period, self.network.send_periodic(can_id, data, period))
+            self._tasks[name] = entry
+            return entry
+
+    def _update(self, entry, data):
+        entry.task.update(data)
+        entry.data = data
+        entry.updates += 1
+
+    def update(self, name, data):
+        """ Replace the data of a running task in place - returns False for unknown names """
+        with self._guard:
+            entry = self._tasks.get(name)
+            if entry is None:
+                return False
+            self._update(entry, bytes(data))
+            return True
+
+    def stop(self, name=None):
+        """ Stop one task (or all tasks) - returns the names stopped """
+        with self._guard:
+            names = list(self._tasks) if name is None else [name] if name in self._tasks else []
+            for stopped in names:
+                self._tasks.pop(stopped).task.stop()
+            return names
+
+    def tasks(self):
+        with self._guard:
+            return [entry.info() for entry in self._tasks.values()]
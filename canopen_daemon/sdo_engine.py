@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    sdo_engine
+
+    Future based SDO client (expedited and segmented transfers).
+    Every node has at most one outstanding transfer - further transfers to
+    the same node are queued - while any number of nodes are in flight at
+    once. Requests are sent without waiting, responses are handled in the
+    notifier thread and complete the futures, so reading the same object
+    from 20 nodes takes about one SDO round trip instead of 20.
+
+    Timeouts adapt per node: the p99 of the recent response latencies times
+    TIMEOUT_FACTOR (bounded by MIN_TIMEOUT / MAX_TIMEOUT). Unanswered initiate
+    requests are retried with backoff. A circuit breaker fast-fails nodes,
+    which failed BREAKER_FAILURES transfers in a row or whose heartbeat was
+    lost (as reported by the heartbeat monitor of the bus), so a dead node
+    does not cost a full timeout on every request. After the cooldown one
+    probe transfer is let through, its outcome closes or opens the breaker.
+    After a retried transfer, the next transfer to the node waits until late
+    answers to the first attempts had time to arrive (and are dropped).
+
+    Block transfers are not handled here (see sdo.open(..., block_transfer=True)).
+    While a block transfer holds the SDO server of a node (see hold()), transfers
+    to that node are rejected.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import bisect
+import collections
+import heapq
+import itertools
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import canopen
+
+# Time to wait for each SDO response until enough latencies are known (seconds)
+RESPONSE_TIMEOUT = 0.3
+
+# Adaptive timeout: p99 of the last LATENCY_SAMPLES latencies * TIMEOUT_FACTOR
+LATENCY_SAMPLES = 200
+MIN_SAMPLES = 20
+TIMEOUT_FACTOR = 3.0
+MIN_TIMEOUT = 0.02
+MAX_TIMEOUT = 1.0
+
+# Retries of unanswered initiate requests, each waiting BACKOFF times longer
+MAX_RETRIES = 2
+BACKOFF = 2.0
+
+# Circuit breaker: open after BREAKER_FAILURES failed transfers in a row (or a lost
+# heartbeat), let one probe transfer through after BREAKER_COOLDOWN seconds
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 2.0
+
+# Upper bounds of the latency histogram buckets (ms) - the last bucket counts the rest
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# SDO command specifiers
+REQUEST_UPLOAD = 0x40
+REQUEST_SEGMENT_UPLOAD = 0x60
+REQUEST_DOWNLOAD = 0x20
+RESPONSE_UPLOAD = 0x40
+RESPONSE_DOWNLOAD = 0x60
+RESPONSE_SEGMENT_UPLOAD = 0x00
+RESPONSE_SEGMENT_DOWNLOAD = 0x20
+RESPONSE_ABORTED = 0x80
+EXPEDITED = 0x02
+SIZE_SPECIFIED = 0x01
+TOGGLE_BIT = 0x10
+NO_MORE_DATA = 0x01
+
+SDO_STRUCT = struct.Struct('<BHB')
+ABORT_STRUCT = struct.Struct('<BHBI')
+
+
+# ================================================================================
+class _Transfer(object):
+    # State of one upload or download
+
+    __slots__ = ('node_id', 'index', 'subindex', 'data', 'future', 'timeout', 'deadline', 'sequence',
+                 'toggle', 'segmented', 'initiated', 'buffer', 'position', 'started', 'request', 'sent',
+                 'answered', 'attempts')
+
+    def __init__(self, node_id, index, subindex, data, timeout):
+        self.node_id = node_id
+        self.index = index
+        self.subindex = subindex
+        # None for uploads, bytes for downloads
+        self.data = data
+        self.future = Future()
+        self.timeout = timeout
+        self.deadline = None
+        self.sequence = None
+        self.toggle = 0
+        self.segmented = False
+        # Initiate of a download confirmed by the node
+        self.initiated = False
+        self.buffer = bytearray()
+        self.position = 0
+        self.started = None
+        # Last request sent, its send time and whether the node answered at all
+        self.request = None
+        self.sent = None
+        self.answered = False
+        self.attempts = 0
+
+
+# ================================================================================
+class _NodeStats(object):
+    # Response latencies, failures and breaker state of one node
+
+    __slots__ = ('latencies', 'histogram', 'transfers', 'failures', 'retries', 'timeouts', 'fast_failed',
+                 'consecutive_failures', 'open_until', 'probing', 'heartbeat_losses', '_timeout')
+
+    def __init__(self):
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.transfers = 0
+        self.failures = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.fast_failed = 0
+        self.consecutive_failures = 0
+        # Circuit breaker is open until this time (None = closed)
+        self.open_until = None
+        # Probe transfer of the half-open breaker in flight
+        self.probing = False
+        self.heartbeat_losses = 0
+        self._timeout = None
+
+    def add_latency(self, latency):
+        self.latencies.append(latency)
+        self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, latency * 1e3)] += 1
+        self._timeout = None
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(fraction * (len(ordered) - 1))]
+
+    def timeout(self, default):
+        if len(self.latencies) < MIN_SAMPLES:
+            return default
+        if self._timeout is None:
+            self._timeout = min(max(self.percentile(0.99) * TIMEOUT_FACTOR, MIN_TIMEOUT), MAX_TIMEOUT)
+        return self._timeout
+
+    def report(self, default):
+        percentiles = {name: round(self.percentile(fraction) * 1e3, 3) if self.latencies else None
+                       for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))}
+        return {'transfers': self.transfers, 'failures': self.failures, 'retries': self.retries,
+                'timeouts': self.timeouts, 'fast_failed': self.fast_failed,
+                'latency_ms': percentiles, 'samples': len(self.latencies),
+                'histogram': dict(zip([str(bound) for bound in HISTOGRAM_BUCKETS] + ['inf'], self.histogram)),
+                'timeout_ms': round(self.timeout(default) * 1e3, 3),
+                'breaker': 'open' if self.open_until is not None else 'closed',
+                'heartbeat_losses': self.heartbeat_losses}
+
+
+# ================================================================================
+class SdoEngine(object):
+    """ Pipelined SDO client for all nodes of a :class:`canopen.Network` """
+
+    def __init__(self, network, timeout=RESPONSE_TIMEOUT, heartbeat_monitor=None):
+        self.network = network
+        self.timeout = timeout
+        self._guard = threading.Lock()
+        # node_id -> active transfer and queue of waiting transfers
+        self._active = {}
+        self._waiting = collections.defaultdict(collections.deque)
+        self._subscribed = set()
+        # Nodes whose SDO server is held by a block transfer
+        self._held = set()
+        # node_id -> sequence of the drain after a retried transfer (see _finish)
+        self._draining = {}
+        self._stats = collections.defaultdict(_NodeStats)
+        # Deadlines of the active transfers (deadline, sequence, node_id)
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._wakeup = threading.Condition(self._guard)
+        self._timer = threading.Thread(target=self._timeout_loop, name='sdo-engine', daemon=True)
+        self._timer.start()
+        # Heartbeat loss / return of a node opens / closes its breaker
+        if heartbeat_monitor is not None:
+            heartbeat_monitor.add_callback(self._on_liveness)
+
+    # ================================================================================
+    # API (called from worker threads)
+
+    def upload(self, node_id, index, subindex, timeout=None):
+        """ Read an object - returns a future of the raw bytes
+
+        Without timeout, the adaptive timeout of the node is used.
+        """
+        return self._submit(_Transfer(node_id, index, subindex, None, timeout))
+
+    def download(self, node_id, index, subindex, data, timeout=None):
+        """ Write an object (raw bytes) - returns a future (result None) """
+        return self._submit(_Transfer(node_id, index, subindex, bytes(data), timeout))
+
+    def hold(self, node_id):
+        """ Reserve the SDO server of a node (i.e. for a block transfer) - transfers are rejected until release()
+
+        :raises IOError:
+            When transfers of this engine are in flight on the node.
+        """
+        with self._guard:
+            if node_id in self._active or node_id in self._draining or self._waiting.get(node_id):
+                raise IOError('node 0x%02X has SDO transfers in flight' % node_id)
+            self._held.add(node_id)
+
+    def release(self, node_id):
+        with self._guard:
+            self._held.discard(node_id)
+
+    def _submit(self, transfer):
+        with self._guard:
+            if transfer.node_id in self._held:
+                transfer.future.set_exception(canopen.SdoCommunicationError(
+                    'Node 0x%02X is busy with a block transfer' % transfer.node_id))
+                return transfer.future
+            if transfer.node_id not in self._subscribed:
+                self.network.subscribe(0x580 + transfer.node_id, self._on_response)
+                self._subscribed.add(transfer.node_id)
+            stats = self._stats[transfer.node_id]
+            if self._breaker_open(stats):
+                stats.fast_failed += 1
+                transfer.future.set_exception(canopen.SdoCommunicationError(
+                    'Node 0x%02X is not answering (circuit breaker open)' % transfer.node_id))
+                return transfer.future
+            if transfer.timeout is None:
+                transfer.timeout = stats.timeout(self.timeout)
+            if transfer.node_id in self._active or transfer.node_id in self._draining:
+                # One outstanding transfer per node - the next one starts when it is done
+                self._waiting[transfer.node_id].append(transfer)
+            else:
+                self._start(transfer)
+        return transfer.future
+
+    # ================================================================================
+    # State machine (called with _guard held)
+
+    def _breaker_open(self, stats):
+        if stats.open_until is None:
+            return False
+        if time.perf_counter() >= stats.open_until and not stats.probing:
+            # Half-open: let this transfer through as the only probe - its outcome closes or opens the breaker
+            stats.probing = True
+            return False
+        return True
+
+    def _send(self, transfer, data):
+        transfer.request = data
+        transfer.sequence = next(self._sequence)
+        transfer.sent = time.perf_counter()
+        transfer.deadline = transfer.sent + transfer.timeout * BACKOFF ** transfer.attempts
+        heapq.heappush(self._deadlines, (transfer.deadline, transfer.sequence, transfer.node_id))
+        self._wakeup.notify()
+        try:
+            self.network.send_message(0x600 + transfer.node_id, data)
+        except Exception as e:
+            # i.e. TX buffer of the interface full - fail this transfer, not the calling thread
+            self._finish(transfer, error=e)
+
+    def _start(self, transfer):
+        self._active[transfer.node_id] = transfer
+        transfer.started = time.perf_counter()
+        if transfer.data is None:
+            request = SDO_STRUCT.pack(REQUEST_UPLOAD, transfer.index, transfer.subindex) + bytes(4)
+        elif 0 < len(transfer.data) <= 4:
+            size_bits = (4 - len(transfer.data)) << 2
+            request = (SDO_STRUCT.pack(REQUEST_DOWNLOAD | EXPEDITED | SIZE_SPECIFIED | size_bits,
+                                       transfer.index, transfer.subindex) + transfer.data.ljust(4, b'\x00'))
+        else:
+            # Segmented - also for empty data (one segment without data), which expedited cannot carry
+            transfer.segmented = True
+            request = (SDO_STRUCT.pack(REQUEST_DOWNLOAD | SIZE_SPECIFIED, transfer.index, transfer.subindex) +
+                       struct.pack('<I', len(transfer.data)))
+        self._send(transfer, request)
+
+    def _finish(self, transfer, result=None, error=None):
+        del self._active[transfer.node_id]
+        transfer.deadline = None
+        stats = self._stats[transfer.node_id]
+        stats.transfers += 1
+        stats.probing = False
+        if isinstance(error, canopen.SdoCommunicationError) or (error is not None and not transfer.answered):
+            # The node did not answer (an abort of the node is an answer)
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= BREAKER_FAILURES:
+                stats.open_until = time.perf_counter() + BREAKER_COOLDOWN
+        else:
+            stats.consecutive_failures = 0
+            stats.open_until = None
+        if transfer.attempts:
+            # The node may still answer the earlier attempts - the next transfer (i.e. on the same
+            # index) would take such an answer for its own, so drain the responses first
+            sequence = next(self._sequence)
+            self._draining[transfer.node_id] = sequence
+            heapq.heappush(self._deadlines, (time.perf_counter() + transfer.timeout * BACKOFF ** transfer.attempts,
+                                             sequence, transfer.node_id))
+            self._wakeup.notify()
+        else:
+            self._start_next(transfer.node_id)
+        if error is not None:
+            transfer.future.set_exception(error)
+        else:
+            transfer.future.set_result(result)
+
+    def _start_next(self, node_id):
+        # Responses of this engine were queued by python-canopen's SDO client of the node, too
+        node = self.network.nodes.get(node_id)
+        if node is not None:
+            try:
+                while True:
+                    node.sdo.responses.get_nowait()
+            except (AttributeError, queue.Empty):
+                pass
+        stats = self._stats[node_id]
+        waiting = self._waiting.get(node_id)
+        while waiting:
+            following = waiting.popleft()
+            if self._breaker_open(stats):
+                stats.fast_failed += 1
+                following.future.set_exception(canopen.SdoCommunicationError(
+                    'Node 0x%02X is not answering (circuit breaker open)' % following.node_id))
+                continue
+            self._start(following)
+            break
+
+    def _abort(self, transfer, code, message):
+        # Abort the transfer on the node as well
+        try:
+            self.network.send_message(0x600 + transfer.node_id,
+                                      ABORT_STRUCT.pack(RESPONSE_ABORTED, transfer.index, transfer.subindex, code))
+        except Exception:
+            pass
+        self._finish(transfer, error=canopen.SdoCommunicationError(message))
+
+    def _send_segment(self, transfer):
+        # Next segment of a segmented download (7 bytes at most)
+        chunk = transfer.data[transfer.position:transfer.position + 7]
+        transfer.position += len(chunk)
+        command = transfer.toggle | ((7 - len(chunk)) << 1)
+        if transfer.position >= len(transfer.data):
+            command |= NO_MORE_DATA
+        self._send(transfer, bytes([command]) + chunk.ljust(7, b'\x00'))
+
+    def _answered(self, transfer):
+        # Response validated to belong to the transfer (not i.e. to python-canopen's SDO client)
+        if transfer.sent is not None:
+            self._stats[transfer.node_id].add_latency(time.perf_counter() - transfer.sent)
+            transfer.sent = None
+        transfer.answered = True
+
+    def _addresses(self, transfer, data):
+        # Response carries index and subindex of the transfer
+        return data[1:4] == SDO_STRUCT.pack(0, transfer.index, transfer.subindex)[1:]
+
+    # Called from the notifier thread
+    def _on_response(self, can_id, data, timestamp):
+        node_id = can_id - 0x580
+        with self._guard:
+            transfer = self._active.get(node_id)
+            if transfer is None or len(data) < 8:
+                return
+            data = bytes(data)
+            command = data[0]
+
+            if command & 0xE0 == RESPONSE_ABORTED:
+                if not self._addresses(transfer, data):
+                    return
+                self._answered(transfer)
+                abort_code, = struct.unpack_from('<I', data, 4)
+                self._finish(transfer, error=canopen.SdoAbortedError(abort_code))
+                return
+
+            if transfer.data is None:
+                self._on_upload_response(transfer, command, data)
+            else:
+                self._on_download_response(transfer, command, data)
+
+    def _on_upload_response(self, transfer, command, data):
+        if not transfer.segmented:
+            if command & 0xE0 != RESPONSE_UPLOAD or not self._addresses(transfer, data):
+                # Response to another request (i.e. python-canopen's SDO client)
+                return
+            self._answered(transfer)
+            if command & EXPEDITED:
+                size = 4 - ((command >> 2) & 0x03) if command & SIZE_SPECIFIED else 4
+                self._finish(transfer, data[4:4 + size])
+                return
+            # Segmented upload - request the first segment
+            transfer.segmented = True
+            self._send(transfer, bytes([REQUEST_SEGMENT_UPLOAD]) + bytes(7))
+            return
+
+        if command & 0xE0 != RESPONSE_SEGMENT_UPLOAD:
+            return
+        self._answered(transfer)
+        if command & TOGGLE_BIT != transfer.toggle:
+            self._abort(transfer, 0x05030000, 'Toggle bit mismatch')
+            return
+        size = 7 - ((command >> 1) & 0x07)
+        transfer.buffer.extend(data[1:1 + size])
+        if command & NO_MORE_DATA:
+            self._finish(transfer, bytes(transfer.buffer))
+            return
+        transfer.toggle ^= TOGGLE_BIT
+        self._send(transfer, bytes([REQUEST_SEGMENT_UPLOAD | transfer.toggle]) + bytes(7))
+
+    def _on_download_response(self, transfer, command, data):
+        if not transfer.initiated and command & 0xE0 == RESPONSE_DOWNLOAD:
+            if not self._addresses(transfer, data):
+                return
+            self._answered(transfer)
+            transfer.initiated = True
+            if not transfer.segmented:
+                self._finish(transfer)
+                return
+            self._send_segment(transfer)
+            return
+
+        if not transfer.segmented or not transfer.initiated or command & 0xE0 != RESPONSE_SEGMENT_DOWNLOAD:
+            return
+        self._answered(transfer)
+        if command & TOGGLE_BIT != transfer.toggle:
+            self._abort(transfer, 0x05030000, 'Toggle bit mismatch')
+            return
+        if transfer.position >= len(transfer.data):
+            self._finish(transfer)
+            return
+        transfer.toggle ^= TOGGLE_BIT
+        self._send_segment(transfer)
+
+    # ================================================================================
+    # Timer thread - fails transfers without response
+
+    def _timeout_loop(self):
+        with self._guard:
+            while True:
+                now = time.perf_counter()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    deadline, sequence, node_id = heapq.heappop(self._deadlines)
+                    if self._draining.get(node_id) == sequence:
+                        # Late answers had their time - they were dropped without an active transfer
+                        del self._draining[node_id]
+                        self._start_next(node_id)
+                        continue
+                    transfer = self._active.get(node_id)
+                    if transfer is None or transfer.sequence != sequence:
+                        continue
+                    stats = self._stats[node_id]
+                    if not transfer.answered and transfer.attempts < MAX_RETRIES:
+                        # Initiate request lost - send it again and wait longer
+                        transfer.attempts += 1
+                        stats.retries += 1
+                        self._send(transfer, transfer.request)
+                        continue
+                    stats.timeouts += 1
+                    self._abort(transfer, 0x05040000, 'No SDO response received')
+                timeout = self._deadlines[0][0] - now if self._deadlines else None
+                self._wakeup.wait(timeout)
+
+    # Called from the heartbeat monitor (notifier thread / loss check)
+    def _on_liveness(self, node_id, alive):
+        with self._guard:
+            stats = self._stats[node_id]
+            if alive:
+                # The node is alive again
+                stats.open_until = None
+                stats.consecutive_failures = 0
+                stats.probing = False
+            else:
+                # Open like after BREAKER_FAILURES failures - half-open after the cooldown, so a node
+                # which merely stopped its heartbeat (0x1017 = 0) is reached again
+                stats.heartbeat_losses += 1
+                stats.consecutive_failures = max(stats.consecutive_failures, BREAKER_FAILURES)
+                stats.open_until = time.perf_counter() + BREAKER_COOLDOWN
+
+    def stats(self):
+        with self._guard:
+            return {'active': sorted(self._active),
+                    'waiting': sum(len(waiting) for waiting in self._waiting.values())}
+
+    def node_stats(self, node_id=None):
+        """ Latency histogram, adaptive timeout and breaker state per node (or of one node) """
+        with self._guard:
+            if node_id is not None:
+                return self._stats[node_id].report(self.timeout)
+            return {node_id: stats.report(self.timeout) for node_id, stats in sorted(self._stats.items())}
+
+    def reset_node(self, node_id):
+        """ Forget latencies and close the breaker of a node (i.e. after replacing the DUT) """
+        with self._guard:
+            self._stats.pop(node_id, None)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    sdo_stream
+
+    Chunked SDO block transfers of large DOMAIN objects (firmware images,
+    data logs) spanning many requests. A stream is opened once, then chunks
+    - binary frames of the request - go straight into python-canopen's block
+    writer, resp. are read chunk by chunk from the block reader and sent
+    back. The daemon holds at most one chunk per request in memory; the CRC
+    of the block protocol is checked by python-canopen.
+
+    An aborted (or failed) stream keeps its position and can be resumed:
+    uploads are read again, skipping the bytes already delivered, downloads
+    are replayed from a spool file on disk, so the client continues where it
+    stopped.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import io
+import itertools
+import tempfile
+import threading
+import time
+
+from sdo_engine import ABORT_STRUCT, RESPONSE_ABORTED
+
+DIRECTIONS = ('upload', 'download')
+
+# Largest chunk per request (bytes)
+CHUNK_LIMIT = 1 << 20
+
+# Default chunk of reads, also used to skip / replay data on resume (bytes)
+CHUNK_SIZE = 1 << 16
+
+# Streams idle longer than this are aborted and removed (seconds)
+STREAM_IDLE = 300
+
+# Abort code sent to the node: general error
+ABORT_CODE = 0x08000000
+
+
+# ================================================================================
+def abort_transfer(node, index, subindex, fp=None):
+    """ Abort a block transfer on the node and forget its python-canopen stream fp unfinished """
+    if fp is not None:
+        # Only mark the raw stream closed - its close() would run the end of the protocol,
+        # the buffer on top of a closed raw stream is discarded without flushing
+        io.RawIOBase.close(fp.raw)
+    try:
+        node.network.send_message(0x600 + node.id, ABORT_STRUCT.pack(RESPONSE_ABORTED, index, subindex, ABORT_CODE))
+    except Exception:
+        pass
+
+
+# ================================================================================
+class SdoStream(object):
+    """ One chunked block upload or download """
+
+    def __init__(self, stream_id, node, index, subindex, direction, size=None, sdo_engine=None):
+        self.stream_id = stream_id
+        self.node = node
+        self.node_id = node.id
+        self.index = index
+        self.subindex = subindex
+        self.direction = direction
+        self.size = size
+        self.state = 'active'
+        # Bytes delivered to (upload) / received from (download) the client
+        self.transferred = 0
+        # Bytes moved on the bus since the transfer was (re)started
+        self.position = 0
+        self.resumes = 0
+        self.error = None
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        # The SDO engine must not talk to the node while the stream is active
+        self._engine = sdo_engine
+        self._hold()
+        self._spool = tempfile.TemporaryFile() if direction == 'download' else None
+        self._fp = None
+        try:
+            self._start()
+        except Exception:
+            self.close()
+            raise
+
+    def _start(self):
+        self.position = 0
+        self.started = time.monotonic()
+        if self.direction == 'upload':
+            self._fp = self.node.sdo.open(self.index, self.subindex, 'rb', block_transfer=True)
+            if self.size is None:
+                self.size = getattr(self._fp.raw, 'size', None)
+            skip = self.transferred
+            while skip:
+                chunk = self._fp.read(min(skip, CHUNK_SIZE))
+                if not chunk:
+                    raise IOError('object is shorter than before (%d bytes)' % self.position)
+                self.position += len(chunk)
+                skip -= len(chunk)
+        else:
+            self._fp = self.node.sdo.open(self.index, self.subindex, 'wb', block_transfer=True, size=self.size)
+            self._spool.seek(0)
+            while self.position < self.transferred:
+                chunk = self._spool.read(min(self.transferred - self.position, CHUNK_SIZE))
+                self._fp.write(chunk)
+                self.position += len(chunk)
+
+    def _hold(self):
+        if self._engine is not None:
+            self._engine.hold(self.node_id)
+
+    def _release(self):
+        if self._engine is not None:
+            self._engine.release(self.node_id)
+
+    def _drop(self):
+        fp, self._fp = self._fp, None
+        abort_transfer(self.node, self.index, self.subindex, fp)
+        self._release()
+
+    def _failed(self, error):
+        self._drop()
+        self.state = 'aborted'
+        self.error = str(error)
+
+    # ================================================================================
+    # Called with self.lock held
+
+    def read(self, size):
+        """ Next chunk of an upload - shorter than size (or empty) at the end """
+        if self.state != 'active':
+            raise IOError('stream %d is %s' % (self.stream_id, self.state))
+        try:
+            chunk = self._fp.read(size)
+        except Exception as e:
+            self._failed(e)
+            raise
+        self.position += len(chunk)
+        self.transferred += len(chunk)
+        if len(chunk) < size or self.transferred == self.size:
+            # End of the transfer (CRC checked by the block reader)
+            self.finish()
+        return chunk
+
+    def write(self, data):
+        """ Send a chunk of a download - the transfer ends when size bytes were written """
+        if self.state != 'active':
+            raise IOError('stream %d is %s' % (self.stream_id, self.state))
+        if self.size is not None and self.transferred + len(data) > self.size:
+            raise ValueError('%d bytes exceed the size of %d bytes' % (self.transferred + len(data), self.size))
+        self._spool.seek(0, io.SEEK_END)
+        self._spool.write(data)
+        self.transferred += len(data)
+        try:
+            self._fp.write(data)
+        except Exception as e:
+            self._failed(e)
+            raise
+        self.position += len(data)
+        if self.transferred == self.size:
+            self.finish()
+
+    def finish(self):
+        """ End the transfer regularly (i.e. downloads of unknown size) """
+        if self.state == 'active':
+            try:
+                self._fp.close()
+            except Exception as e:
+                self._failed(e)
+                raise
+            self._fp = None
+            self.state = 'done'
+            self._release()
+
+    def abort(self):
+        """ Abort the transfer on the node - can be resumed later """
+        if self.state == 'active':
+            self._drop()
+            self.state = 'aborted'
+
+    def resume(self):
+        """ Restart an aborted transfer at the current position """
+        if self.state != 'aborted':
+            raise IOError('stream %d is %s' % (self.stream_id, self.state))
+        self._hold()
+        self.state = 'active'
+        self.error = None
+        self.resumes += 1
+        try:
+            self._start()
+        except Exception as e:
+            self._failed(e)
+            raise
+
+    def close(self):
+        if self.state == 'active':
+            self._drop()
+            self.state = 'aborted'
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def info(self):
+        elapsed = time.monotonic() - self.started
+        return {'stream_id': self.stream_id, 'node_id': self.node_id, 'index': self.index,
+                'subindex': self.subindex, 'direction': self.direction, 'state': self.state,
+                'size': self.size, 'transferred': self.transferred,
+                'progress': round(self.transferred / self.size, 4) if self.size else None,
+                'elapsed_ms': round(elapsed * 1e3, 3),
+                'bytes_per_s': round(self.position / elapsed, 1) if elapsed > 0 else None,
+                'resumes': self.resumes, 'error': self.error}
+
+
+# ================================================================================
+class SdoStreams(object):
+    """ Open streams of one bus, by stream_id - at most one active stream per node """
+
+    def __init__(self, sdo_engine=None):
+        self.sdo_engine = sdo_engine
+        self._streams = {}
+        self._ids = itertools.count(1)
+        self._guard = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._guard:
+            idle = [stream for stream in self._streams.values() if now - stream.last_used > STREAM_IDLE]
+            for stream in idle:
+                del self._streams[stream.stream_id]
+        for stream in idle:
+            with stream.lock:
+                stream.close()
+
+    def check_node(self, node_id, stream=None):
+        """ Raise IOError, if node_id has an active stream (other than stream)
+
+        The SDO server of a node handles one transfer at a time - other SDO requests would
+        interleave with the block transfer.
+        """
+        with self._guard:
+            for other in self._streams.values():
+                if other is not stream and other.node_id == node_id and other.state == 'active':
+                    raise IOError('node 0x%02X has the active stream %d' % (node_id, other.stream_id))
+
+    def open(self, node, index, subindex, direction, size=None):
+        self._expire()
+        self.check_node(node.id)
+        stream = SdoStream(next(self._ids), node, index, subindex, direction, size, self.sdo_engine)
+        with self._guard:
+            self._streams[stream.stream_id] = stream
+        return stream
+
+    def get(self, stream_id):
+        """ Stream by id (None, if unknown) """
+        with self._guard:
+            stream = self._streams.get(stream_id)
+        if stream is not None:
+            stream.last_used = time.monotonic()
+        return stream
+
+    def resume(self, stream):
+        self.check_node(stream.node_id, stream)
+        stream.resume()
+
+    def close(self, stream_id):
+        with self._guard:
+            stream = self._streams.pop(stream_id, None)
+        if stream is not None:
+            with stream.lock:
+                stream.close()
+        return stream
+
+    def close_all(self):
+        with self._guard:
+            stream_ids = list(self._streams)
+        for stream_id in stream_ids:
+            self.close(stream_id)
+
+    def streams(self):
+        with self._guard:
+            return [stream.info() for stream in self._streams.values()]
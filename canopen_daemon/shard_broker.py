@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    shard_broker
+
+    Broker of the sharded mode of the canopen_daemon: one daemon process per
+    CAN bus (shard), so CPU load spreads across cores instead of being bound
+    by the GIL of a single process. Clients keep using one address - the broker
+    routes every request by its 'bus' parameter to the matching shard and
+    forwards the frame stream of all shards to the single PUB endpoint.
+
+    Requests handled by the broker itself:
+    'broker_health'  state of all shards (alive, pid, requests in flight)
+    'turn_off'       stops all shards and the broker
+
+    A shard only knows its own bus - batches and flash_firmware requests
+    addressing other buses are rejected by the broker (one request per bus).
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import subprocess
+import time
+
+import zmq
+
+import wire_protocol
+
+# Envelope of requests the broker sends to the shards itself
+BROKER_ENVELOPE = [b'broker', b'']
+
+
+# ================================================================================
+def _split_envelope(frames):
+    # Routing frames up to and including the empty delimiter, then the request
+    for position, frame in enumerate(frames):
+        if len(frame.bytes) == 0:
+            return frames[:position + 1], frames[position + 1:]
+    return frames[:1], frames[1:]
+
+
+class _Shard(object):
+    __slots__ = ('name', 'identity', 'process', 'pending', 'forwarded', 'started')
+
+    def __init__(self, name, process):
+        self.name = name
+        self.identity = name.encode('utf-8')
+        self.process = process
+        # Requests forwarded, but not answered yet: envelope (bytes) -> (encoding, opcode)
+        self.pending = {}
+        self.forwarded = 0
+        self.started = time.time()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def health(self):
+        return {'alive': self.alive(), 'pid': self.process.pid, 'exitcode': self.process.returncode,
+                'in_flight': len(self.pending), 'forwarded': self.forwarded,
+                'uptime': round(time.time() - self.started, 3)}
+
+
+# Commands which may address several buses within one request
+def _request_buses(cmd, parameters):
+    if cmd == 'batch':
+        items = parameters.get('commands', None) or []
+        return set(str(item['parameters']['bus']) for item in items
+                   if isinstance(item, dict) and isinstance(item.get('parameters'), dict)
+                   and item['parameters'].get('bus') is not None)
+    if cmd == 'flash_firmware':
+        targets = parameters.get('targets', None) or []
+        return set(str(target[0]) for target in targets if isinstance(target, (list, tuple)) and target)
+    return set()
+
+
+# ================================================================================
+class ShardBroker(object):
+    """ Routes requests to one daemon process per bus """
+
+    def __init__(self, context, endpoint, backend_endpoint, stream_endpoint, stream_backend_endpoint,
+                 shard_names, shard_command):
+        """
+        :param context:
+            ZMQ context.
+        :param str endpoint:
+            Endpoint of the clients, i.e. 'tcp://*:5555'.
+        :param str backend_endpoint:
+            Endpoint the shards connect to (identity = bus name).
+        :param str stream_endpoint:
+            PUB endpoint of the clients, i.e. 'tcp://*:5556'.
+        :param str stream_backend_endpoint:
+            Endpoint the PUB sockets of the shards connect to.
+        :param shard_names:
+            Names of the buses - the first one is the default bus.
+        :param shard_command:
+            Command line starting a shard (' --shard <name>' is appended).
+        """
+        self.default = shard_names[0]
+        self.frontend = context.socket(zmq.ROUTER)
+        self.frontend.bind(endpoint)
+        self.backend = context.socket(zmq.ROUTER)
+        # Fail instead of silently dropping requests for shards not (yet) connected
+        self.backend.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.backend.bind(backend_endpoint)
+        # Frame streams of all shards are forwarded to one PUB endpoint
+        self.stream_frontend = context.socket(zmq.XPUB)
+        self.stream_frontend.bind(stream_endpoint)
+        self.stream_backend = context.socket(zmq.XSUB)
+        self.stream_backend.bind(stream_backend_endpoint)
+        self.shards = {}
+        for name in shard_names:
+            process = subprocess.Popen(list(shard_command) + ['--shard', name])
+            self.shards[name] = _Shard(name, process)
+        self.stopping = False
+
+    # ================================================================================
+    def _reply(self, envelope, encoding, opcode, reply_cmd, reply_parameters):
+        frames = wire_protocol.encode_reply(encoding, reply_cmd, reply_parameters, opcode)
+        self.frontend.send_multipart(list(envelope) + frames, copy=False)
+
+    def _route(self, frames):
+        envelope, request = _split_envelope(frames)
+        encoding = wire_protocol.request_encoding(request)
+        shard_name = self.default
+        opcode = None
+        # Only decode requests, which may carry a 'bus' parameter or are handled by the broker
+        if encoding == 'struct':
+            try:
+                shard_name = wire_protocol.struct_bus(request) or self.default
+                opcode = wire_protocol.struct_opcode(request)
+            except Exception as e:
+                self._reply(envelope, encoding, opcode, 'err: %s' % e, {})
+                return
+        else:
+            try:
+                cmd, parameters, opcode = wire_protocol.decode_request(encoding, request)
+            except Exception as e:
+                self._reply(envelope, encoding, opcode, 'err: %s' % e, {})
+                return
+            if cmd == 'broker_health':
+                self._reply(envelope, encoding, opcode, cmd, self.health())
+                return
+            if cmd == 'turn_off':
+                self.turn_off()
+                self._reply(envelope, encoding, opcode, cmd, {})
+                return
+            shard_name = parameters.get('bus', None) or self.default
+            foreign = _request_buses(cmd, parameters) - {shard_name}
+            if foreign:
+                self._reply(envelope, encoding, opcode, 'err: %s cannot address bus %s from bus %s in the sharded '
+                            'mode - send one request per bus' % (cmd, ', '.join(sorted(foreign)), shard_name), {})
+                return
+
+        shard = self.shards.get(shard_name)
+        if shard is None:
+            self._reply(envelope, encoding, opcode, 'err: unknown bus %s' % shard_name, {})
+            return
+        try:
+            self.backend.send_multipart([shard.identity] + list(envelope) + list(request), copy=False)
+        except zmq.ZMQError:
+            self._reply(envelope, encoding, opcode, 'err: shard %s is not running' % shard_name, {})
+            return
+        shard.pending[tuple(frame.bytes for frame in envelope)] = (encoding, opcode)
+        shard.forwarded += 1
+
+    def _forward_reply(self, frames):
+        shard = self.shards.get(frames[0].bytes.decode('utf-8'))
+        envelope, reply = _split_envelope(frames[1:])
+        key = tuple(frame.bytes for frame in envelope)
+        if key == tuple(BROKER_ENVELOPE):
+            # Reply to a request of the broker itself
+            return
+        if shard is not None:
+            shard.pending.pop(key, None)
+        self.frontend.send_multipart(list(envelope) + list(reply), copy=False)
+
+    def _check_shards(self):
+        # Answer requests pending on shards which died
+        for shard in self.shards.values():
+            if shard.pending and not shard.alive():
+                # Each request is answered in its own encoding (and struct opcode)
+                for envelope, (encoding, opcode) in shard.pending.items():
+                    self._reply(envelope, encoding, opcode, 'err: shard %s is not running' % shard.name, {})
+                shard.pending.clear()
+
+    def health(self):
+        return {'default': self.default, 'shards': {name: shard.health() for name, shard in self.shards.items()}}
+
+    def turn_off(self):
+        self.stopping = True
+        for shard in self.shards.values():
+            try:
+                self.backend.send_multipart([shard.identity] + BROKER_ENVELOPE +
+                                            wire_protocol.encode_request('json', 'turn_off', {}))
+            except zmq.ZMQError:
+                pass
+
+    # ================================================================================
+    def run(self):
+        """ Serve until turn_off stopped all shards """
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        poller.register(self.stream_frontend, zmq.POLLIN)
+        poller.register(self.stream_backend, zmq.POLLIN)
+        while True:
+            events = dict(poller.poll(100))
+            if self.frontend in events:
+                self._route(self.frontend.recv_multipart(copy=False))
+            if self.backend in events:
+                self._forward_reply(self.backend.recv_multipart(copy=False))
+            if self.stream_backend in events:
+                self.stream_frontend.send_multipart(self.stream_backend.recv_multipart(copy=False), copy=False)
+            if self.stream_frontend in events:
+                # Subscriptions of the clients are passed on to the shards
+                self.stream_backend.send_multipart(self.stream_frontend.recv_multipart(copy=False), copy=False)
+            self._check_shards()
+            if self.stopping and not any(shard.alive() for shard in self.shards.values()):
+                break
+        for socket in (self.frontend, self.backend, self.stream_frontend, self.stream_backend):
+            socket.close(linger=1000)
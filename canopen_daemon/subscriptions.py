@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    subscriptions
+
+    Subscriptions to the next CAN message with a specific CAN-ID.
+    Each subscription owns its state and wakes up its waiter the moment
+    the frame arrives, so any number of subscriptions can exist at once.
+    The callback list of the CAN-ID is replaced instead of modified (copy-on-
+    write), as the notifier thread may be iterating it in Network.notify.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import threading
+
+# Serialises the copy-on-write updates of network.subscribers
+_guard = threading.Lock()
+
+
+# ================================================================================
+class Subscription(object):
+    """ Captures the first message received with can_id after subscribe() """
+
+    def __init__(self, network, can_id):
+        """
+        :param network:
+            :class:`canopen.Network` delivering the messages.
+        :param int can_id:
+            CAN-ID to subscribe to.
+        """
+        self.network = network
+        self.can_id = can_id
+        self.msg_id = None
+        self.msg_data = None
+        self.msg_timestamp = None
+        self._received = threading.Event()
+
+    def __enter__(self):
+        self.subscribe()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unsubscribe()
+
+    def subscribe(self):
+        # The bound method is unique per subscription, so concurrent
+        # subscriptions to the same CAN-ID do not interfere
+        with _guard:
+            callbacks = self.network.subscribers.get(self.can_id, [])
+            if self._on_message not in callbacks:
+                self.network.subscribers[self.can_id] = callbacks + [self._on_message]
+
+    def unsubscribe(self):
+        # Removing from the list in place could skip the next callback in Network.notify
+        with _guard:
+            callbacks = [callback for callback in self.network.subscribers.get(self.can_id, ())
+                         if callback != self._on_message]
+            if callbacks:
+                self.network.subscribers[self.can_id] = callbacks
+            else:
+                self.network.subscribers.pop(self.can_id, None)
+
+    # Called from the notifier thread
+    def _on_message(self, can_id, data, timestamp):
+        if self._received.is_set():
+            # other msgs than the first will be ignored
+            return
+        self.msg_id = can_id
+        self.msg_data = list(data)
+        self.msg_timestamp = timestamp
+        self._received.set()
+
+    @property
+    def received(self):
+        return self._received.is_set()
+
+    def wait(self, timeout):
+        """ Block until the message arrived or timeout (seconds) elapsed
+
+        :return:
+            True, if the message has been received.
+        """
+        return self._received.wait(timeout)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    sync_producer
+
+    SYNC producer of one bus with jitter and overrun statistics.
+    On socketcan, SYNC frames are sent cyclically by the kernel (broadcast
+    manager, via python-can's send_periodic) - otherwise by a thread, which
+    schedules every frame relative to the start (no drift) and spins for the
+    last fraction of a millisecond (yielding, so the notifier and the workers
+    keep running). TX errors (i.e. bus off) are counted, the SYNC goes on.
+
+    Statistics come from two sources: 'tx' - send times of the thread, and
+    'observed' - SYNC frames seen by the notifier (frames of the broadcast
+    manager are looped back by socketcan, or another SYNC producer on the bus).
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import collections
+import math
+import threading
+import time
+
+import can
+
+SYNC_ID = 0x080
+
+# Intervals kept for the statistics
+INTERVAL_SAMPLES = 1000
+
+# The thread sleeps until this long before a SYNC is due and spins (yielding) for the rest (seconds)
+SPIN_TIME = 0.0002
+
+# An interval longer than OVERRUN_FACTOR * period counts as overrun
+OVERRUN_FACTOR = 1.5
+
+SYNC_MODES = ('auto', 'bcm', 'thread')
+
+
+# ================================================================================
+class _IntervalStats(object):
+    # Intervals between consecutive SYNC frames
+
+    __slots__ = ('period', 'intervals', 'count', 'overruns', 'last')
+
+    def __init__(self, period):
+        self.period = period
+        self.intervals = collections.deque(maxlen=INTERVAL_SAMPLES)
+        self.count = 0
+        self.overruns = 0
+        self.last = None
+
+    def add(self, timestamp):
+        self.count += 1
+        if self.last is not None:
+            interval = timestamp - self.last
+            self.intervals.append(interval)
+            if self.period and interval > self.period * OVERRUN_FACTOR:
+                self.overruns += 1
+        self.last = timestamp
+
+    def report(self):
+        intervals = list(self.intervals)
+        if not intervals:
+            return {'count': self.count, 'overruns': self.overruns}
+        mean = sum(intervals) / len(intervals)
+        deviations = sorted(abs(interval - self.period) for interval in intervals) if self.period else [0.0]
+        return {'count': self.count, 'overruns': self.overruns, 'samples': len(intervals),
+                'mean_ms': round(mean * 1e3, 4),
+                'min_ms': round(min(intervals) * 1e3, 4), 'max_ms': round(max(intervals) * 1e3, 4),
+                'jitter_ms': round(math.sqrt(sum((interval - mean) ** 2 for interval in intervals) /
+                                             len(intervals)) * 1e3, 4),
+                'p99_deviation_ms': round(deviations[int(0.99 * (len(deviations) - 1))] * 1e3, 4)}
+
+
+# ================================================================================
+class SyncProducer(can.Listener):
+    """ Cyclic SYNC of one bus - attached to the notifier to observe SYNC frames """
+
+    def __init__(self, network, bustype):
+        self.network = network
+        self.bustype = bustype
+        self.mode = None
+        self.running = False
+        self.period = None
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._tx = _IntervalStats(None)
+        self._observed = _IntervalStats(None)
+
+    # Called from the notifier thread
+    def on_message_received(self, msg):
+        if msg.arbitration_id == SYNC_ID and not msg.is_extended_id:
+            self._observed.add(msg.timestamp)
+
+    def stop(self):
+        """ Stop sending SYNC (also called by the notifier on shutdown) """
+        if self._task is not None:
+            self._task.stop()
+            self._task = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.running = False
+
+    def start(self, period, mode='auto'):
+        """ Send SYNC every period seconds
+
+        :param str mode:
+            'bcm' (kernel, socketcan only), 'thread' or 'auto' (bcm if possible).
+        :return:
+            Mode used.
+        """
+        self.stop()
+        if mode == 'bcm' and self.bustype != 'socketcan':
+            raise ValueError('bcm needs socketcan, bus is %s' % self.bustype)
+        self.period = period
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+        self._tx = _IntervalStats(period)
+        self._observed = _IntervalStats(period)
+        if mode != 'thread' and self.bustype == 'socketcan':
+            self._task = self.network.bus.send_periodic(
+                can.Message(arbitration_id=SYNC_ID, data=b'', is_extended_id=False), period)
+            self.mode = 'bcm'
+            self.running = True
+        else:
+            self._stop.clear()
+            self.mode = 'thread'
+            # Set before the thread starts - it clears running when it ends
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name='sync-producer', daemon=True)
+            self._thread.start()
+        return self.mode
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            self.running = False
+
+    def _loop(self):
+        period = self.period
+        started = time.perf_counter()
+        cycle = 0
+        while not self._stop.is_set():
+            due = started + cycle * period
+            remaining = due - time.perf_counter()
+            if remaining > SPIN_TIME:
+                if self._stop.wait(remaining - SPIN_TIME):
+                    break
+            while time.perf_counter() < due:
+                # Release the GIL while spinning
+                time.sleep(0)
+            try:
+                self.network.send_message(SYNC_ID, b'')
+            except Exception as e:
+                # i.e. bus off - keep the schedule, the bus may recover
+                self.errors += 1
+                self.last_error = str(e)
+            else:
+                self._tx.add(time.perf_counter())
+            now = time.perf_counter()
+            cycle += 1
+            # Skip slots already over instead of sending a burst
+            late = int((now - started) / period) + 1 - cycle
+            if late > 0:
+                self.missed += late
+                cycle += late
+
+    def stats(self):
+        return {'mode': self.mode, 'running': self.running,
+                'period_ms': round(self.period * 1e3, 4) if self.period else None,
+                'missed': self.missed, 'errors': self.errors, 'last_error': self.last_error, 'tx': self._tx.report(), 'observed': self._observed.report()}
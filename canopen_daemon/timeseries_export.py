@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    timeseries_export
+
+    Columnar export of recorded CAN frames or decoded PDO signals: one
+    timestamp column plus one column per signal, each a flat little endian
+    array. Columns are either written as .npy files (one file per column,
+    numpy.load(..., mmap_mode='r') maps them without copying) or returned
+    as bytes within the reply (sent as attachment frames with msgpack).
+
+    numpy is not needed to write the files.
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import os
+import re
+import struct
+
+# Header of .npy files (format version 1.0)
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_ALIGNMENT = 64
+
+# numpy type descriptions of the struct codes used by pdo_decoder
+STRUCT_DESCR = {'?': '|b1', 'b': '|i1', 'B': '|u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+                'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+# Names of columns and exports - everything else is replaced by '_'
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+# ================================================================================
+class Column(object):
+    """ One column: flat little endian data with numpy type description and shape """
+
+    __slots__ = ('name', 'descr', 'shape', 'data')
+
+    def __init__(self, name, descr, shape, data):
+        self.name = name
+        self.descr = descr
+        self.shape = tuple(shape)
+        self.data = data
+
+    def describe(self):
+        return {'dtype': self.descr, 'shape': list(self.shape)}
+
+
+def _pack(code, values):
+    values = list(values)
+    return struct.pack('<%d%s' % (len(values), code), *values)
+
+
+def frame_columns(frames):
+    """ Columns of recorded frames (FrameRecorder.query(..., raw_data=True)) """
+    count = len(frames['can_id'])
+    data = b''.join(payload.ljust(8, b'\x00') for payload in frames['data'])
+    return [Column('timestamp', '<f8', (count,), _pack('d', frames['timestamp'])),
+            Column('can_id', '<u4', (count,), _pack('I', frames['can_id'])),
+            Column('dlc', '|u1', (count,), bytes(len(payload) for payload in frames['data'])),
+            Column('data', '|u1', (count, 8), data)]
+
+
+def signal_columns(timestamps, decoder, columns):
+    """ Columns of decoded PDO signals (pdo_decoder.PdoDecoder.decode_batch) """
+    count = len(timestamps)
+    result = [Column('timestamp', '<f8', (count,), _pack('d', timestamps))]
+    for code, (name, values) in zip(decoder.struct.format.lstrip('<'), columns.items()):
+        data = values.tobytes() if hasattr(values, 'tobytes') else _pack(code, values)
+        result.append(Column(name.replace(':', '_'), STRUCT_DESCR[code], (count,), data))
+    return result
+
+
+# ================================================================================
+def npy_header(column):
+    """ Header of a .npy file holding column """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %r, }" % (column.descr, column.shape)
+    # Header (with magic and length) padded to a multiple of 64 bytes, terminated by '\n'
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT
+    header = header + ' ' * padding + '\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def safe_name(name):
+    """ name as a single path component
+
+    :raises ValueError:
+        For names consisting of dots only (i.e. '..') - they would leave the directory.
+    """
+    name = _UNSAFE.sub('_', name)
+    if not name.strip('.'):
+        raise ValueError('invalid name %r' % name)
+    return name
+
+
+def export_files(directory, columns):
+    """ Write one .npy file per column into directory
+
+    :return:
+        Dict column name -> file, dtype and shape.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    for column in columns:
+        path = os.path.join(directory, safe_name(column.name) + '.npy')
+        with open(path, 'wb') as fp:
+            fp.write(npy_header(column))
+            fp.write(column.data)
+        files[column.name] = dict(column.describe(), file=path)
+    return files
+
+
+def export_binary(columns):
+    """ Columns as bytes with dtype and shape (to be sent within the reply) """
+    return {column.name: dict(column.describe(), data=column.data) for column in columns}
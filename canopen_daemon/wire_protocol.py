@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    wire_protocol
+
+    Encodings of requests and replies exchanged with the canopen_daemon via ZMQ.
+    A reply is always sent in the encoding of its request, so a client
+    negotiates the encoding simply by the first frame it sends:
+
+    'json'     single frame {"cmd": ..., "parameters": {...}} (i.e. LabVIEW clients)
+    'msgpack'  frames [b'MP1', msgpack header, attachment, ...]
+               bytes larger than ATTACH_THRESHOLD travel as separate frames
+               (zero-copy), referenced via ExtType(ATTACHMENT_EXT, frame number)
+    'struct'   frames [b'ST1', fixed struct header, payload]
+               for the hot commands SDO read / write, raw CAN send, bursts and
+               the chunks of SDO streams
+               [b'ST2', bus name, fixed struct header, payload] addresses
+               another bus than the default one (replies are tagged b'ST1')
+
+    Author: Niels Göran Blume
+    Company: embeX GmbH, Freiburg im Breisgau, Germany
+"""
+
+# ================================================================================
+import json
+import struct
+
+# msgpack is optional - without it only 'json' and 'struct' are available
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Tags in the first frame of binary messages
+MSGPACK_TAG = b'MP1'
+STRUCT_TAG = b'ST1'
+STRUCT_BUS_TAG = b'ST2'
+
+# Bytes values larger than this are sent as separate frames
+ATTACH_THRESHOLD = 1024
+
+# msgpack ExtType code referencing an attachment frame
+ATTACHMENT_EXT = 1
+_ATTACHMENT_REF = struct.Struct('<I')
+
+# Struct frames: opcode -> (cmd, header struct, parameter names, parameter carrying the payload)
+OP_SDO_UPLOAD = 1
+OP_SDO_DOWNLOAD = 2
+OP_CAN_SEND = 3
+OP_CAN_BURST = 4
+OP_SDO_STREAM_WRITE = 5
+OP_SDO_STREAM_READ = 6
+STRUCT_OPS = {
+    OP_SDO_UPLOAD: ('sdo_upload', struct.Struct('<BBHB'), ('node_id', 'index', 'subindex'), None),
+    OP_SDO_DOWNLOAD: ('sdo_download', struct.Struct('<BBHB'), ('node_id', 'index', 'subindex'), 'data'),
+    OP_CAN_SEND: ('can_send_msg', struct.Struct('<BI'), ('can_id',), 'can_bytes'),
+    OP_CAN_BURST: ('can_send_burst', struct.Struct('<Bf'), ('bus_load',), 'frames'),
+    OP_SDO_STREAM_WRITE: ('sdo_stream_write', struct.Struct('<BI'), ('stream_id',), 'data'),
+    OP_SDO_STREAM_READ: ('sdo_stream_read', struct.Struct('<BII'), ('stream_id', 'size'), None),
+}
+STRUCT_REPLY = struct.Struct('<BB')   # opcode, status
+STATUS_OK = 0
+STATUS_ERROR = 1
+# Reply parameter carried as payload of a struct reply
+STRUCT_REPLY_PAYLOAD = {OP_SDO_UPLOAD: 'value', OP_SDO_STREAM_READ: 'data'}
+
+
+def encodings():
+    """ Encodings supported by this daemon """
+    if msgpack is None:
+        return ['json', 'struct']
+    return ['json', 'msgpack', 'struct']
+
+
+# ================================================================================
+# Requests
+
+def request_encoding(frames):
+    """ Return the encoding of a request, given its (zmq.Frame) frames """
+    tag = frames[0].bytes if len(frames) > 1 else b''
+    if tag == MSGPACK_TAG and msgpack is not None:
+        return 'msgpack'
+    if tag in (STRUCT_TAG, STRUCT_BUS_TAG):
+        return 'struct'
+    return 'json'
+
+
+def struct_bus(frames):
+    """ Bus of a struct request (None = default bus) - without decoding it """
+    if frames[0].bytes == STRUCT_BUS_TAG:
+        return frames[1].bytes.decode('utf-8')
+    return None
+
+
+def struct_opcode(frames):
+    """ Opcode of a struct request (None, if it has no header) - without decoding it """
+    position = 2 if frames[0].bytes == STRUCT_BUS_TAG else 1
+    header = frames[position].bytes if len(frames) > position else b''
+    return header[0] if header else None
+
+
+def decode_request(encoding, frames):
+    """ Decode a request - returns cmd, parameters and the struct opcode (or None)
+
+    :raises ValueError:
+        When the request cannot be decoded.
+    """
+    if encoding == 'msgpack':
+        attachments = [memoryview(frame.buffer) for frame in frames[2:]]
+
+        def ext_hook(code, data):
+            if code == ATTACHMENT_EXT:
+                return attachments[_ATTACHMENT_REF.unpack(data)[0]]
+            return msgpack.ExtType(code, data)
+
+        message_dict = msgpack.unpackb(frames[1].buffer, ext_hook=ext_hook, raw=False,
+                                       strict_map_key=False)
+        return message_dict.get('cmd', ''), message_dict.get('parameters', None) or {}, None
+
+    if encoding == 'struct':
+        bus = struct_bus(frames)
+        if bus is not None:
+            # Drop the bus frame - header and payload follow as in b'ST1' requests
+            frames = frames[:1] + frames[2:]
+        header = frames[1].bytes
+        opcode = header[0] if header else None
+        if opcode not in STRUCT_OPS:
+            raise ValueError('unknown struct opcode %r' % opcode)
+        cmd, header_struct, names, payload_name = STRUCT_OPS[opcode]
+        values = header_struct.unpack(header)
+        parameters = dict(zip(names, values[1:]))
+        parameters['raw'] = True
+        if bus is not None:
+            parameters['bus'] = bus
+        if payload_name is not None:
+            parameters[payload_name] = memoryview(frames[2].buffer) if len(frames) > 2 else b''
+        return cmd, parameters, opcode
+
+    message = frames[0].bytes.decode('utf-8')
+    message_dict = json.loads(message)
+    if 'cmd' not in message_dict:
+        return '', {}, None
+    return message_dict.get('cmd', ''), message_dict.get('parameters', None) or {}, None
+
+
+def encode_request(encoding, cmd, parameters, opcode=None):
+    """ Encode a request (client side) - returns the list of frames """
+    if encoding == 'msgpack':
+        attachments = []
+        header = msgpack.packb({'cmd': cmd, 'parameters': _extract_attachments(parameters, attachments)},
+                               use_bin_type=True)
+        return [MSGPACK_TAG, header] + attachments
+    if encoding == 'struct':
+        cmd, header_struct, names, payload_name = STRUCT_OPS[opcode]
+        frames = [STRUCT_TAG, header_struct.pack(opcode, *[parameters[name] for name in names])]
+        if parameters.get('bus') is not None:
+            frames[:1] = [STRUCT_BUS_TAG, parameters['bus'].encode('utf-8')]
+        if payload_name is not None:
+            frames.append(bytes(parameters[payload_name]))
+        return frames
+    return [json.dumps({'cmd': cmd, 'parameters': parameters}).encode('utf-8')]
+
+
+# ================================================================================
+# Replies
+
+def _json_default(value):
+    # bytes (i.e. block uploads) are sent as list of byte values, like subscribe_msg_data
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return list(bytes(value))
+    raise TypeError('%r is not JSON serializable' % type(value))
+
+
+def _extract_attachments(value, attachments):
+    # Replace large bytes values by references to separate frames
+    if isinstance(value, (bytes, bytearray, memoryview)) and len(value) > ATTACH_THRESHOLD:
+        attachments.append(value)
+        return msgpack.ExtType(ATTACHMENT_EXT, _ATTACHMENT_REF.pack(len(attachments) - 1))
+    if isinstance(value, dict):
+        return {key: _extract_attachments(item, attachments) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_extract_attachments(item, attachments) for item in value]
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
+
+def encode_reply(encoding, reply_cmd, reply_parameters, opcode=None):
+    """ Encode a reply - returns the list of frames (to be sent with copy=False) """
+    if encoding == 'msgpack':
+        attachments = []
+        result = {'reply_cmd': reply_cmd,
+                  'reply_parameters': _extract_attachments(reply_parameters, attachments)}
+        return [MSGPACK_TAG, msgpack.packb(result, use_bin_type=True)] + attachments
+
+    if encoding == 'struct':
+        if reply_cmd.startswith('err') or reply_cmd == 'unknown_cmd':
+            return [STRUCT_TAG, STRUCT_REPLY.pack(opcode or 0, STATUS_ERROR), reply_cmd.encode('utf-8')]
+        payload = b''
+        if opcode in STRUCT_REPLY_PAYLOAD:
+            payload = reply_parameters.get(STRUCT_REPLY_PAYLOAD[opcode], b'')
+        return [STRUCT_TAG, STRUCT_REPLY.pack(opcode, STATUS_OK), payload]
+
+    result = {}
+    result['reply_cmd'] = reply_cmd
+    result['reply_parameters'] = reply_parameters
+    return [json.dumps(result, default=_json_default).encode('utf-8')]
+
+
+def decode_reply(frames):
+    """ Decode a reply (client side) from a list of bytes frames - returns a dict """
+    if frames[0] == MSGPACK_TAG:
+        attachments = frames[2:]
+
+        def ext_hook(code, data):
+            if code == ATTACHMENT_EXT:
+                return attachments[_ATTACHMENT_REF.unpack(data)[0]]
+            return msgpack.ExtType(code, data)
+
+        return msgpack.unpackb(frames[1], ext_hook=ext_hook, raw=False, strict_map_key=False)
+    if frames[0] == STRUCT_TAG:
+        opcode, status = STRUCT_REPLY.unpack(frames[1])
+        return {'opcode': opcode, 'status': status, 'payload': frames[2]}
+    return json.loads(frames[0].decode('utf-8'))
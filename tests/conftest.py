@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Tests of the canopen_daemon modules, which need no CAN hardware.
+    The daemon modules are flat scripts - make them importable.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'canopen_daemon'))
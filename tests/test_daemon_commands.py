@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import time
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip('canopen')
+can = pytest.importorskip('can')
+
+import daemon_commands  # registers the commands
+from command_registry import CommandError, DaemonContext, Param, registry
+from heartbeat_monitor import HeartbeatMonitor
+
+
+class _Network(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, can_id, data):
+        self.sent.append((can_id, bytes(data)))
+
+
+@pytest.fixture
+def ctx():
+    monitor = HeartbeatMonitor('test')
+    yield DaemonContext(_Network(), heartbeat_monitor=monitor)
+    monitor.stop()
+
+
+def test_nmt_change_states_without_nodes_is_not_confirmed(ctx):
+    reply_cmd, reply = registry.dispatch(ctx, 'nmt_change_states', {'new_state': 'OPERATIONAL', 'wait': 0.05})
+    assert reply_cmd == 'nmt_change_states'
+    assert ctx.network.sent == [(0x000, b'\x01\x00')]
+    assert reply['nodes'] == {}
+    assert reply['confirmed'] is False
+
+
+def test_nmt_change_states_confirmed_by_heartbeat(ctx):
+    # Heartbeat of node 3 arriving while the command waits (OPERATIONAL)
+    ctx.network.send_message = lambda can_id, data: ctx.heartbeat_monitor.on_message_received(
+        can.Message(arbitration_id=0x703, data=[0x05], is_extended_id=False))
+    reply_cmd, reply = registry.dispatch(ctx, 'nmt_change_states',
+                                         {'node_ids': [3], 'new_state': 'OPERATIONAL', 'wait': 1})
+    assert reply['confirmed'] is True
+    assert reply['nodes'][3]['state'] == 'OPERATIONAL'
+
+
+# ================================================================================
+# Batches - sub-commands recording their execution order
+_executed = []
+
+
+@registry.register('test_batch_step', params=(Param('node_id', 0, int), Param('value', 0, int),
+                                              Param('delay', 0, float), Param('fail', False, bool)))
+def _test_batch_step(ctx, req):
+    time.sleep(req.delay)
+    _executed.append((req.node_id, req.value))
+    if req.fail:
+        raise CommandError('step %d failed' % req.value)
+    return {}
+
+
+class _Bus(object):
+    def __init__(self, name, context=None):
+        self.name = name
+        self.context = context
+
+
+class _Buses(object):
+    def __init__(self, *buses):
+        self._buses = {bus.name: bus for bus in buses}
+
+    def get(self, name):
+        return self._buses[name]
+
+
+@pytest.fixture
+def batch_ctx():
+    del _executed[:]
+    bus = _Bus('can0')
+    bus.context = context = DaemonContext(_Network(), bus=bus, buses=_Buses(bus))
+    return context
+
+
+def _step(node_id, value, **parameters):
+    parameters.update(node_id=node_id, value=value)
+    return {'cmd': 'test_batch_step', 'parameters': parameters}
+
+
+def test_batch_keeps_order_of_a_node_on_the_default_bus(batch_ctx):
+    # Node 3 addressed without bus and via the name of the bus of the batch - one group
+    commands = [_step(3, 1, delay=0.05), _step(3, 2, bus='can0'), _step(3, 3), _step(4, 1, bus='can0')]
+    reply_cmd, reply = registry.dispatch(batch_ctx, 'batch', {'commands': commands})
+    assert reply['errors'] == 0
+    assert [value for node_id, value in _executed if node_id == 3] == [1, 2, 3]
+
+
+def test_batch_stop_on_error(batch_ctx):
+    commands = [_step(3, 1), _step(3, 2, fail=True), _step(3, 3), _step(3, 4)]
+    reply_cmd, reply = registry.dispatch(batch_ctx, 'batch', {'commands': commands, 'stop_on_error': True})
+    assert _executed == [(3, 1), (3, 2)]
+    assert [result['reply_cmd'] for result in reply['results']] == [
+        'test_batch_step', 'err: step 2 failed', 'skipped', 'skipped']
+    assert (reply['errors'], reply['skipped']) == (1, 2)
+
+
+def test_batch_stop_on_error_sequential(batch_ctx):
+    # parallel = False stops exactly at the first error, across nodes
+    commands = [_step(3, 1, fail=True), _step(4, 1), _step(5, 1)]
+    reply_cmd, reply = registry.dispatch(batch_ctx, 'batch', {'commands': commands, 'parallel': False})
+    assert _executed == [(3, 1)]
+    assert reply['skipped'] == 2
+
+
+def test_batch_without_stop_on_error_runs_everything(batch_ctx):
+    commands = [_step(3, 1, fail=True), _step(3, 2), _step(4, 1)]
+    reply_cmd, reply = registry.dispatch(batch_ctx, 'batch', {'commands': commands, 'stop_on_error': False})
+    assert sorted(_executed) == [(3, 1), (3, 2), (4, 1)]
+    assert (reply['errors'], reply['skipped']) == (1, 0)
+
+
+# ================================================================================
+# Raw SDO download - data as bytes, list of byte values or hex string
+class _Engine(object):
+    def __init__(self):
+        self.downloads = []
+
+    def download(self, node_id, index, subindex, data, timeout=None):
+        self.downloads.append(data)
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+class _NodeNetwork(_Network, dict):
+    def __init__(self):
+        _Network.__init__(self)
+        self[3] = object()
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'\x4D\x3C', b'\x4D\x3C'), ([0x4D, 0x3C], b'\x4D\x3C'), ('4D3C', b'\x4D\x3C'), (None, b''),
+])
+def test_sdo_download_raw_data(data, expected):
+    ctx = DaemonContext(_NodeNetwork(), sdo_engine=_Engine())
+    parameters = {'node_id': 3, 'index': 0x6011, 'subindex': 1, 'raw': True}
+    if data is not None:
+        parameters['data'] = data
+    reply_cmd, reply = registry.dispatch(ctx, 'sdo_download', parameters)
+    assert reply_cmd == 'sdo_download'
+    assert ctx.sdo_engine.downloads == [expected]
+
+
+@pytest.mark.parametrize('data', ['not hex', [256], 17])
+def test_sdo_download_raw_data_rejected(data):
+    ctx = DaemonContext(_NodeNetwork(), sdo_engine=_Engine())
+    reply_cmd, reply = registry.dispatch(ctx, 'sdo_download', {'node_id': 3, 'index': 0x6011, 'subindex': 1,
+                                                               'raw': True, 'data': data})
+    assert reply_cmd.startswith('err: data must be bytes')
+    assert ctx.sdo_engine.downloads == []
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import time
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+can = pytest.importorskip('can')
+
+from emcy_monitor import EmcyMonitor
+
+_channels = itertools.count()
+
+
+class _Streamer(object):
+    def __init__(self):
+        self.events = []
+
+    def publish_event(self, kind, event):
+        self.events.append((kind, event))
+
+
+@pytest.fixture
+def bus():
+    # Monitor attached to the notifier of a network and a node sending on the same virtual bus
+    channel = 'test_emcy_monitor_%d' % next(_channels)
+    network = canopen.Network()
+    # Short notifier cycle - the teardown waits for it
+    network.NOTIFIER_CYCLE = 0.05
+    network.connect(interface='virtual', channel=channel, receive_own_messages=False)
+    streamer = _Streamer()
+    monitor = EmcyMonitor('can0', streamer, history_limit=3)
+    monitor.streamer_events = streamer.events
+    network.notifier.add_listener(monitor)
+    node = can.Bus(interface='virtual', channel=channel)
+    yield monitor, node
+    node.shutdown()
+    network.disconnect()
+
+
+def _emcy(node, node_id, data):
+    node.send(can.Message(arbitration_id=0x080 + node_id, data=data, is_extended_id=False))
+
+
+def _wait_received(monitor, count, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while monitor.received < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert monitor.received == count
+
+
+def test_history_is_bounded_and_queried(bus):
+    monitor, node = bus
+    for code in (0x1000, 0x2310, 0x3210, 0x4210):
+        _emcy(node, 3, code.to_bytes(2, 'little') + b'\x01\xAA\xBB')
+    _emcy(node, 5, b'\x30\x81\x11')
+    _wait_received(monitor, 5)
+    # Only the last 3 records of node 3 are kept
+    assert [record['code'] for record in monitor.query(3)] == [0x2310, 0x3210, 0x4210]
+    assert monitor.query(3)[0]['data'] == [0xAA, 0xBB]
+    assert monitor.query(5)[0]['data'] == []
+    assert [record['code'] for record in monitor.query(3, code_min=0x3000, code_max=0x3FFF)] == [0x3210]
+    assert [record['code'] for record in monitor.query(limit=2)] == [0x4210, 0x8130]
+    assert monitor.query(3, start=monitor.query(3)[-1]['timestamp'])[0]['code'] == 0x4210
+    assert monitor.stats()['nodes'] == {3: {'history': 3, 'active': 4}, 5: {'history': 1, 'active': 1}}
+    assert [event['node_id'] for kind, event in monitor.streamer_events if kind == 'emcy'] == [3, 3, 3, 3, 5]
+
+
+def test_error_reset_clears_active_records(bus):
+    monitor, node = bus
+    _emcy(node, 3, b'\x10\x32\x04')
+    _emcy(node, 3, b'\x00\x50\x80')
+    _emcy(node, 4, b'\x10\x32\x04')
+    _wait_received(monitor, 3)
+    assert [record['code'] for record in monitor.active(3)] == [0x3210, 0x5000]
+    # Code 0x0000 - error reset of node 3 only
+    _emcy(node, 3, b'\x00\x00\x00')
+    _wait_received(monitor, 4)
+    assert monitor.active(3) == []
+    assert len(monitor.active(4)) == 1
+    # The reset stays in the history
+    assert [record['code'] for record in monitor.query(3)] == [0x3210, 0x5000, 0x0000]
+    monitor.clear(3)
+    assert monitor.query(3) == [] and monitor.query(4)
+
+
+def test_other_frames_are_ignored(bus):
+    monitor, node = bus
+    # SYNC, too short, remote frame, extended ID
+    node.send(can.Message(arbitration_id=0x080, data=b'', is_extended_id=False))
+    _emcy(node, 3, b'\x10\x32')
+    node.send(can.Message(arbitration_id=0x083, is_remote_frame=True, dlc=8, is_extended_id=False))
+    node.send(can.Message(arbitration_id=0x083, data=b'\x10\x32\x04', is_extended_id=True))
+    _emcy(node, 3, b'\x10\x32\x04')
+    _wait_received(monitor, 1)
+    assert len(monitor.query()) == 1
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import binascii
+import itertools
+import struct
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+can = pytest.importorskip('can')
+
+import firmware_flash
+from firmware_flash import flash_node, open_image, BLOCK_BYTES, PROGRAM_CONTROL, PROGRAM_DATA
+from sdo_engine import SdoEngine
+
+_channels = itertools.count()
+
+
+class _Bootloader(object):
+    # SDO server of a node on the virtual bus: expedited writes of 0x1F51, block download of 0x1F50
+    def __init__(self, channel, node_id, abort_control=None):
+        self.node_id = node_id
+        self.abort_control = abort_control
+        self.controls = []
+        self.image = None
+        self.crc_ok = None
+        self._block = None
+        self._seqno = 0
+        self.bus = can.Bus(interface='virtual', channel=channel)
+        self.notifier = can.Notifier(self.bus, [self._on_request], timeout=0.05)
+
+    def _respond(self, data):
+        self.bus.send(can.Message(arbitration_id=0x580 + self.node_id, data=bytes(data).ljust(8, b'\x00'),
+                                  is_extended_id=False))
+
+    def _on_request(self, msg):
+        if msg.arbitration_id != 0x600 + self.node_id:
+            return
+        data = bytes(msg.data)
+        command = data[0]
+        if self._block is not None:
+            # Block segments: sequence number, 7 bytes
+            self._seqno = command & 0x7F
+            self._block.extend(data[1:8])
+            if command & 0x80 or self._seqno == 127:
+                self._respond(bytes([0xA2, self._seqno, 127]))
+                if command & 0x80:
+                    self.image, self._block = self._block, None
+            return
+        if command == 0x80:
+            return
+        index, subindex = struct.unpack_from('<HB', data, 1)
+        if command & 0xE0 == 0x20 and index == PROGRAM_CONTROL:
+            if data[4] == self.abort_control:
+                self._respond(struct.pack('<BHBI', 0x80, index, subindex, 0x08000020))
+                return
+            self.controls.append((subindex, data[4]))
+            self._respond(struct.pack('<BHB', 0x60, index, subindex))
+        elif command & 0xE1 == 0xC0 and index == PROGRAM_DATA:
+            # Initiate - CRC supported, 127 segments per block
+            self._block = bytearray()
+            self._respond(struct.pack('<BHBB', 0xA4, index, subindex, 127))
+        elif command & 0xE1 == 0xC1:
+            # End - unused bytes of the last segment and CRC
+            unused = (command >> 2) & 0x07
+            del self.image[len(self.image) - unused:]
+            crc, = struct.unpack_from('<H', data, 1)
+            self.crc_ok = crc == binascii.crc_hqx(bytes(self.image), 0)
+            self._respond(b'\xA1')
+
+    def shutdown(self):
+        self.notifier.stop()
+        self.bus.shutdown()
+
+
+class _Recording(object):
+    # File object of the block download, recording the slices written
+    def __init__(self, fp, slices):
+        self._fp = fp
+        self._slices = slices
+
+    def write(self, data):
+        self._slices.append(len(data))
+        return self._fp.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+@pytest.fixture
+def bus():
+    channel = 'test_firmware_flash_%d' % next(_channels)
+    network = canopen.Network()
+    # Short notifier cycle - the teardown waits for it
+    network.NOTIFIER_CYCLE = 0.05
+    network.connect(interface='virtual', channel=channel, receive_own_messages=False)
+    bootloaders = []
+
+    def create(node_id, **kwargs):
+        bootloaders.append(_Bootloader(channel, node_id, **kwargs))
+        node = network.add_node(canopen.RemoteNode(node_id, canopen.ObjectDictionary()))
+        node.slices = []
+        open_stream = node.sdo.open
+        node.sdo.open = lambda *args, **kwargs: _Recording(open_stream(*args, **kwargs), node.slices)
+        return bootloaders[-1], node
+    yield SdoEngine(network), create
+    for bootloader in bootloaders:
+        bootloader.shutdown()
+    network.disconnect()
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / 'firmware.bin'
+    path.write_bytes(bytes(range(256)) * 8)
+    return str(path)
+
+
+def test_stop_clear_download_start(bus, image_path):
+    sdo_engine, create = bus
+    bootloader, node = create(5)
+    events = []
+    with open_image(image_path) as image:
+        result = flash_node(sdo_engine, node, image, program=1, publish=events.append)
+        expected = bytes(image)
+    assert result['success'], result['error']
+    # Program control: stop, clear, start
+    assert bootloader.controls == [(1, 0), (1, 3), (1, 1)]
+    assert bytes(bootloader.image) == expected and bootloader.crc_ok
+    # Slices of one full block, the rest last
+    assert node.slices == [BLOCK_BYTES, BLOCK_BYTES, len(expected) - 2 * BLOCK_BYTES]
+    assert result['transferred'] == len(expected)
+    assert events[-1]['state'] == 'done'
+
+
+def test_without_clear_and_start(bus, image_path):
+    sdo_engine, create = bus
+    bootloader, node = create(6)
+    with open_image(image_path) as image:
+        result = flash_node(sdo_engine, node, image, program=2, clear=False, start=False)
+    assert result['success'], result['error']
+    assert bootloader.controls == [(2, 0)]
+
+
+def test_failed_clear_skips_the_download(bus, image_path):
+    sdo_engine, create = bus
+    bootloader, node = create(7, abort_control=firmware_flash.CONTROL_CLEAR)
+    events = []
+    with open_image(image_path) as image:
+        result = flash_node(sdo_engine, node, image, publish=events.append)
+    assert not result['success']
+    assert result['error'].startswith('clear:')
+    assert bootloader.controls == [(1, 0)] and bootloader.image is None
+    assert node.slices == [] and events[-1]['state'] == 'failed'
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+can = pytest.importorskip('can')
+
+import frame_burst
+
+
+def test_pack_unpack_round_trip():
+    payload = frame_burst.pack_frames([(0x181, b'\x01\x02'), (0x18FF0001 | frame_burst.EXTENDED_FLAG, b'', 500),
+                                       (0x7FF, bytes(range(8)), 0)])
+    assert len(payload) == 3 * frame_burst.BURST_FRAME.size
+    assert frame_burst.unpack_frames(payload) == [(0x181, False, b'\x01\x02', 0.0),
+                                                  (0x18FF0001, True, b'', 500e-6),
+                                                  (0x7FF, False, bytes(range(8)), 0.0)]
+
+
+def test_unpack_rejects_partial_frames():
+    with pytest.raises(ValueError):
+        frame_burst.unpack_frames(b'\x00' * (frame_burst.BURST_FRAME.size + 1))
+
+
+def test_frame_bits():
+    assert frame_burst.frame_bits(8, False) == 132
+    assert frame_burst.frame_bits(0, False) == 52
+    assert frame_burst.frame_bits(8, True) > frame_burst.frame_bits(8, False)
+
+
+class _Bus(object):
+    def __init__(self, fail_every=0):
+        self.sent = []
+        self.fail_every = fail_every
+
+    def send(self, msg):
+        if self.fail_every and (len(self.sent) + 1) % self.fail_every == 0:
+            self.sent.append(None)
+            raise can.CanError('TX buffer full')
+        self.sent.append(msg)
+
+
+class _Network(object):
+    def __init__(self, bus):
+        self.bus = bus
+        self.send_lock = threading.Lock()
+
+
+def test_send_burst_counts_errors():
+    bus = _Bus(fail_every=3)
+    frames = frame_burst.unpack_frames(frame_burst.pack_frames([(0x100 + n, b'\x00') for n in range(9)]))
+    result = frame_burst.send_burst(_Network(bus), frames, 250000, bus_load=0)
+    assert (result['sent'], result['errors']) == (6, 3)
+    assert [detail['position'] for detail in result['error_details']] == [2, 5, 8]
+    assert [msg.arbitration_id for msg in bus.sent if msg is not None][:2] == [0x100, 0x101]
+
+
+def test_send_burst_is_paced():
+    frames = frame_burst.unpack_frames(frame_burst.pack_frames([(0x181, bytes(8))] * 50))
+    result = frame_burst.send_burst(_Network(_Bus()), frames, 125000, bus_load=0.5)
+    # 50 frames of 132 bits at 62500 bit/s take about 100 ms
+    assert result['duration_ms'] >= 90
+    assert result['bus_load'] <= 0.55
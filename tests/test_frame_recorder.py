@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+can = pytest.importorskip('can')
+
+from frame_recorder import FrameRecorder, EXTENDED_FLAG
+
+
+def _msg(can_id, data=b'', timestamp=0.0, **kwargs):
+    return can.Message(arbitration_id=can_id, data=data, timestamp=timestamp, **kwargs)
+
+
+def test_query_returns_frames_in_order():
+    recorder = FrameRecorder(capacity=4)
+    for position in range(3):
+        recorder.on_message_received(_msg(0x181, bytes([position, 0xAA]), timestamp=float(position)))
+    columns = recorder.query()
+    assert columns['can_id'] == [0x181, 0x181, 0x181]
+    assert columns['timestamp'] == [0.0, 1.0, 2.0]
+    assert columns['data'] == [[0, 0xAA], [1, 0xAA], [2, 0xAA]]
+
+
+def test_ring_buffer_overwrites_oldest():
+    recorder = FrameRecorder(capacity=3)
+    for position in range(5):
+        recorder.on_message_received(_msg(0x200 + position, b'\x01', timestamp=float(position)))
+    assert recorder.query()['can_id'] == [0x202, 0x203, 0x204]
+    assert recorder.stats()['overwritten'] == 2
+
+
+def test_remote_frame_keeps_buffer_size():
+    recorder = FrameRecorder(capacity=3)
+    # Node guarding request: DLC 1, no data
+    rtr = _msg(0x703, timestamp=1.0, is_remote_frame=True, dlc=1)
+    assert rtr.dlc == 1 and len(rtr.data) == 0
+    recorder.on_message_received(_msg(0x181, bytes(range(8)), timestamp=0.0))
+    recorder.on_message_received(rtr)
+    recorder.on_message_received(_msg(0x182, bytes(range(8, 16)), timestamp=2.0))
+    recorder.on_message_received(_msg(0x183, b'\xFF', timestamp=3.0))
+    assert len(recorder.data) == 3 * 8
+    columns = recorder.query(raw_data=True)
+    assert columns['can_id'] == [0x703, 0x182, 0x183]
+    assert columns['data'] == [b'', bytes(range(8, 16)), b'\xFF']
+
+
+def test_error_frames_are_not_recorded():
+    recorder = FrameRecorder(capacity=3)
+    recorder.on_message_received(_msg(0x0, timestamp=0.0, is_error_frame=True))
+    assert recorder.stats()['count'] == 0
+
+
+def test_query_window_ids_and_limit():
+    recorder = FrameRecorder(capacity=10)
+    for position in range(6):
+        recorder.on_message_received(_msg(0x181 + position % 2, b'\x00', timestamp=float(position)))
+    recorder.on_message_received(_msg(0x181, b'\x00', timestamp=6.0, is_extended_id=True))
+    assert recorder.query(can_ids=[0x182])['timestamp'] == [1.0, 3.0, 5.0]
+    assert recorder.query(start=2.0, end=4.0)['timestamp'] == [2.0, 3.0, 4.0]
+    assert recorder.query(limit=2)['timestamp'] == [5.0, 6.0]
+    assert recorder.can_ids[6] & EXTENDED_FLAG
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+import pytest
+
+can = pytest.importorskip('can')
+zmq = pytest.importorskip('zmq')
+
+import frame_stream
+from frame_stream import FrameStreamer, StreamFilter
+
+
+def _msg(can_id, value=0):
+    return can.Message(arbitration_id=can_id, data=[value], is_extended_id=False)
+
+
+@pytest.mark.parametrize('policy, kept', [('drop_oldest', [2, 3, 4]), ('drop_newest', [0, 1, 2])])
+def test_filter_policies(policy, kept):
+    stream_filter = StreamFilter('f', 0x180, 0x7FF, limit=3, policy=policy)
+    for value in range(5):
+        stream_filter.push(_msg(0x180, value))
+    assert [msg.data[0] for msg in stream_filter.queue] == kept
+    assert (stream_filter.matched, stream_filter.dropped) == (5, 2)
+
+
+class _Drained(collections.deque):
+    # The publisher thread empties the queue right after the length check
+    def __len__(self):
+        length = super(_Drained, self).__len__()
+        self.clear()
+        return length
+
+
+def test_filter_push_while_publisher_pops():
+    stream_filter = StreamFilter('f', 0x180, 0x7FF, limit=1)
+    stream_filter.queue = _Drained([_msg(0x180, 0)], maxlen=1)
+    stream_filter.push(_msg(0x180, 1))
+    assert [msg.data[0] for msg in stream_filter.queue] == [1]
+    assert stream_filter.dropped == 1
+
+
+def test_events_dropped_when_queue_full(monkeypatch):
+    monkeypatch.setattr(frame_stream, 'EVENT_QUEUE_LIMIT', 3)
+    context = zmq.Context()
+    streamer = FrameStreamer(context, 'inproc://test-frame-stream')
+    try:
+        # Keep the publisher from draining the queue
+        streamer._stop.set()
+        streamer._thread.join()
+        streamer._events = frame_stream.collections.deque(maxlen=3)
+        for index in range(5):
+            streamer.publish_event('emcy', {'index': index})
+        assert streamer.events_dropped == 2
+        assert len(streamer._events) == 3
+    finally:
+        context.term()
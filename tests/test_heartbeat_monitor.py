@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+can = pytest.importorskip('can')
+
+import heartbeat_monitor
+from heartbeat_monitor import HeartbeatMonitor
+from emcy_monitor import EmcyMonitor
+
+
+def _msg(can_id, data=b'', **kwargs):
+    return can.Message(arbitration_id=can_id, data=data, is_extended_id=False, **kwargs)
+
+
+class _Streamer(object):
+    def __init__(self):
+        self.events = []
+
+    def publish_event(self, kind, event):
+        self.events.append((kind, event))
+
+
+@pytest.fixture
+def monitor():
+    streamer = _Streamer()
+    monitor = HeartbeatMonitor('test', streamer)
+    monitor.streamer_events = streamer.events
+    yield monitor
+    monitor.stop()
+
+
+def test_state_changes_are_published(monitor):
+    monitor.on_message_received(_msg(0x703, data=b'\x00'))
+    monitor.on_message_received(_msg(0x703, data=b'\x7F'))
+    monitor.on_message_received(_msg(0x703, data=b'\x7F'))
+    assert monitor.states([3])[3]['state'] == 'PRE-OPERATIONAL'
+    assert [event['state'] for kind, event in monitor.streamer_events if kind == 'nmt'] == \
+        ['INITIALISING', 'PRE-OPERATIONAL']
+
+
+def test_node_guarding_response_masks_toggle_bit(monitor):
+    monitor.on_message_received(_msg(0x705, data=b'\x85'))
+    assert monitor.states([5])[5]['state'] == 'OPERATIONAL'
+
+
+def test_remote_frames_are_ignored(monitor):
+    monitor.on_message_received(_msg(0x703, is_remote_frame=True, dlc=1))
+    assert monitor.states() == {}
+
+
+def test_wait_states_returns_reached_state(monitor):
+    monitor.on_message_received(_msg(0x703, data=b'\x05'))
+    assert monitor.wait_states({3: 'OPERATIONAL'}, 0.1)[3] is not None
+    assert monitor.wait_states({3: 'STOPPED', 4: 'OPERATIONAL'}, 0.05) == {3: None, 4: None}
+
+
+def test_wait_states_does_not_register_absent_nodes(monitor):
+    assert monitor.wait_states({9: 'OPERATIONAL'}, 0.01) == {9: None}
+    assert monitor.states() == {}
+
+
+def test_emcy_remote_frame_is_not_a_reset():
+    emcy = EmcyMonitor('test')
+    emcy.on_message_received(_msg(0x083, data=b'\x10\x32\x04\x01\x02'))
+    emcy.on_message_received(_msg(0x083, is_remote_frame=True, dlc=8))
+    active = emcy.active(3)
+    assert [(record['code'], record['register'], record['data']) for record in active] == [(0x3210, 0x04, [1, 2])]
+    assert emcy.stats()['received'] == 1
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import struct
+import time
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+can = pytest.importorskip('can')
+
+import network_scanner
+from network_scanner import NetworkScanner
+
+_channels = itertools.count()
+
+
+class _Nodes(object):
+    # SDO servers answering expedited uploads on the virtual bus
+    def __init__(self, channel, objects):
+        # node_id -> {(index, subindex): value}
+        self.objects = objects
+        self.bus = can.Bus(interface='virtual', channel=channel)
+        self.notifier = can.Notifier(self.bus, [self._on_request], timeout=0.05)
+
+    def _on_request(self, msg):
+        node_id = msg.arbitration_id - 0x600
+        if node_id not in self.objects or msg.data[0] != 0x40:
+            return
+        index, subindex = struct.unpack_from('<HB', msg.data, 1)
+        value = self.objects[node_id].get((index, subindex), 0)
+        self.bus.send(can.Message(arbitration_id=0x580 + node_id, is_extended_id=False,
+                                  data=bytes([0x43]) + bytes(msg.data[1:4]) + struct.pack('<I', value)))
+
+    def shutdown(self):
+        self.notifier.stop()
+        self.bus.shutdown()
+
+
+@pytest.fixture
+def bus():
+    channel = 'test_network_scanner_%d' % next(_channels)
+    network = canopen.Network()
+    # Short notifier cycle - the teardown waits for it
+    network.NOTIFIER_CYCLE = 0.05
+    network.connect(interface='virtual', channel=channel, receive_own_messages=False)
+    nodes = []
+
+    def create(objects):
+        nodes.append(_Nodes(channel, objects))
+        return nodes[-1]
+    yield network, create
+    for node in nodes:
+        node.shutdown()
+    network.disconnect()
+
+
+def test_requests_are_paced(bus):
+    network, create = bus
+    create({})
+    sent = []
+    send_message = network.send_message
+
+    def record(can_id, data):
+        sent.append(time.perf_counter())
+        send_message(can_id, data)
+    network.send_message = record
+    # 135 bits at 54 kbit/s with 50 % bus load - one request per 5 ms
+    scanner = NetworkScanner(network, bitrate=54000)
+    assert scanner.frame_interval == pytest.approx(0.005)
+    scanner.scan(limit=10)
+    assert len(sent) == 10
+    # Token bucket: request n is never sent before n intervals passed
+    for n, timestamp in enumerate(sent):
+        assert timestamp - sent[0] >= n * 0.005 - 0.0005
+
+
+def test_quiet_time_ends_the_scan(bus, monkeypatch):
+    monkeypatch.setattr(network_scanner, 'MIN_QUIET_TIME', 0.3)
+    network, create = bus
+    create({2: {}, 5: {}})
+    result = NetworkScanner(network).scan(limit=10, timeout=2.0)
+    assert result['nodes'] == [2, 5]
+    # Quiet time after the last response, well before the timeout
+    assert 300 <= result['duration_ms'] < 1500
+    assert set(result['latency_ms']) == {2, 5}
+
+
+def test_expected_nodes_end_the_scan(bus, monkeypatch):
+    monkeypatch.setattr(network_scanner, 'MIN_QUIET_TIME', 0.5)
+    network, create = bus
+    create({2: {}, 5: {}})
+    result = NetworkScanner(network).scan(limit=10, expected=[2, 5], timeout=2.0)
+    assert result['nodes'] == [2, 5]
+    assert result['duration_ms'] < 400
+
+
+def test_identity(bus):
+    network, create = bus
+    create({3: {(0x1018, 1): 0x1234, (0x1018, 2): 7, (0x1018, 3): 0x10001, (0x1018, 4): 42}})
+    result = NetworkScanner(network).scan(limit=5, identity=True)
+    assert result['identity'] == {3: {'vendor_id': 0x1234, 'product_code': 7, 'revision': 0x10001, 'serial': 42}}
+    # All subscriptions of the scan are gone
+    assert not [can_id for can_id in network.subscribers if 0x580 < can_id <= 0x5FF]
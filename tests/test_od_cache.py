@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+
+from od_cache import ObjectDictionaryCache
+
+EDS = """[DeviceInfo]
+ProductName=Test
+
+[MandatoryObjects]
+SupportedObjects=1
+1=0x1000
+
+[1000]
+ParameterName=Device type
+ObjectType=0x7
+DataType=0x0007
+AccessType=ro
+DefaultValue=%s
+
+[OptionalObjects]
+SupportedObjects=1
+1=0x1014
+
+[1014]
+ParameterName=COB-ID EMCY
+ObjectType=0x7
+DataType=0x0007
+AccessType=rw
+DefaultValue=%s
+"""
+
+
+def _write(path, device_type='0x191', emcy='0x80'):
+    with open(path, 'w') as fp:
+        fp.write(EDS % (device_type, emcy))
+    # The mtime alone may not change within the timer resolution
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+
+
+def _pickles(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.pickle'))
+
+
+def test_hit_shares_the_dictionary(tmp_path):
+    path = str(tmp_path / 'node.eds')
+    _write(path)
+    cache = ObjectDictionaryCache()
+    od = cache.get(path, 1)
+    assert cache.get(path, 2) is od
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_edit_is_a_miss_and_evicts_old_pickles(tmp_path):
+    path = str(tmp_path / 'node.eds')
+    cache_dir = str(tmp_path / 'cache')
+    _write(path)
+    cache = ObjectDictionaryCache(cache_dir)
+    assert cache.get(path)[0x1000].default == 0x191
+    old = _pickles(cache_dir)
+    assert len(old) == 1
+    _write(path, device_type='0x192')
+    assert cache.get(path)[0x1000].default == 0x192
+    assert cache.misses == 2
+    new = _pickles(cache_dir)
+    assert len(new) == 1 and new != old
+
+
+def test_pickle_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'node.eds')
+    cache_dir = str(tmp_path / 'cache')
+    _write(path)
+    ObjectDictionaryCache(cache_dir).get(path)
+    restarted = ObjectDictionaryCache(cache_dir)
+    assert restarted.get(path)[0x1000].default == 0x191
+    assert (restarted.disk_hits, restarted.misses) == (1, 0)
+
+
+def test_nodeid_is_parsed_per_node(tmp_path):
+    path = str(tmp_path / 'node.eds')
+    cache_dir = str(tmp_path / 'cache')
+    _write(path, emcy='$NODEID+0x80')
+    cache = ObjectDictionaryCache(cache_dir)
+    assert cache.get(path, 3)[0x1014].default == 0x83
+    assert cache.get(path, 5)[0x1014].default == 0x85
+    assert cache.get(path, 3) is not cache.get(path, 5)
+    assert cache.misses == 2
+    # Both nodes of the current content keep their pickles
+    assert len(_pickles(cache_dir)) == 2
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import Future
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+from canopen.objectdictionary import ObjectDictionary, Variable, UNSIGNED32
+
+import od_snapshot
+
+
+class _Engine(object):
+    # Answers uploads from values (bytes) or exceptions, by index
+    def __init__(self, answers):
+        self.answers = answers
+        self.uploads = []
+
+    def upload(self, node_id, index, subindex, timeout=None):
+        self.uploads.append(index)
+        future = Future()
+        answer = self.answers[index]
+        if isinstance(answer, Exception):
+            future.set_exception(answer)
+        else:
+            future.set_result(answer)
+        return future
+
+
+class _Node(object):
+    def __init__(self, indices):
+        self.id = 3
+        self.object_dictionary = ObjectDictionary()
+        for index in indices:
+            var = Variable('Object 0x%04X' % index, index, 0)
+            var.data_type = UNSIGNED32
+            var.access_type = 'ro'
+            self.object_dictionary.add_object(var)
+
+
+def test_snapshot_via_engine_with_aborts():
+    engine = _Engine({0x1000: b'\x92\x01\x02\x00', 0x1001: canopen.SdoAbortedError(0x06020000),
+                      0x1002: b'\x00\x00\x00\x00'})
+    result = od_snapshot.take_snapshot(engine, _Node([0x1000, 0x1001, 0x1002]))
+    assert result['snapshot'] == {'1000:00': '92010200', '1002:00': '00000000'}
+    assert list(result['errors']) == ['1001:00']
+    assert result['bytes'] == 8
+
+
+def test_snapshot_aborts_on_communication_error():
+    engine = _Engine({0x1000: canopen.SdoCommunicationError('No SDO response received'),
+                      0x1001: b'\x00', 0x1002: b'\x00'})
+    with pytest.raises(canopen.SdoCommunicationError):
+        od_snapshot.take_snapshot(engine, _Node([0x1000, 0x1001, 0x1002]))
+    # No time wasted on the remaining objects
+    assert engine.uploads == [0x1000]
+
+
+def test_diff_snapshots():
+    golden = {'1000:00': '92010200', '1018:04': 'AABBCCDD'}
+    snapshot = {'1000:00': '92010200', '1018:04': '00000001', '1001:00': '00'}
+    assert od_snapshot.diff_snapshots(golden, snapshot, ['1018:04']) == {
+        '1001:00': {'expected': None, 'actual': '00'}}
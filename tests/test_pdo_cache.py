@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+pytest.importorskip('canopen')
+from canopen.objectdictionary import datatypes
+
+from pdo_cache import PdoValueCache
+
+
+class _Od(object):
+    def __init__(self, data_type):
+        self.data_type = data_type
+
+
+class _Variable(object):
+    def __init__(self, index, subindex, data_type, length):
+        self.index = index
+        self.subindex = subindex
+        self.od = _Od(data_type)
+        self.length = length
+        self.raw = None
+
+
+class _PdoMap(object):
+    # The parts of a python-canopen PDO map used by the cache
+    def __init__(self, cob_id, variables):
+        self.cob_id = cob_id
+        self.map = variables
+        self.callbacks = []
+        self.data = b''
+        self.timestamp = None
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def receive(self, data, timestamp=1.0):
+        self.data = data
+        self.timestamp = timestamp
+        for callback in self.callbacks:
+            callback(self)
+
+
+def _map(cob_id=0x183):
+    return _PdoMap(cob_id, [_Variable(0x6000, 1, datatypes.UNSIGNED16, 16),
+                            _Variable(0x6000, 2, datatypes.UNSIGNED8, 8)])
+
+
+def test_decoded_values_are_cached():
+    cache = PdoValueCache()
+    pdo_map = _map()
+    cache.attach(3, pdo_map)
+    pdo_map.receive(b'\x34\x12\x07')
+    assert cache.get(3, 0x6000, 1)['value'] == 0x1234
+    assert cache.get(3, 0x6000, 2)['value'] == 7
+    pdo_map.receive(b'\x01\x00\x02')
+    assert cache.get(3, 0x6000, 1)['count'] == 2
+
+
+def test_reattach_replaces_callback_and_decoder():
+    cache = PdoValueCache()
+    pdo_map = _map(0x183)
+    cache.attach(3, pdo_map)
+    # New COB-ID - the decoder of the old one must not stay behind
+    pdo_map.cob_id = 0x283
+    cache.attach(3, pdo_map)
+    assert list(cache.decoders) == [0x283]
+    assert len(pdo_map.callbacks) == 1
+
+
+def test_detach_after_cob_id_change():
+    cache = PdoValueCache()
+    pdo_map = _map(0x183)
+    cache.attach(3, pdo_map)
+    pdo_map.cob_id = 0x283
+    cache.detach(pdo_map)
+    assert cache.decoders == {}
+    assert pdo_map.callbacks == []
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+import pytest
+
+pytest.importorskip('canopen')
+from canopen.objectdictionary import datatypes
+
+import pdo_decoder
+
+
+class _Od(object):
+    def __init__(self, data_type):
+        self.data_type = data_type
+
+
+class _Variable(object):
+    def __init__(self, index, subindex, data_type, length):
+        self.index = index
+        self.subindex = subindex
+        self.od = _Od(data_type)
+        self.length = length
+
+
+class _PdoMap(object):
+    def __init__(self, cob_id, variables):
+        self.cob_id = cob_id
+        self.map = variables
+
+
+def _map():
+    return _PdoMap(0x183, [_Variable(0x6000, 1, datatypes.INTEGER16, 16),
+                           _Variable(0x6000, 2, datatypes.UNSIGNED32, 32),
+                           _Variable(0x6001, 0, datatypes.REAL32, 32)])
+
+
+def test_compile_and_decode():
+    decoder = pdo_decoder.compile_map(_map())
+    assert decoder.cob_id == 0x183
+    assert decoder.keys == ((0x6000, 1), (0x6000, 2), (0x6001, 0))
+    assert decoder.size == 10
+    assert decoder.decode(struct.pack('<hIf', -2, 0xDEADBEEF, 1.5)) == (-2, 0xDEADBEEF, 1.5)
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_decode_batch(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(pdo_decoder, 'numpy', None)
+    decoder = pdo_decoder.compile_map(_map())
+    payloads = [struct.pack('<hIf', value, value * 2, value / 2.0) for value in range(5)] + [b'\x00\x01']
+    columns, skipped = decoder.decode_batch(payloads)
+    # The short frame is skipped
+    assert skipped == 1
+    assert sorted(columns) == ['6000:01', '6000:02', '6001:00']
+    assert list(columns['6000:01']) == [0, 1, 2, 3, 4]
+    assert list(columns['6000:02']) == [0, 2, 4, 6, 8]
+    assert list(columns['6001:00']) == [0.0, 0.5, 1.0, 1.5, 2.0]
+
+
+def test_decode_batch_empty(monkeypatch):
+    monkeypatch.setattr(pdo_decoder, 'numpy', None)
+    columns, skipped = pdo_decoder.compile_map(_map()).decode_batch([])
+    assert columns == {'6000:01': [], '6000:02': [], '6001:00': []} and skipped == 0
+
+
+@pytest.mark.parametrize('pdo_map', [
+    # 24 bit integer - no struct code
+    _PdoMap(0x183, [_Variable(0x6000, 1, datatypes.INTEGER24, 24)]),
+    # Length not matching the data type (bit field)
+    _PdoMap(0x183, [_Variable(0x6000, 1, datatypes.UNSIGNED8, 4)]),
+    # No COB-ID / empty mapping
+    _PdoMap(None, [_Variable(0x6000, 1, datatypes.UNSIGNED8, 8)]),
+    _PdoMap(0x183, []),
+])
+def test_not_compiled(pdo_map):
+    assert pdo_decoder.compile_map(pdo_map) is None
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import time
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+can = pytest.importorskip('can')
+
+from periodic_tasks import PeriodicTasks
+
+_channels = itertools.count()
+
+
+@pytest.fixture
+def bus():
+    # Network and a second node on a private virtual bus
+    channel = 'test_periodic_tasks_%d' % next(_channels)
+    network = canopen.Network()
+    # Short notifier cycle - the teardown waits for it
+    network.NOTIFIER_CYCLE = 0.05
+    network.connect(interface='virtual', channel=channel, receive_own_messages=False)
+    receiver = can.Bus(interface='virtual', channel=channel)
+    yield network, receiver
+    receiver.shutdown()
+    network.disconnect()
+
+
+def _receive(receiver, duration):
+    frames = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        msg = receiver.recv(0.01)
+        if msg is not None:
+            frames.append((msg.arbitration_id, bytes(msg.data)))
+    return frames
+
+
+def _drain(receiver):
+    while receiver.recv(0) is not None:
+        pass
+
+
+def test_lifecycle(bus):
+    network, receiver = bus
+    tasks = PeriodicTasks(network, 'virtual')
+    entry = tasks.start('beat', 0x703, b'\x05', 0.01)
+    frames = _receive(receiver, 0.1)
+    assert len(frames) >= 5 and set(frames) == {(0x703, b'\x05')}
+
+    # Same name, CAN-ID and period - the running task is updated in place
+    assert tasks.start('beat', 0x703, b'\x7F', 0.01) is entry
+    _drain(receiver)
+    assert set(_receive(receiver, 0.05)) == {(0x703, b'\x7F')}
+
+    assert tasks.update('beat', b'\x04')
+    _drain(receiver)
+    assert set(_receive(receiver, 0.05)) == {(0x703, b'\x04')}
+    assert tasks.tasks() == [dict(entry.info(), data=[4], updates=2)]
+
+    assert tasks.stop('beat') == ['beat']
+    _drain(receiver)
+    assert _receive(receiver, 0.05) == []
+    assert tasks.tasks() == []
+
+
+def test_other_period_replaces_the_task(bus):
+    network, receiver = bus
+    tasks = PeriodicTasks(network, 'virtual')
+    first = tasks.start('cmd', 0x200, b'\x01', 0.01)
+    second = tasks.start('cmd', 0x201, b'\x02', 0.01)
+    assert second is not first
+    _drain(receiver)
+    assert set(_receive(receiver, 0.05)) == {(0x201, b'\x02')}
+    tasks.stop()
+
+
+def test_unknown_names(bus):
+    network, receiver = bus
+    tasks = PeriodicTasks(network, 'virtual')
+    assert not tasks.update('missing', b'\x00')
+    assert tasks.stop('missing') == []
+    tasks.start('a', 0x100, b'', 0.01)
+    tasks.start('b', 0x101, b'', 0.01)
+    assert sorted(tasks.stop()) == ['a', 'b']
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+can = pytest.importorskip('can')
+
+import sdo_engine
+from sdo_engine import SdoEngine
+from heartbeat_monitor import HeartbeatMonitor, LOSS_FACTOR, CHECK_INTERVAL
+
+
+class _Network(object):
+    # Records the requests instead of sending them
+    def __init__(self):
+        self.sent = []
+        self.nodes = {}
+
+    def subscribe(self, can_id, callback):
+        pass
+
+    def send_message(self, can_id, data):
+        self.sent.append((can_id, bytes(data)))
+
+
+def _heartbeat(node_id, state=0x05):
+    return can.Message(arbitration_id=0x700 + node_id, data=[state], is_extended_id=False)
+
+
+def _lose_heartbeat(monitor, node_id, period=0.01):
+    monitor.expect(node_id, period)
+    monitor.on_message_received(_heartbeat(node_id))
+    time.sleep(period * LOSS_FACTOR + 3 * CHECK_INTERVAL)
+    assert not monitor.states([node_id])[node_id]['alive']
+
+
+@pytest.fixture
+def monitor():
+    monitor = HeartbeatMonitor('test')
+    yield monitor
+    monitor.stop()
+
+
+def test_heartbeat_loss_opens_breaker(monitor):
+    network = _Network()
+    engine = SdoEngine(network, heartbeat_monitor=monitor)
+    _lose_heartbeat(monitor, 3)
+    with pytest.raises(canopen.SdoCommunicationError, match='circuit breaker'):
+        engine.upload(3, 0x1000, 0).result(1)
+    assert network.sent == []
+    assert engine.node_stats(3)['heartbeat_losses'] == 1
+
+
+def test_heartbeat_loss_expires(monitor, monkeypatch):
+    # A node which only stopped its heartbeat (0x1017 = 0) is reached again after the cooldown
+    monkeypatch.setattr(sdo_engine, 'BREAKER_COOLDOWN', 0.0)
+    network = _Network()
+    engine = SdoEngine(network, heartbeat_monitor=monitor)
+    _lose_heartbeat(monitor, 4)
+    engine.upload(4, 0x1000, 0)
+    assert network.sent[-1][0] == 0x604
+
+
+def test_heartbeat_return_closes_breaker(monitor):
+    network = _Network()
+    engine = SdoEngine(network, heartbeat_monitor=monitor)
+    _lose_heartbeat(monitor, 5)
+    monitor.on_message_received(_heartbeat(5))
+    engine.upload(5, 0x1000, 0)
+    assert network.sent[-1][0] == 0x605
+
+
+def test_boot_ups_do_not_teach_a_period(monitor):
+    monitor.on_message_received(_heartbeat(6, 0x00))
+    monitor.on_message_received(_heartbeat(6, 0x00))
+    assert monitor.states([6])[6]['period_ms'] is None
+
+
+def test_held_node_rejects_transfers():
+    network = _Network()
+    engine = SdoEngine(network)
+    engine.hold(7)
+    with pytest.raises(canopen.SdoCommunicationError, match='block transfer'):
+        engine.upload(7, 0x1000, 0).result(1)
+    assert network.sent == []
+    engine.release(7)
+    engine.upload(7, 0x1000, 0)
+    assert network.sent[-1][0] == 0x607
+
+
+def test_hold_refused_with_transfer_in_flight():
+    engine = SdoEngine(_Network())
+    engine.upload(8, 0x1000, 0)
+    with pytest.raises(IOError, match='in flight'):
+        engine.hold(8)
+
+
+def _respond(engine, node_id, data):
+    engine._on_response(0x580 + node_id, bytes(data), 0.0)
+
+
+def test_empty_download_is_segmented():
+    network = _Network()
+    engine = SdoEngine(network)
+    future = engine.download(9, 0x2000, 0x01, b'')
+    # Initiate of a segmented download with size 0 - expedited cannot carry 0 bytes
+    assert network.sent[-1] == (0x609, b'\x21\x00\x20\x01\x00\x00\x00\x00')
+    _respond(engine, 9, b'\x60\x00\x20\x01\x00\x00\x00\x00')
+    # One segment without data (7 unused bytes, no more data)
+    assert network.sent[-1] == (0x609, b'\x0F' + bytes(7))
+    _respond(engine, 9, b'\x20' + bytes(7))
+    assert future.result(1) is None
+
+
+def test_foreign_response_is_not_an_answer():
+    network = _Network()
+    engine = SdoEngine(network)
+    future = engine.upload(10, 0x1000, 0x00)
+    # Response to another request of the node (i.e. python-canopen's SDO client)
+    _respond(engine, 10, b'\x43\x18\x10\x01\x01\x00\x00\x00')
+    _respond(engine, 10, b'\x80\x18\x10\x01\x00\x00\x02\x06')
+    assert engine.node_stats(10)['samples'] == 0
+    assert not future.done()
+    _respond(engine, 10, b'\x43\x00\x10\x00\x92\x01\x02\x00')
+    assert future.result(1) == b'\x92\x01\x02\x00'
+    assert engine.node_stats(10)['samples'] == 1
+
+
+def _wait_sent(network, count, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while len(network.sent) < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return len(network.sent)
+
+
+def test_late_duplicate_response_is_drained():
+    network = _Network()
+    engine = SdoEngine(network, timeout=0.02)
+    first = engine.upload(11, 0x1000, 0x00)
+    # Initiate unanswered - sent again
+    assert _wait_sent(network, 2) == 2
+    _respond(engine, 11, b'\x43\x00\x10\x00\x01\x00\x00\x00')
+    assert first.result(1) == b'\x01\x00\x00\x00'
+    sent = len(network.sent)
+    second = engine.upload(11, 0x1000, 0x00)
+    assert len(network.sent) == sent
+    # Late answer to the first attempt - must not complete the next transfer
+    _respond(engine, 11, b'\x43\x00\x10\x00\x01\x00\x00\x00')
+    assert not second.done()
+    assert _wait_sent(network, sent + 1) == sent + 1
+    _respond(engine, 11, b'\x43\x00\x10\x00\x02\x00\x00\x00')
+    assert second.result(1) == b'\x02\x00\x00\x00'
+
+
+def test_half_open_breaker_lets_one_probe_through(monitor, monkeypatch):
+    monkeypatch.setattr(sdo_engine, 'BREAKER_COOLDOWN', 0.0)
+    network = _Network()
+    engine = SdoEngine(network, heartbeat_monitor=monitor)
+    _lose_heartbeat(monitor, 12)
+    probe = engine.upload(12, 0x1000, 0x00)
+    with pytest.raises(canopen.SdoCommunicationError, match='circuit breaker'):
+        engine.upload(12, 0x1001, 0x00).result(1)
+    assert len(network.sent) == 1
+    _respond(engine, 12, b'\x43\x00\x10\x00\x92\x01\x02\x00')
+    assert probe.result(1) == b'\x92\x01\x02\x00'
+    assert engine.node_stats(12)['breaker'] == 'closed'
+    engine.upload(12, 0x1001, 0x00)
+    assert network.sent[-1] == (0x60C, b'\x40\x01\x10\x00' + bytes(4))
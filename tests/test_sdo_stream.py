@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import io
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+
+from command_registry import CommandError, DaemonContext
+from sdo_engine import SdoEngine
+from sdo_stream import SdoStreams
+
+
+class _Network(object):
+    def __init__(self):
+        self.sent = []
+        self.nodes = {}
+
+    def subscribe(self, can_id, callback):
+        pass
+
+    def send_message(self, can_id, data):
+        self.sent.append((can_id, bytes(data)))
+
+
+class _Raw(io.RawIOBase):
+    # Block reader of an object of size bytes
+    def __init__(self, size):
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.remaining)
+        buffer[:count] = b'\xAA' * count
+        self.remaining -= count
+        return count
+
+
+class _Sdo(object):
+    def open(self, index, subindex, mode, block_transfer=False, size=None):
+        return io.BufferedReader(_Raw(100))
+
+
+class _Node(object):
+    def __init__(self, node_id, network):
+        self.id = node_id
+        self.network = network
+        self.sdo = _Sdo()
+
+
+@pytest.fixture
+def bus():
+    network = _Network()
+    engine = SdoEngine(network)
+    streams = SdoStreams(engine)
+    yield network, engine, streams
+    streams.close_all()
+
+
+def test_active_stream_holds_the_node(bus):
+    network, engine, streams = bus
+    stream = streams.open(_Node(3, network), 0x2000, 0, 'upload')
+    with pytest.raises(canopen.SdoCommunicationError, match='block transfer'):
+        engine.upload(3, 0x1000, 0).result(1)
+    # Other nodes are not affected
+    engine.upload(4, 0x1000, 0)
+    assert network.sent[-1][0] == 0x604
+
+    stream.abort()
+    engine.upload(3, 0x1000, 0)
+    assert network.sent[-1][0] == 0x603
+
+
+def test_finished_stream_releases_the_node(bus):
+    network, engine, streams = bus
+    stream = streams.open(_Node(3, network), 0x2000, 0, 'upload')
+    stream.read(1000)
+    assert stream.state == 'done'
+    engine.upload(3, 0x1000, 0)
+    assert network.sent[-1][0] == 0x603
+
+
+def test_stream_refused_with_engine_transfer_in_flight(bus):
+    network, engine, streams = bus
+    engine.upload(3, 0x1000, 0)
+    with pytest.raises(IOError, match='in flight'):
+        streams.open(_Node(3, network), 0x2000, 0, 'upload')
+    assert streams.streams() == []
+
+
+def test_sdo_commands_rejected_during_stream(bus):
+    network, engine, streams = bus
+    context = DaemonContext(network, sdo_streams=streams)
+    streams.open(_Node(3, network), 0x2000, 0, 'upload')
+    with pytest.raises(CommandError, match='active stream'):
+        context.check_sdo(3)
+    context.check_sdo(4)
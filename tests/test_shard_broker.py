@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+
+import pytest
+
+zmq = pytest.importorskip('zmq')
+
+import wire_protocol
+from shard_broker import ShardBroker
+
+
+@pytest.fixture
+def broker():
+    context = zmq.Context()
+    # Shards exiting right away
+    broker = ShardBroker(context, 'inproc://front', 'inproc://back', 'inproc://stream', 'inproc://stream-back',
+                         ['can0', 'can1'], [sys.executable, '-c', 'pass'])
+    client = context.socket(zmq.DEALER)
+    client.connect('inproc://front')
+    shard = context.socket(zmq.DEALER)
+    shard.setsockopt(zmq.IDENTITY, b'can0')
+    shard.connect('inproc://back')
+    yield broker, client, shard
+    for socket in (client, shard, broker.frontend, broker.backend, broker.stream_frontend, broker.stream_backend):
+        socket.close(linger=0)
+    context.term()
+
+
+def _route(broker, client, frames):
+    client.send_multipart([b''] + frames)
+    broker._route(broker.frontend.recv_multipart(copy=False))
+
+
+def _reply(client):
+    assert client.poll(1000)
+    return wire_protocol.decode_reply(client.recv_multipart()[1:])
+
+
+def test_dead_shard_answers_in_the_request_encoding(broker):
+    broker, client, shard = broker
+    _route(broker, client, wire_protocol.encode_request(
+        'struct', 'sdo_upload', {'node_id': 3, 'index': 0x1000, 'subindex': 0}, wire_protocol.OP_SDO_UPLOAD))
+    assert shard.poll(1000)
+    shard.recv_multipart()
+    broker.shards['can0'].process.wait()
+    broker._check_shards()
+    reply = _reply(client)
+    assert reply['opcode'] == wire_protocol.OP_SDO_UPLOAD
+    assert reply['status'] == wire_protocol.STATUS_ERROR
+    assert b'not running' in reply['payload']
+
+
+def test_struct_request_routed_by_bus_tag(broker):
+    broker, client, shard = broker
+    # can1 has no shard connected - answered by the broker
+    _route(broker, client, wire_protocol.encode_request(
+        'struct', 'can_send_msg', {'can_id': 0x181, 'can_bytes': b'\x01', 'bus': 'can1'}, wire_protocol.OP_CAN_SEND))
+    reply = _reply(client)
+    assert (reply['opcode'], reply['status']) == (wire_protocol.OP_CAN_SEND, wire_protocol.STATUS_ERROR)
+    assert b'can1' in reply['payload']
+
+
+def test_cross_bus_batch_rejected(broker):
+    broker, client, shard = broker
+    commands = [{'cmd': 'sdo_upload', 'parameters': {'node_id': 3, 'bus': 'can1'}}]
+    _route(broker, client, wire_protocol.encode_request('json', 'batch', {'commands': commands}))
+    reply = _reply(client)
+    assert reply['reply_cmd'].startswith('err: batch cannot address bus can1')
+    assert not shard.poll(50)
+
+
+def test_cross_bus_flash_rejected(broker):
+    broker, client, shard = broker
+    _route(broker, client, wire_protocol.encode_request(
+        'json', 'flash_firmware', {'image': 'fw.bin', 'targets': [['can0', 3], ['can1', 4]]}))
+    assert _reply(client)['reply_cmd'].startswith('err: flash_firmware cannot address bus can1')
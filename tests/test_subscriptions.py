@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+canopen = pytest.importorskip('canopen')
+
+from subscriptions import Subscription
+
+
+class _Unsubscribing(Subscription):
+    # The waiter unsubscribes the moment it is woken up - while Network.notify iterates
+    def _on_message(self, can_id, data, timestamp):
+        super(_Unsubscribing, self)._on_message(can_id, data, timestamp)
+        self.unsubscribe()
+
+
+def test_first_message_is_captured():
+    network = canopen.Network()
+    with Subscription(network, 0x123) as subscription:
+        network.notify(0x123, bytearray(b'\x01\x02'), 1.5)
+        network.notify(0x123, bytearray(b'\x03'), 2.5)
+        assert subscription.wait(0)
+    assert (subscription.msg_id, subscription.msg_data, subscription.msg_timestamp) == (0x123, [1, 2], 1.5)
+    assert 0x123 not in network.subscribers
+
+
+def test_unsubscribe_during_notify_does_not_skip_others():
+    network = canopen.Network()
+    first = _Unsubscribing(network, 0x123)
+    second = Subscription(network, 0x123)
+    first.subscribe()
+    second.subscribe()
+    network.notify(0x123, bytearray(b'\x01'), 0.0)
+    assert first.received and second.received
+    assert network.subscribers[0x123] == [second._on_message]
+
+
+def test_unsubscribe_keeps_other_callbacks():
+    network = canopen.Network()
+    received = []
+    network.subscribe(0x123, lambda can_id, data, timestamp: received.append(can_id))
+    subscription = Subscription(network, 0x123)
+    subscription.subscribe()
+    subscription.subscribe()
+    assert len(network.subscribers[0x123]) == 2
+    subscription.unsubscribe()
+    network.notify(0x123, bytearray(), 0.0)
+    assert received == [0x123] and not subscription.received
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import pytest
+
+can = pytest.importorskip('can')
+
+import sync_producer
+from sync_producer import SyncProducer, _IntervalStats
+
+
+class _Network(object):
+    # Records the send times, optionally failing or stalling
+    def __init__(self, fail=False, stall=None):
+        self.sent = []
+        self.fail = fail
+        self.stall = stall
+
+    def send_message(self, can_id, data):
+        if self.fail:
+            raise can.CanError('bus off')
+        self.sent.append(time.perf_counter())
+        if self.stall is not None and len(self.sent) == 5:
+            time.sleep(self.stall)
+
+
+@pytest.fixture
+def producer():
+    producers = []
+
+    def create(network):
+        producers.append(SyncProducer(network, 'virtual'))
+        return producers[-1]
+    yield create
+    for producer in producers:
+        producer.stop()
+
+
+def test_interval_stats_overruns():
+    stats = _IntervalStats(0.01)
+    for timestamp in (0.0, 0.01, 0.02, 0.04, 0.05):
+        stats.add(timestamp)
+    report = stats.report()
+    assert (report['count'], report['samples'], report['overruns']) == (5, 4, 1)
+    assert report['max_ms'] == pytest.approx(20.0)
+
+
+def test_thread_schedule_does_not_drift(producer):
+    network = _Network()
+    sync = producer(network)
+    assert sync.start(0.005, 'thread') == 'thread'
+    time.sleep(0.3)
+    sync.stop()
+    sent = network.sent
+    assert len(sent) >= 40
+    # Every frame is due at start + n * period - single late frames do not shift the rest
+    phases = sorted(abs((t - sent[0]) / 0.005 - round((t - sent[0]) / 0.005)) for t in sent)
+    assert phases[len(phases) // 2] < 0.2
+    assert len(sent) + sync.missed == pytest.approx(round((sent[-1] - sent[0]) / 0.005) + 1, abs=1)
+    assert sync.stats()['tx']['count'] == len(sent)
+
+
+def test_late_slots_are_skipped(producer):
+    network = _Network(stall=0.0275)
+    sync = producer(network)
+    sync.start(0.005, 'thread')
+    time.sleep(0.1)
+    sync.stop()
+    # The stall of 5.5 periods is not caught up with a burst of frames
+    assert sync.missed >= 4
+    assert sync.stats()['tx']['overruns'] >= 1
+    # A burst would put ~6 frames right after the stall
+    stalled = network.sent[4]
+    assert len([t for t in network.sent if stalled <= t <= stalled + 0.0275 + 0.005]) <= 3
+
+
+def test_send_errors_are_counted(producer):
+    sync = producer(_Network(fail=True))
+    sync.start(0.005, 'thread')
+    time.sleep(0.05)
+    stats = sync.stats()
+    assert stats['running'] and stats['errors'] >= 5
+    assert stats['last_error'] == 'bus off'
+    sync.stop()
+    assert not sync.stats()['running']
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_running_cleared_when_the_thread_ends(producer, monkeypatch):
+    sync = producer(_Network())
+
+    def crash():
+        raise RuntimeError('crashed')
+    monkeypatch.setattr(sync, '_loop', crash)
+    sync.start(0.005, 'thread')
+    sync._thread.join(1)
+    assert not sync.stats()['running']
+
+
+def test_bcm_needs_socketcan(producer):
+    with pytest.raises(ValueError):
+        producer(_Network()).start(0.005, 'bcm')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+import timeseries_export
+
+
+def test_safe_name_replaces_unsafe_characters():
+    assert timeseries_export.safe_name('run 1/../x') == 'run_1_.._x'
+    assert timeseries_export.safe_name('.hidden') == '.hidden'
+
+
+@pytest.mark.parametrize('name', ['.', '..', '...'])
+def test_safe_name_rejects_dots_only(name):
+    with pytest.raises(ValueError):
+        timeseries_export.safe_name(name)
+
+
+def _frames():
+    return {'can_id': [0x181, 0x281], 'timestamp': [1.0, 1.5], 'data': [b'\x01\x02', b'']}
+
+
+def test_frame_columns():
+    columns = {column.name: column for column in timeseries_export.frame_columns(_frames())}
+    assert sorted(columns) == ['can_id', 'data', 'dlc', 'timestamp']
+    assert columns['data'].shape == (2, 8)
+    assert columns['data'].data == b'\x01\x02' + bytes(14)
+    assert columns['dlc'].data == b'\x02\x00'
+
+
+def test_npy_header_alignment():
+    header = timeseries_export.npy_header(timeseries_export.Column('x', '<f8', (3,), bytes(24)))
+    assert header.startswith(timeseries_export.NPY_MAGIC)
+    assert len(header) % timeseries_export.NPY_ALIGNMENT == 0
+    assert header.endswith(b'\n')
+
+
+def test_export_files_load_with_numpy(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    files = timeseries_export.export_files(str(tmp_path / 'run'), timeseries_export.frame_columns(_frames()))
+    assert numpy.load(files['timestamp']['file']).tolist() == [1.0, 1.5]
+    assert numpy.load(files['can_id']['file']).tolist() == [0x181, 0x281]
+    data = numpy.load(files['data']['file'], mmap_mode='r')
+    assert data.shape == (2, 8) and data[0, :2].tolist() == [1, 2]
+
+
+def test_signal_columns_and_binary_export():
+    pytest.importorskip('canopen')
+    import pdo_decoder
+    decoder = pdo_decoder.PdoDecoder(0x183, [(0x6000, 1), (0x6000, 2)], '<hB')
+    columns, skipped = decoder.decode_batch([b'\xFF\xFF\x07', b'\x01\x00\x08'])
+    exported = timeseries_export.export_binary(timeseries_export.signal_columns([1.0, 2.0], decoder, columns))
+    assert sorted(exported) == ['6000_01', '6000_02', 'timestamp']
+    assert exported['6000_01']['dtype'] == '<i2' and exported['6000_01']['data'] == b'\xFF\xFF\x01\x00'
+    assert exported['6000_02'] == {'dtype': '|u1', 'shape': [2], 'data': b'\x07\x08'}
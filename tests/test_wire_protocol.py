@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+zmq = pytest.importorskip('zmq')
+
+import wire_protocol
+
+
+def _decode(frames):
+    # Request as received by the daemon (zmq.Frame)
+    frames = [zmq.Frame(bytes(frame)) for frame in frames]
+    encoding = wire_protocol.request_encoding(frames)
+    return (encoding,) + wire_protocol.decode_request(encoding, frames)
+
+
+def test_json_round_trip():
+    frames = wire_protocol.encode_request('json', 'sdo_upload', {'node_id': 3, 'index': 0x1008})
+    assert _decode(frames) == ('json', 'sdo_upload', {'node_id': 3, 'index': 0x1008}, None)
+    reply = wire_protocol.encode_reply('json', 'sdo_upload', {'value': b'\x01\x02'})
+    # bytes travel as list of byte values
+    assert wire_protocol.decode_reply(reply) == {'reply_cmd': 'sdo_upload', 'reply_parameters': {'value': [1, 2]}}
+
+
+def test_json_without_cmd():
+    assert _decode([b'{"parameters": {}}']) == ('json', '', {}, None)
+
+
+def test_msgpack_round_trip_with_attachments():
+    pytest.importorskip('msgpack')
+    large = bytes(range(256)) * 8
+    parameters = {'node_id': 3, 'small': b'\x01\x02', 'chunks': [large, b'\x03']}
+    frames = wire_protocol.encode_request('msgpack', 'sdo_stream_write', parameters)
+    # The large value travels as a separate frame
+    assert frames[0] == wire_protocol.MSGPACK_TAG
+    assert len(frames) == 3 and bytes(frames[2]) == large
+    encoding, cmd, decoded, opcode = _decode(frames)
+    assert (encoding, cmd, opcode) == ('msgpack', 'sdo_stream_write', None)
+    assert bytes(decoded['chunks'][0]) == large
+    assert decoded['small'] == b'\x01\x02' and decoded['chunks'][1] == b'\x03'
+
+    reply = wire_protocol.encode_reply('msgpack', 'sdo_stream_read', {'data': memoryview(large), 'eof': True})
+    assert len(reply) == 3
+    decoded = wire_protocol.decode_reply([bytes(frame) for frame in reply])
+    assert decoded['reply_parameters'] == {'data': large, 'eof': True}
+
+
+@pytest.mark.parametrize('opcode, parameters', [
+    (wire_protocol.OP_SDO_UPLOAD, {'node_id': 3, 'index': 0x6011, 'subindex': 1}),
+    (wire_protocol.OP_SDO_DOWNLOAD, {'node_id': 3, 'index': 0x6011, 'subindex': 2, 'data': b'\x4D\x3C'}),
+    (wire_protocol.OP_CAN_SEND, {'can_id': 0x18FF0001, 'can_bytes': b'\x01\x02\x03'}),
+    (wire_protocol.OP_SDO_STREAM_WRITE, {'stream_id': 7, 'data': b'\xAA' * 2000}),
+    (wire_protocol.OP_SDO_STREAM_READ, {'stream_id': 7, 'size': 65536}),
+])
+def test_struct_round_trip(opcode, parameters):
+    cmd = wire_protocol.STRUCT_OPS[opcode][0]
+    encoding, decoded_cmd, decoded, decoded_opcode = _decode(
+        wire_protocol.encode_request('struct', cmd, parameters, opcode))
+    assert (encoding, decoded_cmd, decoded_opcode) == ('struct', cmd, opcode)
+    assert decoded.pop('raw') is True
+    assert {name: bytes(value) if isinstance(value, memoryview) else value
+            for name, value in decoded.items()} == parameters
+
+
+def test_struct_round_trip_with_bus():
+    parameters = {'node_id': 3, 'index': 0x1000, 'subindex': 0, 'bus': 'can1'}
+    frames = wire_protocol.encode_request('struct', 'sdo_upload', parameters, wire_protocol.OP_SDO_UPLOAD)
+    assert frames[:2] == [wire_protocol.STRUCT_BUS_TAG, b'can1']
+    encoding, cmd, decoded, opcode = _decode(frames)
+    assert decoded['bus'] == 'can1' and decoded['index'] == 0x1000
+    zmq_frames = [zmq.Frame(frame) for frame in frames]
+    assert wire_protocol.struct_bus(zmq_frames) == 'can1'
+    assert wire_protocol.struct_opcode(zmq_frames) == wire_protocol.OP_SDO_UPLOAD
+
+
+def test_struct_replies():
+    reply = wire_protocol.encode_reply('struct', 'sdo_upload', {'value': b'\x92\x01'}, wire_protocol.OP_SDO_UPLOAD)
+    assert wire_protocol.decode_reply(reply) == {'opcode': wire_protocol.OP_SDO_UPLOAD,
+                                                 'status': wire_protocol.STATUS_OK, 'payload': b'\x92\x01'}
+    reply = wire_protocol.encode_reply('struct', 'err: node 0x03 has not been added', {},
+                                       wire_protocol.OP_SDO_DOWNLOAD)
+    assert wire_protocol.decode_reply(reply) == {'opcode': wire_protocol.OP_SDO_DOWNLOAD,
+                                                 'status': wire_protocol.STATUS_ERROR,
+                                                 'payload': b'err: node 0x03 has not been added'}
+
+
+def test_struct_unknown_opcode():
+    with pytest.raises(ValueError):
+        _decode([wire_protocol.STRUCT_TAG, b'\x63'])